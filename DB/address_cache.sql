@@ -0,0 +1,196 @@
+-- ============================================
+-- address_cache: мемоизация get_house_id_by_address
+-- ============================================
+--
+-- Один и тот же адрес Cian/Avito разбирается многократно (process_cian_ads,
+-- process_avito_ads, ReportPipeline, find_nearby_apartments). Результат
+-- сохраняется по нормализованному адресу вместе с версиями резолвера и FIAS.
+-- Записи другой версии считаются промахом и перезаписываются.
+--
+-- Попадания и промахи считаются sequence-счётчиками (address_cache_count), а не
+-- UPDATE строки кэша: чтение из кэша не берёт блокировку строки, не пишет WAL и не
+-- оставляет мёртвых версий, а в read-only транзакциях и на репликах функция работает
+-- без записи (промах разбирается, но не сохраняется).
+--
+-- После загрузки новых данных FIAS:
+--     SELECT public.address_cache_bump_fias_version();
+-- После изменения parse_address / find_parentobjids_by_parsed / parse_and_find_house:
+--     SELECT public.address_cache_bump_resolver_version('sql-2');
+
+CREATE TABLE IF NOT EXISTS public.address_cache_meta (
+    id               boolean PRIMARY KEY DEFAULT TRUE CHECK (id),
+    resolver_version text NOT NULL,
+    fias_version     text NOT NULL,
+    updated_at       timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.address_cache_meta (id, resolver_version, fias_version)
+VALUES (TRUE, 'sql-1', to_char(now(), 'YYYYMMDDHH24MISS'))
+ON CONFLICT (id) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS public.address_cache (
+    normalized_address text PRIMARY KEY,
+    house_id           integer,
+    street_found       boolean,
+    house_part         text,
+    resolver_version   text NOT NULL,
+    fias_version       text NOT NULL,
+    resolved_at        timestamptz NOT NULL DEFAULT now(),
+    -- Кто разобрал адрес: resolver_version SQL-функции или RESOLVER_VERSION
+    -- in-process резолвера (server/address_resolver.py, «py-1»)
+    resolved_by        text
+);
+
+CREATE INDEX IF NOT EXISTS address_cache_house_id_idx ON public.address_cache (house_id);
+
+-- nextval не транзакционен и не блокирует строк; сбрасываются при смене версий
+CREATE SEQUENCE IF NOT EXISTS public.address_cache_hits_seq;
+CREATE SEQUENCE IF NOT EXISTS public.address_cache_misses_seq;
+
+
+CREATE OR REPLACE FUNCTION public.address_cache_count(p_hits bigint, p_misses bigint)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- nextval запрещён в read-only транзакциях и на репликах — там статистика не ведётся
+    IF current_setting('transaction_read_only') = 'on' THEN
+        RETURN;
+    END IF;
+    IF p_hits > 0 THEN
+        PERFORM nextval('public.address_cache_hits_seq') FROM generate_series(1, p_hits);
+    END IF;
+    IF p_misses > 0 THEN
+        PERFORM nextval('public.address_cache_misses_seq') FROM generate_series(1, p_misses);
+    END IF;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.address_cache_reset_counters()
+RETURNS void
+LANGUAGE sql
+AS $$
+    SELECT setval('public.address_cache_hits_seq', 1, false);
+    SELECT setval('public.address_cache_misses_seq', 1, false);
+$$;
+
+
+-- Ключ кэша: только то, что не влияет на разбор (пробелы, пробелы вокруг запятых).
+-- Регистр сохраняем: parse_address сравнивает алиасы с учётом регистра.
+CREATE OR REPLACE FUNCTION public.normalize_address_key(p_address text)
+RETURNS text
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT NULLIF(
+        regexp_replace(
+            regexp_replace(btrim(p_address), '\s*,\s*', ', ', 'g'),
+            '\s+', ' ', 'g'
+        ),
+        ''
+    );
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.get_house_id_by_address_cached(p_address text)
+RETURNS TABLE(result_id integer, street_found boolean, house_part text)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    v_key     text := public.normalize_address_key(p_address);
+    v_meta    public.address_cache_meta%ROWTYPE;
+    v_cached  public.address_cache%ROWTYPE;
+    v_id      integer;
+    v_found   boolean;
+    v_part    text;
+BEGIN
+    IF v_key IS NULL THEN
+        RETURN QUERY SELECT NULL::integer, FALSE, NULL::text;
+        RETURN;
+    END IF;
+
+    SELECT * INTO v_meta FROM public.address_cache_meta WHERE id;
+
+    SELECT * INTO v_cached
+      FROM public.address_cache c
+     WHERE c.normalized_address = v_key
+       AND c.resolver_version = v_meta.resolver_version
+       AND c.fias_version = v_meta.fias_version;
+
+    IF FOUND THEN
+        PERFORM public.address_cache_count(1, 0);
+        RETURN QUERY SELECT v_cached.house_id, v_cached.street_found, v_cached.house_part;
+        RETURN;
+    END IF;
+
+    SELECT r.result_id, r.street_found, r.house_part
+      INTO v_id, v_found, v_part
+      FROM public.get_house_id_by_address(p_address) r
+     LIMIT 1;
+
+    PERFORM public.address_cache_count(0, 1);
+    -- На реплике / в read-only транзакции результат просто не кэшируется
+    IF current_setting('transaction_read_only') = 'off' THEN
+        INSERT INTO public.address_cache AS c (
+            normalized_address, house_id, street_found, house_part,
+            resolver_version, fias_version, resolved_at, resolved_by
+        )
+        VALUES (v_key, v_id, v_found, v_part, v_meta.resolver_version, v_meta.fias_version, now(),
+                v_meta.resolver_version)
+        ON CONFLICT (normalized_address) DO UPDATE
+           SET house_id = EXCLUDED.house_id,
+               street_found = EXCLUDED.street_found,
+               house_part = EXCLUDED.house_part,
+               resolver_version = EXCLUDED.resolver_version,
+               fias_version = EXCLUDED.fias_version,
+               resolved_at = EXCLUDED.resolved_at,
+               resolved_by = EXCLUDED.resolved_by;
+    END IF;
+
+    RETURN QUERY SELECT v_id, COALESCE(v_found, FALSE), v_part;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.address_cache_bump_fias_version(p_version text DEFAULT NULL)
+RETURNS text
+LANGUAGE sql
+AS $$
+    SELECT public.address_cache_reset_counters();
+    UPDATE public.address_cache_meta
+       SET fias_version = COALESCE(p_version, to_char(now(), 'YYYYMMDDHH24MISS')),
+           updated_at = now()
+     WHERE id
+    RETURNING fias_version;
+$$;
+
+
+CREATE OR REPLACE FUNCTION public.address_cache_bump_resolver_version(p_version text)
+RETURNS text
+LANGUAGE sql
+AS $$
+    SELECT public.address_cache_reset_counters();
+    UPDATE public.address_cache_meta
+       SET resolver_version = p_version,
+           updated_at = now()
+     WHERE id
+    RETURNING resolver_version;
+$$;
+
+
+-- Устаревшие записи не мешают (не совпадает версия), но занимают место
+CREATE OR REPLACE FUNCTION public.address_cache_purge_stale()
+RETURNS bigint
+LANGUAGE sql
+AS $$
+    WITH deleted AS (
+        DELETE FROM public.address_cache c
+         USING public.address_cache_meta m
+         WHERE m.id
+           AND (c.resolver_version <> m.resolver_version OR c.fias_version <> m.fias_version)
+        RETURNING 1
+    )
+    SELECT count(*) FROM deleted;
+$$;
@@ -0,0 +1,109 @@
+-- ============================================
+-- Индексы для поиска улиц FIAS без последовательного сканирования
+-- ============================================
+--
+-- find_parentobjids_by_parsed ищет улицы условием norm_name ILIKE '%слово%'.
+-- Ведущий '%' не работает с btree, поэтому каждый разбор адреса читал
+-- public.fias_objects целиком. GIN-индекс pg_trgm обслуживает ILIKE и ~*
+-- с произвольной позицией подстроки (BitmapOr по словам адреса).
+--
+-- Применение (индексы строятся без блокировки записи, вне транзакции):
+--     psql "$DATABASE_URL" -f DB/fias_trgm_indexes.sql
+-- Проверка: python server/fias_street_benchmark.py --sample 300
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS fias_objects_norm_name_trgm_idx
+    ON public.fias_objects USING gin (norm_name gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS fias_objects_typename_parent_idx
+    ON public.fias_objects (typename, parent_objectid);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS fias_houses_parent_housenum_idx
+    ON public.fias_houses (parentobjid, upper(housenum));
+
+ANALYZE public.fias_objects;
+ANALYZE public.fias_houses;
+
+
+-- Та же логика, что и раньше, но запрос строится с параметрами (EXECUTE ... USING)
+-- и в виде, который планировщик может отдать trigram-индексу:
+--   * слова улицы — OR из norm_name ILIKE '%w%' (BitmapOr по GIN);
+--   * «большой/малый» и номер — регулярные выражения ~*, тоже через GIN;
+--   * спецсимволы LIKE ('%', '_', '\') в словах экранируются.
+CREATE OR REPLACE FUNCTION public.find_parentobjids_by_parsed(street_type text, norm_name_val text, town_objid integer DEFAULT NULL::integer) RETURNS integer[]
+    LANGUAGE plpgsql STABLE
+    AS $_$
+DECLARE
+    result_ids      INT[];
+    tokens          text[];
+    w               text;
+    word_filters    text[] := '{}';
+    want_big        boolean := false;
+    want_small      boolean := false;
+    num_clean       text := NULL;
+    num_pattern     text := NULL;
+    big_variants    text[] := ARRAY['большой','большая','большое','большие','б.'];
+    small_variants  text[] := ARRAY['малый','малая','малое','малые','м.'];
+    big_pattern     text := '(большой|большая|большое|большие|б\.)';
+    small_pattern   text := '(малый|малая|малое|малые|м\.)';
+    sql             text;
+BEGIN
+    -- проверка родителя
+    IF town_objid IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM public.fias_objects WHERE objectid = town_objid
+    ) THEN
+        RAISE NOTICE 'Parent objectid % not found', town_objid;
+        RETURN '{}';
+    END IF;
+
+    -- разбиваем вход
+    tokens := regexp_split_to_array(coalesce(norm_name_val, ''), '\s+');
+
+    -- классифицируем токены
+    FOREACH w IN ARRAY tokens LOOP
+        IF w ~ '\d' THEN
+            -- сохраняем только цифры для фильтрации по номеру
+            num_clean   := regexp_replace(w, '\D', '', 'g');
+            num_pattern := format('(?:^| )%s[^ ]*(?: |$)', num_clean);
+        ELSIF lower(w) = ANY(big_variants) THEN
+            want_big := true;
+        ELSIF lower(w) = ANY(small_variants) THEN
+            want_small := true;
+        ELSE
+            -- всё остальное — существенные слова
+            word_filters := array_append(
+                word_filters,
+                format('f.norm_name ILIKE %L',
+                       '%' || replace(replace(replace(lower(w), '\', '\\'), '%', '\%'), '_', '\_') || '%')
+            );
+        END IF;
+    END LOOP;
+
+    sql := 'SELECT array_agg(f.objectid) FROM public.fias_objects f WHERE TRUE';
+    IF array_length(word_filters, 1) > 0 THEN
+        sql := sql || ' AND (' || array_to_string(word_filters, ' OR ') || ')';
+    END IF;
+    IF want_big THEN
+        sql := sql || ' AND f.norm_name ~* $1';
+    END IF;
+    IF want_small THEN
+        sql := sql || ' AND f.norm_name ~* $2';
+    END IF;
+    IF num_clean IS NOT NULL THEN
+        sql := sql || ' AND f.norm_name ~* $3';
+    END IF;
+
+    -- тип и родитель
+    IF street_type IS NOT NULL THEN
+        sql := sql || ' AND f.typename = $4';
+    END IF;
+    IF town_objid IS NOT NULL THEN
+        sql := sql || ' AND f.parent_objectid = $5';
+    END IF;
+
+    EXECUTE sql INTO result_ids
+        USING big_pattern, small_pattern, num_pattern, street_type, town_objid;
+    RETURN COALESCE(result_ids, '{}');
+END;
+$_$;
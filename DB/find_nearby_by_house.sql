@@ -0,0 +1,190 @@
+-- ============================================
+-- find_nearby_apartments_by_house: поиск конкурентов по уже известному house_id
+-- ============================================
+--
+-- find_nearby_apartments(p_address, ...) повторно разбирал адрес, хотя
+-- ReportPipeline к этому моменту уже знает house_id, и ранжировал источники
+-- через url LIKE '%cian.ru%' для каждой строки. Ранг источника теперь хранится
+-- в flats_history.source_rank, а выборка по соседним домам идёт по индексу
+-- (house_id, is_actual, rooms, price).
+--
+-- source_rank — обычный nullable-столбец: ADD COLUMN без DEFAULT меняет только
+-- каталог и не перезаписывает flats_history (generated STORED держал бы ACCESS
+-- EXCLUSIVE на всё время перезаписи). Новые строки и смену url заполняет триггер,
+-- старые — flats_history_backfill_source_rank пачками по id с COMMIT после каждой;
+-- пока заполнение не закончено, запрос вычисляет ранг для строк с NULL на лету.
+--
+-- Применение (вне транзакции: процедура заполнения делает COMMIT, индекс строится
+-- без блокировки записи):
+--     psql "$DATABASE_URL" -f DB/find_nearby_by_house.sql
+-- Если заполнение прервано, его можно продолжить:
+--     CALL public.flats_history_backfill_source_rank(50000);
+
+-- Короткая ACCESS EXCLUSIVE только на изменение каталога; не ждём за долгими запросами
+SET lock_timeout = '5s';
+ALTER TABLE public.flats_history ADD COLUMN IF NOT EXISTS source_rank smallint;
+RESET lock_timeout;
+
+
+-- Ранг источника объявления: 1 — Cian, 2 — Яндекс, 3 — остальные
+CREATE OR REPLACE FUNCTION public.flats_source_rank(p_url text)
+RETURNS smallint
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT (CASE
+        WHEN p_url LIKE '%cian.ru%' THEN 1
+        WHEN p_url LIKE '%yandex.ru%' THEN 2
+        ELSE 3
+    END)::smallint;
+$$;
+
+CREATE OR REPLACE FUNCTION public.flats_history_set_source_rank()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.source_rank := public.flats_source_rank(NEW.url);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS flats_history_source_rank ON public.flats_history;
+CREATE TRIGGER flats_history_source_rank
+    BEFORE INSERT OR UPDATE OF url ON public.flats_history
+    FOR EACH ROW EXECUTE FUNCTION public.flats_history_set_source_rank();
+
+
+-- Заполняет source_rank у существующих строк диапазонами id по p_batch_size,
+-- каждая пачка — отдельная транзакция (короткие блокировки строк, VACUUM успевает)
+CREATE OR REPLACE PROCEDURE public.flats_history_backfill_source_rank(p_batch_size integer DEFAULT 50000)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_from    bigint;
+    v_max     bigint;
+    v_updated bigint;
+    v_total   bigint := 0;
+BEGIN
+    SELECT min(id), max(id) INTO v_from, v_max
+    FROM public.flats_history
+    WHERE source_rank IS NULL;
+
+    WHILE v_from <= v_max LOOP
+        UPDATE public.flats_history
+           SET source_rank = public.flats_source_rank(url)
+         WHERE id >= v_from
+           AND id < v_from + p_batch_size
+           AND source_rank IS NULL;
+        GET DIAGNOSTICS v_updated = ROW_COUNT;
+        v_total := v_total + v_updated;
+        COMMIT;
+        v_from := v_from + p_batch_size;
+    END LOOP;
+
+    RAISE NOTICE 'source_rank заполнен у % строк flats_history', v_total;
+END;
+$$;
+
+CALL public.flats_history_backfill_source_rank(50000);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_history_house_actual_rooms_price_idx
+    ON public.flats_history (house_id, is_actual, rooms, price);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_house_rooms_floor_idx
+    ON public.flats (house_id, rooms, floor);
+
+
+CREATE OR REPLACE FUNCTION public.find_nearby_apartments_by_house(
+    p_house_id      integer,
+    p_rooms         integer,
+    p_current_price bigint,
+    p_area          real DEFAULT NULL::real,
+    p_kitchen_area  real DEFAULT NULL::real,
+    p_radius        integer DEFAULT 500
+) RETURNS TABLE(price bigint, floor smallint, rooms smallint, person_type text, created timestamp without time zone, updated timestamp without time zone, url text, is_active boolean, house_id integer, distance_m integer, area numeric, kitchen_area numeric)
+    LANGUAGE sql STABLE
+    AS $$
+    WITH near AS (
+        SELECT nh.house_id, min(nh.dist_m) AS dist_m
+        FROM public.get_house_near_house(p_house_id, p_radius) nh
+        GROUP BY nh.house_id
+    ),
+    candidates AS (
+        SELECT DISTINCT ON (h.price, h.rooms, h.floor)
+            h.price,
+            h.floor,
+            h.rooms,
+            h.person_type_id,
+            h.time_source_created,
+            h.time_source_updated,
+            h.url,
+            h.is_actual,
+            h.house_id,
+            near.dist_m,
+            f.area,
+            f.kitchen_area
+        FROM near
+        JOIN public.flats_history h
+          ON h.house_id = near.house_id
+         AND h.is_actual <> 0
+         AND h.rooms >= p_rooms
+         AND h.price < p_current_price
+        LEFT JOIN public.flats f
+          ON f.house_id = h.house_id AND f.rooms = h.rooms AND f.floor = h.floor
+        WHERE (p_area IS NULL OR f.area IS NULL OR f.area >= COALESCE(p_area * 0.95, 0))
+          AND (p_kitchen_area IS NULL OR f.kitchen_area IS NULL OR f.kitchen_area >= COALESCE(p_kitchen_area * 0.9, 0))
+        ORDER BY h.price, h.rooms, h.floor,
+                 COALESCE(h.source_rank, public.flats_source_rank(h.url)), h.time_source_updated DESC
+    )
+    SELECT
+        c.price,
+        c.floor,
+        c.rooms,
+        CASE c.person_type_id
+            WHEN 3 THEN 'собственник'
+            WHEN 2 THEN 'агентство'
+            ELSE 'неизвестно'
+        END,
+        c.time_source_created::timestamp AS created,
+        c.time_source_updated AS updated,
+        c.url,
+        (c.is_actual <> 0) AS is_active,
+        c.house_id,
+        c.dist_m,
+        c.area,
+        c.kitchen_area
+    FROM candidates c
+    ORDER BY c.price, c.rooms, c.floor
+    LIMIT 20;
+$$;
+
+
+-- Прежняя сигнатура по адресу остаётся для внешних вызовов: один разбор адреса
+-- (через кэш address_cache) и дальше — вариант по house_id.
+CREATE OR REPLACE FUNCTION public.find_nearby_apartments(p_address text, p_rooms integer, p_current_price bigint, p_area real DEFAULT NULL::real, p_kitchen_area real DEFAULT NULL::real, p_radius integer DEFAULT 500) RETURNS TABLE(price bigint, floor smallint, rooms smallint, person_type text, created timestamp without time zone, updated timestamp without time zone, url text, is_active boolean, house_id integer, distance_m integer, area numeric, kitchen_area numeric)
+    LANGUAGE plpgsql
+    AS $$
+DECLARE
+    v_house_id INT;
+BEGIN
+    IF to_regproc('public.get_house_id_by_address_cached') IS NOT NULL THEN
+        SELECT r.result_id INTO v_house_id
+        FROM public.get_house_id_by_address_cached(p_address) r
+        LIMIT 1;
+    ELSE
+        SELECT r.result_id INTO v_house_id
+        FROM public.get_house_id_by_address(p_address) r
+        LIMIT 1;
+    END IF;
+
+    IF v_house_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    SELECT * FROM public.find_nearby_apartments_by_house(
+        v_house_id, p_rooms, p_current_price, p_area, p_kitchen_area, p_radius
+    );
+END;
+$$;
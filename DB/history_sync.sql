@@ -0,0 +1,176 @@
+-- ============================================
+-- sync_ads_to_public_history: пакетная синхронизация flats_history
+-- ============================================
+--
+-- history_sync.sync_ad_to_public_history вызывался на каждое объявление и делал
+-- до двух SELECT для поиска записи, затем UPDATE или INSERT и, при изменении цены
+-- или статуса, INSERT в flats_changes — 3-4 обращения к серверу на объявление.
+-- Функция принимает JSONB-массив снимков объявлений и выполняет то же самое за
+-- один вызов. Снимки обрабатываются по порядку, поэтому повторы одного объявления
+-- в пачке ведут себя так же, как последовательные вызовы.
+--
+-- Снимок: {"url", "house_id", "floor", "rooms", "price", "is_actual",
+--          "description", "address", "ts"}; отсутствующие/NULL поля не меняются.
+-- Возвращает (ord, history_id): ord — индекс снимка в массиве (с 0),
+-- history_id — id в flats_history (NULL, если запись не создана).
+--
+-- Применение:
+--     psql "$DATABASE_URL" -f DB/history_sync.sql
+-- Вызов из Python: history_sync.sync_ads_to_public_history(cursor, rows)
+
+CREATE OR REPLACE FUNCTION public.sync_ads_to_public_history(p_snapshots jsonb)
+RETURNS TABLE(ord integer, history_id bigint)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+DECLARE
+    s              jsonb;
+    v_ord          integer := -1;
+    v_new          public.flats_history;
+    v_ts           timestamptz;
+    v_desc         text;
+    v_found        boolean;
+    v_existing     record;
+    v_payload      jsonb;
+    v_cols         text;
+    v_vals         text;
+    v_hist_cols    text[];
+    v_change_cols  text[];
+BEGIN
+    SELECT array_agg(a.attname::text) INTO v_hist_cols
+    FROM pg_attribute a
+    WHERE a.attrelid = 'public.flats_history'::regclass
+      AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = '';
+
+    IF to_regclass('public.flats_changes') IS NOT NULL THEN
+        SELECT array_agg(a.attname::text) INTO v_change_cols
+        FROM pg_attribute a
+        WHERE a.attrelid = 'public.flats_changes'::regclass
+          AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = '';
+    END IF;
+
+    FOR s IN SELECT e.value FROM jsonb_array_elements(COALESCE(p_snapshots, '[]'::jsonb)) AS e(value) LOOP
+        v_ord := v_ord + 1;
+        ord := v_ord;
+        history_id := NULL;
+
+        -- Числа могут прийти как 12500000.0 (Decimal(str(float))): ввод bigint такое
+        -- не принимает, поэтому целочисленные поля приводятся через numeric, как
+        -- присваивание numeric-параметра в построчной версии.
+        s := s || jsonb_strip_nulls(jsonb_build_object(
+            'price',    round((s->>'price')::numeric),
+            'floor',    round((s->>'floor')::numeric),
+            'rooms',    round((s->>'rooms')::numeric),
+            'house_id', round((s->>'house_id')::numeric)
+        ));
+
+        v_new  := jsonb_populate_record(NULL::public.flats_history, s);
+        v_ts   := COALESCE((s->>'ts')::timestamptz, now());
+        v_desc := s->>'description';
+
+        ------------------------------------------------------------
+        -- 1. Поиск записи: по url, затем по (house_id, floor, rooms)
+        ------------------------------------------------------------
+        v_found := FALSE;
+        IF v_new.url IS NOT NULL THEN
+            SELECT fh.id, fh.price, fh.is_actual, fh.time_source_created INTO v_existing
+            FROM public.flats_history fh
+            WHERE fh.url = v_new.url
+            ORDER BY fh.time_source_updated DESC NULLS LAST
+            LIMIT 1;
+            v_found := FOUND;
+        END IF;
+        IF NOT v_found
+           AND v_new.house_id IS NOT NULL AND v_new.floor IS NOT NULL AND v_new.rooms IS NOT NULL
+        THEN
+            SELECT fh.id, fh.price, fh.is_actual, fh.time_source_created INTO v_existing
+            FROM public.flats_history fh
+            WHERE fh.house_id = v_new.house_id
+              AND fh.floor = v_new.floor
+              AND fh.rooms = v_new.rooms
+            ORDER BY fh.time_source_updated DESC NULLS LAST
+            LIMIT 1;
+            v_found := FOUND;
+        END IF;
+
+        IF v_found THEN
+            ------------------------------------------------------------
+            -- 2. Снимок прежних значений в flats_changes
+            ------------------------------------------------------------
+            IF v_change_cols IS NOT NULL
+               AND ((v_new.price IS NOT NULL AND v_existing.price IS DISTINCT FROM v_new.price)
+                    OR (v_new.is_actual IS NOT NULL AND v_existing.is_actual IS DISTINCT FROM v_new.is_actual))
+               AND (v_existing.price IS NOT NULL OR v_existing.is_actual IS NOT NULL)
+            THEN
+                v_payload := jsonb_strip_nulls(jsonb_build_object(
+                    'flats_history_id', v_existing.id,
+                    'price', v_existing.price,
+                    'is_actual', v_existing.is_actual,
+                    'description', v_desc
+                ));
+                SELECT string_agg(quote_ident(k), ', '), string_agg(format('($1).%I', k), ', ')
+                  INTO v_cols, v_vals
+                  FROM jsonb_object_keys(v_payload) AS k
+                 WHERE k = ANY(v_change_cols);
+                IF 'updated' = ANY(v_change_cols) THEN
+                    v_cols := concat_ws(', ', v_cols, 'updated');
+                    v_vals := concat_ws(', ', v_vals, '$2');
+                END IF;
+                IF v_cols IS NOT NULL THEN
+                    EXECUTE format('INSERT INTO public.flats_changes (%s) VALUES (%s)', v_cols, v_vals)
+                        USING jsonb_populate_record(NULL::public.flats_changes, v_payload), v_ts;
+                END IF;
+            END IF;
+
+            ------------------------------------------------------------
+            -- 3. Обновление текущего состояния
+            ------------------------------------------------------------
+            -- Ключ секционирования (DB/partition_flats_history.sql) рядом с id — иначе
+            -- UPDATE проверяет индекс каждой месячной секции; NULL лежит в DEFAULT
+            IF v_existing.time_source_created IS NOT NULL THEN
+                UPDATE public.flats_history fh
+                   SET price = COALESCE(v_new.price, fh.price),
+                       is_actual = COALESCE(v_new.is_actual, fh.is_actual),
+                       time_source_updated = v_ts,
+                       description = COALESCE(NULLIF(v_desc, ''), fh.description)
+                 WHERE fh.id = v_existing.id
+                   AND fh.time_source_created = v_existing.time_source_created;
+            ELSE
+                UPDATE public.flats_history fh
+                   SET price = COALESCE(v_new.price, fh.price),
+                       is_actual = COALESCE(v_new.is_actual, fh.is_actual),
+                       time_source_updated = v_ts,
+                       description = COALESCE(NULLIF(v_desc, ''), fh.description)
+                 WHERE fh.id = v_existing.id
+                   AND fh.time_source_created IS NULL;
+            END IF;
+
+            history_id := v_existing.id;
+        ELSE
+            ------------------------------------------------------------
+            -- 4. Новая запись (только непустые поля, как в Python-версии)
+            ------------------------------------------------------------
+            v_payload := jsonb_strip_nulls(s - 'ts');
+            SELECT string_agg(quote_ident(k), ', '), string_agg(format('($1).%I', k), ', ')
+              INTO v_cols, v_vals
+              FROM jsonb_object_keys(v_payload) AS k
+             WHERE k = ANY(v_hist_cols);
+            IF 'time_source_created' = ANY(v_hist_cols) THEN
+                v_cols := concat_ws(', ', v_cols, 'time_source_created');
+                v_vals := concat_ws(', ', v_vals, '$2');
+            END IF;
+            IF 'time_source_updated' = ANY(v_hist_cols) THEN
+                v_cols := concat_ws(', ', v_cols, 'time_source_updated');
+                v_vals := concat_ws(', ', v_vals, '$2');
+            END IF;
+            IF v_cols IS NOT NULL THEN
+                EXECUTE format('INSERT INTO public.flats_history (%s) VALUES (%s) RETURNING id', v_cols, v_vals)
+                    INTO history_id
+                    USING jsonb_populate_record(NULL::public.flats_history, v_payload), v_ts;
+            END IF;
+        END IF;
+
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
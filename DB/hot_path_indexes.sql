@@ -0,0 +1,57 @@
+-- ============================================
+-- Индексы под горячие запросы парсеров и отчётов
+-- ============================================
+--
+-- В дампах DB/ нет вторичных индексов под самые частые условия:
+--   * очереди ads_cian / ads_avito (processed IS FALSE) — process_*_ads;
+--   * flats_history.url и (house_id, floor, rooms, time_source_updated) —
+--     history_sync.sync_ad_to_public_history, ReportPipeline._fetch_history_ads,
+--     users.market_price_history;
+--   * flats_history (avitoid, source_id) — сопоставление в batch_upsert;
+--   * flats_changes.flats_history_id — истории цен в отчётах;
+--   * users.flat_reports по ключу отчёта — reportlab.fetch_latest_report_json;
+--   * users.ads (house_id, rooms) — конкуренты в build_flat_report.
+--
+-- Применение (индексы строятся без блокировки записи, вне транзакции;
+-- ДО DB/partition_flats_history.sql — на секционированной таблице
+-- CONCURRENTLY не поддерживается, миграция секционирования переносит индексы сама):
+--     psql "$DATABASE_URL" -f DB/hot_path_indexes.sql
+-- Проверка планов: python server/explain_check.py
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_cian_unprocessed_idx
+    ON public.ads_cian (id)
+    WHERE processed IS FALSE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_avito_unprocessed_idx
+    ON public.ads_avito (id)
+    WHERE processed IS FALSE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_history_url_updated_idx
+    ON public.flats_history (url, time_source_updated DESC NULLS LAST);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_history_flat_updated_idx
+    ON public.flats_history (house_id, floor, rooms, time_source_updated DESC NULLS LAST);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_history_avitoid_source_idx
+    ON public.flats_history (avitoid, source_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flats_changes_history_id_idx
+    ON public.flats_changes (flats_history_id, updated DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS flat_reports_key_updated_idx
+    ON users.flat_reports (tg_user_id, house_id, floor, rooms, radius_m, updated_at DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_house_rooms_idx
+    ON users.ads (house_id, rooms)
+    WHERE price IS NOT NULL;
+
+-- Недостроенные (INVALID) индексы после прерванного CONCURRENTLY — удалить и
+-- применить файл заново:
+--     SELECT indexrelid::regclass FROM pg_index WHERE NOT indisvalid;
+
+ANALYZE public.ads_cian;
+ANALYZE public.ads_avito;
+ANALYZE public.flats_history;
+ANALYZE public.flats_changes;
+ANALYZE users.flat_reports;
+ANALYZE users.ads;
@@ -0,0 +1,203 @@
+-- ============================================
+-- house_neighbours: предрасчитанные соседние дома (до 3 км)
+-- ============================================
+--
+-- get_house_near_house вызывается в каждом отчёте (find_nearby_apartments,
+-- users.build_flat_report*) и каждый раз делал ST_DWithin по moscow_geo,
+-- хотя координаты домов почти не меняются. Пары (дом, сосед, расстояние)
+-- считаются заранее; поиск соседей — диапазонный скан индекса
+-- (house_id, dist_m).
+--
+-- Первичное построение и обновление после изменений moscow_geo:
+--     python server/house_neighbours_job.py
+-- (или вручную: SELECT public.house_neighbours_sync_points();
+--  затем SELECT public.house_neighbours_refresh_batch(500); пока не вернёт 0)
+
+CREATE TABLE IF NOT EXISTS public.house_geo_points (
+    house_id      integer PRIMARY KEY,
+    centroid_utm  public.geometry NOT NULL,
+    is_apartments boolean NOT NULL,
+    geo_hash      text NOT NULL,
+    dirty         boolean NOT NULL DEFAULT TRUE,
+    updated_at    timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS house_geo_points_centroid_gist
+    ON public.house_geo_points USING gist (centroid_utm);
+CREATE INDEX IF NOT EXISTS house_geo_points_dirty_idx
+    ON public.house_geo_points (house_id) WHERE dirty;
+
+CREATE TABLE IF NOT EXISTS public.house_neighbours (
+    house_id     integer NOT NULL,
+    neighbour_id integer NOT NULL,
+    dist_m       integer NOT NULL,
+    PRIMARY KEY (house_id, neighbour_id)
+);
+
+-- Покрывающий индекс: WHERE house_id = ? AND dist_m <= ? ORDER BY dist_m — index only scan
+CREATE INDEX IF NOT EXISTS house_neighbours_house_dist_idx
+    ON public.house_neighbours (house_id, dist_m) INCLUDE (neighbour_id);
+CREATE INDEX IF NOT EXISTS house_neighbours_neighbour_idx
+    ON public.house_neighbours (neighbour_id);
+
+
+CREATE OR REPLACE FUNCTION public.house_neighbours_max_radius()
+RETURNS integer
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT 3000;
+$$;
+
+
+-- Шаг 1: переносит координаты домов из moscow_geo, помечая новые и сдвинутые дома как dirty.
+-- Исчезнувшие дома удаляются вместе со всеми их парами. Возвращает число dirty-домов.
+CREATE OR REPLACE FUNCTION public.house_neighbours_sync_points()
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_dirty integer;
+BEGIN
+    DROP TABLE IF EXISTS tmp_house_points;
+    CREATE TEMP TABLE tmp_house_points ON COMMIT DROP AS
+    SELECT DISTINCT ON (g.house_id)
+        g.house_id,
+        g.centroid_utm,
+        (g.building = 'apartments') AS is_apartments,
+        md5(public.ST_AsEWKT(g.centroid_utm) || (g.building = 'apartments')::text) AS geo_hash
+    FROM public.moscow_geo g
+    WHERE g.house_id IS NOT NULL
+      AND g.centroid_utm IS NOT NULL
+    ORDER BY g.house_id, (g.building = 'apartments') DESC, g.id;
+
+    -- Удалённые дома: чистим пары, где дом был источником или соседом
+    WITH gone AS (
+        DELETE FROM public.house_geo_points p
+        WHERE NOT EXISTS (SELECT 1 FROM tmp_house_points t WHERE t.house_id = p.house_id)
+        RETURNING p.house_id
+    )
+    DELETE FROM public.house_neighbours n
+    USING gone
+    WHERE n.house_id = gone.house_id OR n.neighbour_id = gone.house_id;
+
+    INSERT INTO public.house_geo_points AS p (house_id, centroid_utm, is_apartments, geo_hash, dirty, updated_at)
+    SELECT t.house_id, t.centroid_utm, t.is_apartments, t.geo_hash, TRUE, now()
+    FROM tmp_house_points t
+    ON CONFLICT (house_id) DO UPDATE
+       SET centroid_utm = EXCLUDED.centroid_utm,
+           is_apartments = EXCLUDED.is_apartments,
+           geo_hash = EXCLUDED.geo_hash,
+           dirty = TRUE,
+           updated_at = now()
+     WHERE p.geo_hash IS DISTINCT FROM EXCLUDED.geo_hash;
+
+    SELECT count(*) INTO v_dirty FROM public.house_geo_points WHERE dirty;
+    RETURN v_dirty;
+END;
+$$;
+
+
+-- Шаг 2: пересчитывает пары для очередной пачки dirty-домов в обе стороны
+-- (дом → соседи и соседи → дом). Возвращает число обработанных домов.
+CREATE OR REPLACE FUNCTION public.house_neighbours_refresh_batch(p_batch_size integer DEFAULT 500)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_ids    integer[];
+    v_radius double precision := public.house_neighbours_max_radius();
+BEGIN
+    SELECT array_agg(house_id) INTO v_ids
+    FROM (
+        SELECT house_id
+        FROM public.house_geo_points
+        WHERE dirty
+        ORDER BY house_id
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ) d;
+
+    IF v_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM public.house_neighbours
+    WHERE house_id = ANY(v_ids) OR neighbour_id = ANY(v_ids);
+
+    -- дом из пачки → соседние жилые дома
+    INSERT INTO public.house_neighbours (house_id, neighbour_id, dist_m)
+    SELECT s.house_id, t.house_id, round(public.ST_Distance(s.centroid_utm, t.centroid_utm))::integer
+    FROM public.house_geo_points s
+    JOIN public.house_geo_points t
+      ON t.is_apartments
+     AND t.house_id <> s.house_id
+     AND public.ST_DWithin(t.centroid_utm, s.centroid_utm, v_radius)
+    WHERE s.house_id = ANY(v_ids)
+    ON CONFLICT (house_id, neighbour_id) DO UPDATE SET dist_m = EXCLUDED.dist_m;
+
+    -- остальные дома → жилой дом из пачки
+    INSERT INTO public.house_neighbours (house_id, neighbour_id, dist_m)
+    SELECT s.house_id, t.house_id, round(public.ST_Distance(s.centroid_utm, t.centroid_utm))::integer
+    FROM public.house_geo_points t
+    JOIN public.house_geo_points s
+      ON s.house_id <> t.house_id
+     AND NOT (s.house_id = ANY(v_ids))
+     AND public.ST_DWithin(s.centroid_utm, t.centroid_utm, v_radius)
+    WHERE t.house_id = ANY(v_ids)
+      AND t.is_apartments
+    ON CONFLICT (house_id, neighbour_id) DO UPDATE SET dist_m = EXCLUDED.dist_m;
+
+    UPDATE public.house_geo_points
+       SET dirty = FALSE
+     WHERE house_id = ANY(v_ids);
+
+    RETURN array_length(v_ids, 1);
+END;
+$$;
+
+
+-- Соседи берутся из house_neighbours, если радиус в пределах предрасчёта и дом
+-- уже посчитан; иначе — прежний ST_DWithin по moscow_geo.
+CREATE OR REPLACE FUNCTION public.get_house_near_house(p_house_id integer, p_radius integer DEFAULT 500)
+RETURNS TABLE(house_id integer, dist_m integer)
+LANGUAGE plpgsql
+STABLE
+AS $$
+#variable_conflict use_column
+BEGIN
+    IF p_radius <= public.house_neighbours_max_radius()
+       AND EXISTS (
+           SELECT 1 FROM public.house_geo_points p
+           WHERE p.house_id = p_house_id AND NOT p.dirty
+       )
+    THEN
+        RETURN QUERY
+        SELECT n.neighbour_id, n.dist_m
+        FROM public.house_neighbours n
+        WHERE n.house_id = p_house_id
+          AND n.dist_m <= p_radius
+        ORDER BY n.dist_m;
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH src AS (
+        SELECT g.centroid_utm
+        FROM public.moscow_geo g
+        WHERE g.house_id = p_house_id
+          AND g.centroid_utm IS NOT NULL
+        LIMIT 1
+    )
+    SELECT
+        t.house_id,
+        ROUND(public.ST_Distance(t.centroid_utm, s.centroid_utm))::integer AS dist_m
+    FROM public.moscow_geo t
+    CROSS JOIN src s
+    WHERE t.house_id IS NOT NULL
+      AND t.house_id <> p_house_id
+      AND t.building = 'apartments'
+      AND public.ST_DWithin(t.centroid_utm, s.centroid_utm, p_radius::double precision)
+    ORDER BY 2 ASC;
+END;
+$$;
@@ -0,0 +1,343 @@
+-- ============================================
+-- map_tiles: предрасчитанные тайлы z/x/y для карты кабинета
+-- ============================================
+--
+-- Карта в кабинете на каждое перемещение вызывала get_houses_in_bounds /
+-- get_ads_in_bounds — свежий запрос по прямоугольнику с агрегацией flats_history.
+-- Теперь агрегаты считаются заранее по тайлам веб-меркатора (z от 10 до 16):
+--   * public.map_house_stats — по дому: координаты, тайл на z16, число активных и
+--     всех объявлений, минимальная цена активных, разбивка по комнатам (1/2/3/4+);
+--   * public.map_tiles — по тайлу: число домов, домов с активными объявлениями,
+--     активных объявлений, минимальная цена, разбивка по комнатам, центр; с z15 —
+--     список домов. etag = md5 содержимого, меняется только при изменении данных.
+-- Изменения flats_history ставят дома в очередь public.map_dirty_houses (триггер
+-- уровня оператора); map_tiles_refresh пересчитывает только затронутые тайлы.
+-- Тайлы отдаёт GET /api/map/tiles/{z}/{x}/{y}.json (server/map_tiles.py) с ETag.
+-- Фильтры по цене и площади по-прежнему обслуживают get_*_in_bounds.
+--
+-- Применение и первичное построение:
+--     psql "$DATABASE_URL" -f DB/map_tiles.sql
+--     python server/map_tiles.py rebuild
+-- Дальше по расписанию (после импорта объявлений):
+--     python server/map_tiles.py refresh
+
+CREATE TABLE IF NOT EXISTS public.map_house_stats (
+    house_id         integer PRIMARY KEY,
+    lat              real    NOT NULL,
+    lng              real    NOT NULL,
+    address          text,
+    tile_x           integer NOT NULL,
+    tile_y           integer NOT NULL,
+    active_ads_count integer NOT NULL DEFAULT 0,
+    total_ads_count  integer NOT NULL DEFAULT 0,
+    min_active_price bigint,
+    active_by_rooms  jsonb   NOT NULL DEFAULT '{}'::jsonb,
+    updated_at       timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS map_house_stats_tile_idx
+    ON public.map_house_stats (tile_x, tile_y);
+
+CREATE TABLE IF NOT EXISTS public.map_dirty_houses (
+    house_id  integer PRIMARY KEY,
+    queued_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.map_tiles (
+    z                  smallint NOT NULL,
+    x                  integer  NOT NULL,
+    y                  integer  NOT NULL,
+    house_count        integer  NOT NULL,
+    houses_with_active integer  NOT NULL,
+    active_ads         integer  NOT NULL,
+    min_price          bigint,
+    payload            jsonb    NOT NULL,
+    etag               text     NOT NULL,
+    updated_at         timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (z, x, y)
+);
+
+
+CREATE OR REPLACE FUNCTION public.map_tile_min_zoom()
+RETURNS integer LANGUAGE sql IMMUTABLE AS $$ SELECT 10; $$;
+
+CREATE OR REPLACE FUNCTION public.map_tile_max_zoom()
+RETURNS integer LANGUAGE sql IMMUTABLE AS $$ SELECT 16; $$;
+
+-- С этого зума тайл содержит список домов, ниже — только агрегаты
+CREATE OR REPLACE FUNCTION public.map_tile_houses_zoom()
+RETURNS integer LANGUAGE sql IMMUTABLE AS $$ SELECT 15; $$;
+
+
+-- Номер тайла веб-меркатора (как у OSM/Leaflet) для точки на зуме p_z
+CREATE OR REPLACE FUNCTION public.map_tile_xy(p_lat double precision, p_lng double precision, p_z integer)
+RETURNS TABLE(x integer, y integer)
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT
+        floor((p_lng + 180.0) / 360.0 * (1 << p_z))::integer,
+        floor(
+            (1.0 - ln(tan(radians(p_lat)) + 1.0 / cos(radians(p_lat))) / pi()) / 2.0 * (1 << p_z)
+        )::integer;
+$$;
+
+
+-- Очередь: дома, объявления которых изменились
+CREATE OR REPLACE FUNCTION public.map_tiles_flats_history_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO public.map_dirty_houses (house_id)
+        SELECT DISTINCT n.house_id FROM new_rows n WHERE n.house_id IS NOT NULL
+        ON CONFLICT (house_id) DO NOTHING;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO public.map_dirty_houses (house_id)
+        SELECT DISTINCT o.house_id FROM old_rows o WHERE o.house_id IS NOT NULL
+        ON CONFLICT (house_id) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS map_tiles_flats_history_ins ON public.flats_history;
+CREATE TRIGGER map_tiles_flats_history_ins
+    AFTER INSERT ON public.flats_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.map_tiles_flats_history_changed();
+
+DROP TRIGGER IF EXISTS map_tiles_flats_history_upd ON public.flats_history;
+CREATE TRIGGER map_tiles_flats_history_upd
+    AFTER UPDATE ON public.flats_history
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.map_tiles_flats_history_changed();
+
+DROP TRIGGER IF EXISTS map_tiles_flats_history_del ON public.flats_history;
+CREATE TRIGGER map_tiles_flats_history_del
+    AFTER DELETE ON public.flats_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.map_tiles_flats_history_changed();
+
+
+-- Полное перестроение: все дома из moscow_geo и уже известные — в очередь
+CREATE OR REPLACE FUNCTION public.map_tiles_enqueue_all()
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_count integer;
+BEGIN
+    INSERT INTO public.map_dirty_houses (house_id)
+    SELECT g.house_id FROM system.moscow_geo g WHERE g.house_id IS NOT NULL
+    UNION
+    SELECT s.house_id FROM public.map_house_stats s
+    ON CONFLICT (house_id) DO NOTHING;
+
+    SELECT count(*) INTO v_count FROM public.map_dirty_houses;
+    RETURN v_count;
+END;
+$$;
+
+
+-- Пересчитывает пачку домов из очереди и все тайлы, в которые они попадали или
+-- попадают теперь. Возвращает число обработанных домов (0 — очередь пуста).
+CREATE OR REPLACE FUNCTION public.map_tiles_refresh(p_batch_size integer DEFAULT 5000)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_ids    integer[];
+    v_max    integer := public.map_tile_max_zoom();
+    v_houses integer := public.map_tile_houses_zoom();
+    v_z      integer;
+    v_shift  integer;
+BEGIN
+    WITH claimed AS (
+        DELETE FROM public.map_dirty_houses d
+        WHERE d.house_id IN (
+            SELECT q.house_id
+            FROM public.map_dirty_houses q
+            ORDER BY q.house_id
+            LIMIT p_batch_size
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING d.house_id
+    )
+    SELECT array_agg(house_id) INTO v_ids FROM claimed;
+
+    IF v_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DROP TABLE IF EXISTS pg_temp.tmp_map_tiles_max;
+    CREATE TEMP TABLE tmp_map_tiles_max ON COMMIT DROP AS
+    SELECT s.tile_x, s.tile_y
+    FROM public.map_house_stats s
+    WHERE s.house_id = ANY(v_ids);
+
+    ------------------------------------------------------------
+    -- 1. Статистика домов
+    ------------------------------------------------------------
+    DELETE FROM public.map_house_stats WHERE house_id = ANY(v_ids);
+
+    INSERT INTO public.map_house_stats (
+        house_id, lat, lng, address, tile_x, tile_y,
+        active_ads_count, total_ads_count, min_active_price, active_by_rooms, updated_at
+    )
+    SELECT
+        g.house_id, g.lat, g.lng, g.address, t.x, t.y,
+        COALESCE(a.active_ads_count, 0),
+        COALESCE(a.total_ads_count, 0),
+        a.min_active_price,
+        COALESCE(r.by_rooms, '{}'::jsonb),
+        now()
+    FROM (
+        SELECT DISTINCT ON (mg.house_id)
+            mg.house_id,
+            mg.lat::real AS lat,
+            mg.lon::real AS lng,
+            CONCAT(mg.street, ', ', mg.housenum) AS address
+        FROM system.moscow_geo mg
+        WHERE mg.house_id = ANY(v_ids)
+          AND mg.lat IS NOT NULL
+          AND mg.lon IS NOT NULL
+        ORDER BY mg.house_id
+    ) g
+    CROSS JOIN LATERAL public.map_tile_xy(g.lat, g.lng, v_max) t
+    LEFT JOIN LATERAL (
+        SELECT
+            count(*) FILTER (WHERE fh.is_actual = 1)::integer AS active_ads_count,
+            count(*)::integer AS total_ads_count,
+            min(fh.price) FILTER (WHERE fh.is_actual = 1) AS min_active_price
+        FROM public.flats_history fh
+        WHERE fh.house_id = g.house_id
+    ) a ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT jsonb_object_agg(b.bucket, jsonb_build_object('active', b.active, 'min_price', b.min_price)) AS by_rooms
+        FROM (
+            SELECT
+                CASE WHEN fh.rooms >= 4 THEN '4+' ELSE fh.rooms::text END AS bucket,
+                count(*)::integer AS active,
+                min(fh.price) AS min_price
+            FROM public.flats_history fh
+            WHERE fh.house_id = g.house_id
+              AND fh.is_actual = 1
+              AND fh.rooms IS NOT NULL
+            GROUP BY 1
+        ) b
+    ) r ON TRUE;
+
+    INSERT INTO tmp_map_tiles_max
+    SELECT s.tile_x, s.tile_y
+    FROM public.map_house_stats s
+    WHERE s.house_id = ANY(v_ids);
+
+    ------------------------------------------------------------
+    -- 2. Тайлы всех зумов, содержащие изменённые дома
+    ------------------------------------------------------------
+    FOR v_z IN public.map_tile_min_zoom() .. v_max LOOP
+        v_shift := v_max - v_z;
+
+        DROP TABLE IF EXISTS pg_temp.tmp_map_tiles_new;
+        CREATE TEMP TABLE tmp_map_tiles_new ON COMMIT DROP AS
+        WITH affected AS (
+            SELECT DISTINCT m.tile_x >> v_shift AS x, m.tile_y >> v_shift AS y
+            FROM tmp_map_tiles_max m
+        ),
+        houses AS (
+            SELECT a.x, a.y, h.*
+            FROM affected a
+            JOIN public.map_house_stats h
+              ON h.tile_x BETWEEN (a.x << v_shift) AND ((a.x + 1) << v_shift) - 1
+             AND h.tile_y BETWEEN (a.y << v_shift) AND ((a.y + 1) << v_shift) - 1
+        ),
+        rooms AS (
+            SELECT rb.x, rb.y,
+                   jsonb_object_agg(rb.bucket, jsonb_build_object('active', rb.active, 'min_price', rb.min_price)) AS by_rooms
+            FROM (
+                SELECT h.x, h.y, e.key AS bucket,
+                       sum((e.value->>'active')::integer) AS active,
+                       min((e.value->>'min_price')::bigint) AS min_price
+                FROM houses h
+                CROSS JOIN LATERAL jsonb_each(h.active_by_rooms) e
+                GROUP BY h.x, h.y, e.key
+            ) rb
+            GROUP BY rb.x, rb.y
+        ),
+        agg AS (
+            SELECT
+                h.x, h.y,
+                count(*)::integer AS house_count,
+                count(*) FILTER (WHERE h.active_ads_count > 0)::integer AS houses_with_active,
+                sum(h.active_ads_count)::integer AS active_ads,
+                sum(h.total_ads_count)::integer AS total_ads,
+                min(h.min_active_price) AS min_price,
+                avg(h.lat) AS center_lat,
+                avg(h.lng) AS center_lng,
+                CASE WHEN v_z >= v_houses THEN
+                    jsonb_agg(
+                        jsonb_build_object(
+                            'house_id', h.house_id,
+                            'lat', h.lat,
+                            'lng', h.lng,
+                            'address', h.address,
+                            'active_ads_count', h.active_ads_count,
+                            'total_ads_count', h.total_ads_count,
+                            'min_price', h.min_active_price,
+                            'rooms', h.active_by_rooms
+                        )
+                        ORDER BY h.house_id
+                    )
+                END AS houses
+            FROM houses h
+            GROUP BY h.x, h.y
+        )
+        SELECT
+            a.x, a.y,
+            g.house_count, g.houses_with_active, g.active_ads, g.min_price,
+            jsonb_strip_nulls(jsonb_build_object(
+                'z', v_z, 'x', a.x, 'y', a.y,
+                'house_count', COALESCE(g.house_count, 0),
+                'houses_with_active', COALESCE(g.houses_with_active, 0),
+                'active_ads', COALESCE(g.active_ads, 0),
+                'total_ads', COALESCE(g.total_ads, 0),
+                'min_price', g.min_price,
+                'rooms', COALESCE(r.by_rooms, '{}'::jsonb),
+                'center', CASE WHEN g.house_count > 0
+                               THEN jsonb_build_object('lat', round(g.center_lat::numeric, 6), 'lng', round(g.center_lng::numeric, 6))
+                          END,
+                'houses', g.houses
+            )) AS payload
+        FROM affected a
+        LEFT JOIN agg g ON g.x = a.x AND g.y = a.y
+        LEFT JOIN rooms r ON r.x = a.x AND r.y = a.y;
+
+        DELETE FROM public.map_tiles mt
+        USING tmp_map_tiles_new n
+        WHERE mt.z = v_z AND mt.x = n.x AND mt.y = n.y
+          AND n.house_count IS NULL;
+
+        INSERT INTO public.map_tiles AS mt (
+            z, x, y, house_count, houses_with_active, active_ads, min_price, payload, etag, updated_at
+        )
+        SELECT v_z, n.x, n.y, n.house_count, n.houses_with_active, n.active_ads, n.min_price,
+               n.payload, md5(n.payload::text), now()
+        FROM tmp_map_tiles_new n
+        WHERE n.house_count IS NOT NULL
+        ON CONFLICT (z, x, y) DO UPDATE
+           SET house_count = EXCLUDED.house_count,
+               houses_with_active = EXCLUDED.houses_with_active,
+               active_ads = EXCLUDED.active_ads,
+               min_price = EXCLUDED.min_price,
+               payload = EXCLUDED.payload,
+               etag = EXCLUDED.etag,
+               updated_at = now()
+         WHERE mt.etag IS DISTINCT FROM EXCLUDED.etag;
+    END LOOP;
+
+    RETURN array_length(v_ids, 1);
+END;
+$$;
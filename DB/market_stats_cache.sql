@@ -0,0 +1,485 @@
+-- ============================================
+-- market_stats_cache: рыночная статистика для users.build_flat_report
+-- ============================================
+--
+-- build_flat_report для каждого запроса заново собирал конкурентов в радиусе,
+-- считал перцентили цены за м², топ-20 и истории цен конкурентов, хотя про один
+-- дом спрашивают несколько пользователей. Всё, что не зависит от конкретной
+-- квартиры-субъекта, теперь хранится в users.market_stats_cache с ключом
+-- (house_id, rooms, radius_m, stats_date):
+--   * перцентили и отсортированный массив ppm (позиция субъекта — подсчёт по массиву);
+--   * топ-20 конкурентов;
+--   * истории цен по ключам (house_id, floor, rooms) конкурентов.
+-- Изменения flats_history / flats_changes / users.ads помечают затронутые строки
+-- как stale (дом и дома, в радиус которых он попадает, по house_neighbours).
+-- Устаревшая строка пересчитывается при следующем запросе отчёта или заданием
+--     python server/market_stats_job.py
+--
+-- Попадания и промахи считаются sequence-счётчиками (market_stats_count), как в
+-- DB/address_cache.sql: попадание — обычный SELECT, без UPDATE строки кэша.
+--
+-- Применение (после DB/house_neighbours.sql, до DB/report_functions.sql):
+--     psql "$DATABASE_URL" -f DB/market_stats_cache.sql
+
+CREATE TABLE IF NOT EXISTS users.market_stats_cache (
+    house_id          integer NOT NULL,
+    rooms             integer NOT NULL,
+    radius_m          integer NOT NULL,
+    stats_date        date    NOT NULL DEFAULT CURRENT_DATE,
+    competitors_count integer NOT NULL DEFAULT 0,
+    ppm_p25           numeric,
+    ppm_p50           numeric,
+    ppm_p75           numeric,
+    ppm_sorted        numeric[] NOT NULL DEFAULT '{}',
+    top_items         jsonb   NOT NULL DEFAULT '[]'::jsonb,
+    comp_history      jsonb   NOT NULL DEFAULT '[]'::jsonb,
+    stale             boolean NOT NULL DEFAULT FALSE,
+    computed_at       timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (house_id, rooms, radius_m, stats_date)
+);
+
+CREATE INDEX IF NOT EXISTS market_stats_cache_stale_idx
+    ON users.market_stats_cache (stats_date, house_id)
+    WHERE stale;
+CREATE INDEX IF NOT EXISTS market_stats_cache_rooms_house_idx
+    ON users.market_stats_cache (rooms, house_id);
+
+-- nextval не транзакционен и не блокирует строк; сброс — users.market_stats_reset_counters()
+CREATE SEQUENCE IF NOT EXISTS users.market_stats_hits_seq;
+CREATE SEQUENCE IF NOT EXISTS users.market_stats_misses_seq;
+
+
+CREATE OR REPLACE FUNCTION users.market_stats_count(p_hits bigint, p_misses bigint)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- nextval запрещён в read-only транзакциях и на репликах — там статистика не ведётся
+  IF current_setting('transaction_read_only') = 'on' THEN
+    RETURN;
+  END IF;
+  IF p_hits > 0 THEN
+    PERFORM nextval('users.market_stats_hits_seq') FROM generate_series(1, p_hits);
+  END IF;
+  IF p_misses > 0 THEN
+    PERFORM nextval('users.market_stats_misses_seq') FROM generate_series(1, p_misses);
+  END IF;
+END;
+$$;
+
+
+CREATE OR REPLACE FUNCTION users.market_stats_reset_counters()
+RETURNS void
+LANGUAGE sql
+AS $$
+  SELECT setval('users.market_stats_hits_seq', 1, false);
+  SELECT setval('users.market_stats_misses_seq', 1, false);
+$$;
+
+
+-- История цен одной квартиры (house_id, floor, rooms): flats_history + flats_changes
+CREATE OR REPLACE FUNCTION users.market_price_history(
+    p_house_id integer,
+    p_floor    integer,
+    p_rooms    integer
+) RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT COALESCE(
+    jsonb_agg(jsonb_build_object('ts', t.ts, 'price', t.price) ORDER BY t.ts DESC)
+      FILTER (WHERE t.ts IS NOT NULL),
+    '[]'::jsonb
+  )
+  FROM (
+    SELECT fh.time_source_updated AS ts, fh.price
+    FROM public.flats_history fh
+    WHERE fh.house_id = p_house_id
+      AND fh.floor = p_floor
+      AND fh.rooms = p_rooms
+      AND fh.price IS NOT NULL
+    UNION ALL
+    SELECT fc.updated AS ts, fc.price
+    FROM public.flats_changes fc
+    JOIN public.flats_history fh ON fh.id = fc.flats_history_id
+    WHERE fh.house_id = p_house_id
+      AND fh.floor = p_floor
+      AND fh.rooms = p_rooms
+      AND fc.price IS NOT NULL
+  ) t;
+$$;
+
+
+-- Полный расчёт статистики по конкурентам из users.ads в радиусе (как в build_flat_report)
+CREATE OR REPLACE FUNCTION users.market_stats_compute(
+    p_house_id integer,
+    p_rooms    integer,
+    p_radius_m integer
+) RETURNS TABLE(
+    competitors_count integer,
+    ppm_p25 numeric,
+    ppm_p50 numeric,
+    ppm_p75 numeric,
+    ppm_sorted numeric[],
+    top_items jsonb,
+    comp_history jsonb
+)
+LANGUAGE sql
+STABLE
+AS $$
+  WITH near_houses AS (
+    SELECT p_house_id AS house_id, 0::int AS dist_m
+    UNION ALL
+    SELECT nh.house_id, nh.dist_m
+    FROM public.get_house_near_house(p_house_id, p_radius_m) nh
+  ),
+  ads_raw AS (
+    SELECT
+      a.*,
+      nh.dist_m AS near_dist_m,
+      lower(split_part(coalesce(a.url, ''), '?', 1)) AS norm_url
+    FROM near_houses nh
+    JOIN users.ads a ON a.house_id = nh.house_id
+    WHERE a.price IS NOT NULL
+      AND a.rooms = p_rooms
+      AND (a.status IS NULL OR a.status = TRUE)
+  ),
+  ads_dedup AS (
+    SELECT DISTINCT ON (COALESCE(norm_url, a.id::text))
+      a.id AS ad_id,
+      a.house_id,
+      a.floor,
+      a.rooms,
+      COALESCE(a.near_dist_m, 0) AS dist_m,
+      a.price,
+      COALESCE(a.total_area, a.living_area) AS area_m2,
+      a.kitchen_area,
+      a.living_area,
+      a.total_floors,
+      a.bathroom,
+      a.balcony,
+      a.renovation,
+      a.construction_year,
+      a.house_type,
+      a.ceiling_height,
+      a.furniture,
+      a.metro_station,
+      a.metro_time::smallint AS metro_time,
+      NULL::text AS metro_way,
+      a.url,
+      a.updated_at
+    FROM ads_raw a
+    ORDER BY COALESCE(norm_url, a.id::text), a.updated_at DESC NULLS LAST, a.id DESC
+  ),
+  comps AS (
+    SELECT
+      *,
+      CASE
+        WHEN area_m2 IS NOT NULL AND area_m2 > 0 THEN price::numeric / area_m2
+        ELSE NULL
+      END AS ppm
+    FROM ads_dedup
+  ),
+  stats AS (
+    SELECT
+      COUNT(*)::int AS cnt,
+      percentile_cont(0.25) WITHIN GROUP (ORDER BY ppm) AS p25_ppm,
+      percentile_cont(0.50) WITHIN GROUP (ORDER BY ppm) AS p50_ppm,
+      percentile_cont(0.75) WITHIN GROUP (ORDER BY ppm) AS p75_ppm,
+      COALESCE(array_agg(ppm ORDER BY ppm), '{}') AS ppm_sorted
+    FROM comps
+    WHERE ppm IS NOT NULL
+  ),
+  top_items AS (
+    SELECT
+      COALESCE(
+        jsonb_agg(
+          jsonb_build_object(
+            'ad_id', ad_id,
+            'house_id', house_id,
+            'floor', floor,
+            'rooms', rooms,
+            'dist_m', dist_m,
+            'price', price,
+            'area_m2', area_m2,
+            'kitchen_area', kitchen_area,
+            'living_area', living_area,
+            'total_floors', total_floors,
+            'bathroom', bathroom,
+            'balcony', balcony,
+            'renovation', renovation,
+            'construction_year', construction_year,
+            'house_type', house_type,
+            'ceiling_height', ceiling_height,
+            'furniture', furniture,
+            'metro_station', metro_station,
+            'metro_time', metro_time,
+            'metro_way', metro_way,
+            'ppm', ppm,
+            'url', url,
+            'updated', updated_at
+          )
+          ORDER BY ppm ASC NULLS LAST, price ASC
+        ),
+        '[]'::jsonb
+      ) AS items
+    FROM (
+      SELECT * FROM comps
+      ORDER BY ppm ASC NULLS LAST, price ASC
+      LIMIT 20
+    ) t
+  ),
+  comp_history AS (
+    SELECT COALESCE(jsonb_agg(
+      jsonb_build_object(
+        'house_id', k.house_id,
+        'floor', k.floor,
+        'rooms', k.rooms,
+        'history', users.market_price_history(k.house_id, k.floor, k.rooms)
+      )
+    ), '[]'::jsonb) AS history
+    FROM (SELECT DISTINCT house_id, floor, rooms FROM comps) k
+  )
+  SELECT s.cnt, s.p25_ppm::numeric, s.p50_ppm::numeric, s.p75_ppm::numeric, s.ppm_sorted, ti.items, ch.history
+  FROM stats s
+  CROSS JOIN top_items ti
+  CROSS JOIN comp_history ch;
+$$;
+
+
+-- Расчёт статистики за сегодня и запись в кэш (промах market_stats_get и пересчёт устаревших)
+CREATE OR REPLACE FUNCTION users.market_stats_store(
+    p_house_id integer,
+    p_rooms    integer,
+    p_radius_m integer
+) RETURNS users.market_stats_cache
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_row users.market_stats_cache;
+BEGIN
+  INSERT INTO users.market_stats_cache AS c (
+    house_id, rooms, radius_m, stats_date,
+    competitors_count, ppm_p25, ppm_p50, ppm_p75, ppm_sorted,
+    top_items, comp_history, stale, computed_at
+  )
+  SELECT
+    p_house_id, p_rooms, p_radius_m, CURRENT_DATE,
+    m.competitors_count, m.ppm_p25, m.ppm_p50, m.ppm_p75, m.ppm_sorted,
+    m.top_items, m.comp_history, FALSE, now()
+  FROM users.market_stats_compute(p_house_id, p_rooms, p_radius_m) m
+  ON CONFLICT (house_id, rooms, radius_m, stats_date) DO UPDATE
+     SET competitors_count = EXCLUDED.competitors_count,
+         ppm_p25 = EXCLUDED.ppm_p25,
+         ppm_p50 = EXCLUDED.ppm_p50,
+         ppm_p75 = EXCLUDED.ppm_p75,
+         ppm_sorted = EXCLUDED.ppm_sorted,
+         top_items = EXCLUDED.top_items,
+         comp_history = EXCLUDED.comp_history,
+         stale = FALSE,
+         computed_at = now()
+  RETURNING c.* INTO v_row;
+
+  RETURN v_row;
+END;
+$$;
+
+
+-- Статистика за сегодня: из кэша, либо расчёт и запись в кэш
+CREATE OR REPLACE FUNCTION users.market_stats_get(
+    p_house_id integer,
+    p_rooms    integer,
+    p_radius_m integer
+) RETURNS users.market_stats_cache
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_row users.market_stats_cache;
+BEGIN
+  SELECT c.* INTO v_row
+  FROM users.market_stats_cache c
+  WHERE c.house_id = p_house_id
+    AND c.rooms = p_rooms
+    AND c.radius_m = p_radius_m
+    AND c.stats_date = CURRENT_DATE
+    AND NOT c.stale;
+
+  IF FOUND THEN
+    PERFORM users.market_stats_count(1, 0);
+    RETURN v_row;
+  END IF;
+
+  PERFORM users.market_stats_count(0, 1);
+  RETURN users.market_stats_store(p_house_id, p_rooms, p_radius_m);
+END;
+$$;
+
+
+-- Помечает устаревшими сегодняшние строки, на которые влияют изменения в домах p_house_ids
+-- с числом комнат p_rooms: сам дом и дома, в радиус которых он попадает.
+CREATE OR REPLACE FUNCTION users.market_stats_mark_stale(
+    p_house_ids integer[],
+    p_rooms     integer[]
+) RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_count integer;
+BEGIN
+  IF p_house_ids IS NULL OR cardinality(p_house_ids) = 0 THEN
+    RETURN 0;
+  END IF;
+
+  UPDATE users.market_stats_cache c
+     SET stale = TRUE
+   WHERE c.stats_date = CURRENT_DATE
+     AND NOT c.stale
+     AND c.rooms = ANY(p_rooms)
+     AND (
+          c.house_id = ANY(p_house_ids)
+          -- радиус больше предрасчёта: соседей в house_neighbours нет, перестраховываемся
+          OR c.radius_m > public.house_neighbours_max_radius()
+          OR EXISTS (
+              SELECT 1
+              FROM public.house_neighbours n
+              WHERE n.house_id = c.house_id
+                AND n.neighbour_id = ANY(p_house_ids)
+                AND n.dist_m <= c.radius_m
+          )
+          -- дом-центр ещё не посчитан в house_neighbours: соседи идут через ST_DWithin
+          OR EXISTS (
+              SELECT 1
+              FROM public.house_geo_points p
+              WHERE p.house_id = c.house_id AND p.dirty
+          )
+     );
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$;
+
+
+-- Триггеры уровня оператора: одна пометка на весь batch_upsert, а не на каждую строку
+CREATE OR REPLACE FUNCTION users.market_stats_flats_history_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_houses integer[];
+  v_rooms  integer[];
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT array_agg(DISTINCT house_id), array_agg(DISTINCT rooms::int)
+      INTO v_houses, v_rooms
+      FROM new_rows WHERE house_id IS NOT NULL;
+  ELSIF TG_OP = 'UPDATE' THEN
+    SELECT array_agg(DISTINCT house_id), array_agg(DISTINCT rooms)
+      INTO v_houses, v_rooms
+      FROM (
+        SELECT house_id, rooms::int FROM new_rows
+        UNION
+        SELECT house_id, rooms::int FROM old_rows
+      ) r
+     WHERE house_id IS NOT NULL;
+  ELSE
+    SELECT array_agg(DISTINCT house_id), array_agg(DISTINCT rooms::int)
+      INTO v_houses, v_rooms
+      FROM old_rows WHERE house_id IS NOT NULL;
+  END IF;
+
+  PERFORM users.market_stats_mark_stale(v_houses, v_rooms);
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION users.market_stats_flats_changes_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_houses integer[];
+  v_rooms  integer[];
+BEGIN
+  SELECT array_agg(DISTINCT fh.house_id), array_agg(DISTINCT fh.rooms::int)
+    INTO v_houses, v_rooms
+    FROM new_rows fc
+    JOIN public.flats_history fh ON fh.id = fc.flats_history_id
+   WHERE fh.house_id IS NOT NULL;
+
+  PERFORM users.market_stats_mark_stale(v_houses, v_rooms);
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS market_stats_flats_history_ins ON public.flats_history;
+CREATE TRIGGER market_stats_flats_history_ins
+    AFTER INSERT ON public.flats_history
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+DROP TRIGGER IF EXISTS market_stats_flats_history_upd ON public.flats_history;
+CREATE TRIGGER market_stats_flats_history_upd
+    AFTER UPDATE ON public.flats_history
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+DROP TRIGGER IF EXISTS market_stats_flats_history_del ON public.flats_history;
+CREATE TRIGGER market_stats_flats_history_del
+    AFTER DELETE ON public.flats_history
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+DROP TRIGGER IF EXISTS market_stats_flats_changes_ins ON public.flats_changes;
+CREATE TRIGGER market_stats_flats_changes_ins
+    AFTER INSERT ON public.flats_changes
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_changes_changed();
+
+-- users.ads — источник самих конкурентов (цены, площади, статус)
+DROP TRIGGER IF EXISTS market_stats_ads_ins ON users.ads;
+CREATE TRIGGER market_stats_ads_ins
+    AFTER INSERT ON users.ads
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+DROP TRIGGER IF EXISTS market_stats_ads_upd ON users.ads;
+CREATE TRIGGER market_stats_ads_upd
+    AFTER UPDATE ON users.ads
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+DROP TRIGGER IF EXISTS market_stats_ads_del ON users.ads;
+CREATE TRIGGER market_stats_ads_del
+    AFTER DELETE ON users.ads
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION users.market_stats_flats_history_changed();
+
+
+-- Пересчёт пачки устаревших строк за сегодня и удаление прошлых дней.
+-- Возвращает число пересчитанных строк (0 — очередь пуста).
+CREATE OR REPLACE FUNCTION users.market_stats_refresh_stale(p_batch_size integer DEFAULT 100)
+RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_keys  record;
+  v_count integer := 0;
+BEGIN
+  DELETE FROM users.market_stats_cache WHERE stats_date < CURRENT_DATE;
+
+  FOR v_keys IN
+    SELECT c.house_id, c.rooms, c.radius_m
+    FROM users.market_stats_cache c
+    WHERE c.stats_date = CURRENT_DATE
+      AND c.stale
+    ORDER BY c.house_id
+    LIMIT p_batch_size
+    FOR UPDATE SKIP LOCKED
+  LOOP
+    PERFORM users.market_stats_store(v_keys.house_id, v_keys.rooms, v_keys.radius_m);
+    v_count := v_count + 1;
+  END LOOP;
+
+  RETURN v_count;
+END;
+$$;
@@ -0,0 +1,428 @@
+-- ============================================
+-- Помесячное секционирование flats_history и flats_changes
+-- ============================================
+--
+-- flats_history и flats_changes только растут; старые объявления лежат в тех же
+-- страницах и индексах, что и текущие, и замедляют VACUUM, перестроение индексов
+-- и запросы к свежим данным. Таблицы переводятся в декларативное секционирование
+-- RANGE по месяцу:
+--   * flats_history — по time_source_created (не меняется при обновлении цены,
+--     поэтому UPDATE из batch_upsert / history_sync не переносит строки между секциями);
+--   * flats_changes — по updated.
+-- Строки с NULL в ключе и вне созданных месяцев попадают в секцию <table>_default.
+--
+-- Что делает public.partition_by_month(table, key, months_ahead):
+--   1. проверяет, что на таблицу не ссылаются представления и что каждый UNIQUE-индекс
+--      содержит ключ секционирования (иначе — исключение, ничего не меняется);
+--   2. берёт EXCLUSIVE-блокировку: чтение продолжается, запись ждёт до конца миграции;
+--   3. строит секционированную копию <table>_new: секции с первого месяца данных до
+--      текущего + months_ahead и DEFAULT, перенос строк, первичный ключ (с добавлением
+--      ключа секционирования; если ключ допускает NULL — UNIQUE-индекс), индексы,
+--      исходящие внешние ключи, права, sequence, ANALYZE;
+--   4. короткая перестановка имён: <table> → <table>_legacy, <table>_new → <table>,
+--      перенос пользовательских триггеров. Только здесь берётся ACCESS EXCLUSIVE —
+--      чтение блокируется лишь на время переименования, а не копирования.
+-- Каждый CALL — отдельная транзакция, чтобы блокировка первой таблицы не держалась,
+-- пока копируется вторая.
+--
+-- Внешний ключ flats_changes.flats_history_id → flats_history.id удаляется: на
+-- секционированной таблице UNIQUE(id) без ключа секционирования невозможен, а в
+-- flats_changes нет time_source_created для составного ключа. id по-прежнему уникален
+-- благодаря sequence. Ссылки вместо ключа проверяют constraint-триггеры, которые
+-- создаются до миграции и переносятся вместе с остальными триггерами:
+--   * flats_changes_history_ref (INSERT / UPDATE OF flats_history_id) — строка
+--     flats_history с таким id существует (блокируется FOR KEY SHARE, как при проверке
+--     внешнего ключа);
+--   * flats_history_changes_guard (DELETE / UPDATE OF id) — на удалённый id не
+--     ссылается flats_changes (перенос строки между секциями не считается удалением).
+-- Сироты, появившиеся до создания триггеров, ищутся запросом
+--     SELECT fc.* FROM public.flats_changes fc
+--     WHERE NOT EXISTS (SELECT 1 FROM public.flats_history fh WHERE fh.id = fc.flats_history_id);
+--
+-- Поиск по одному id (без ключа секционирования) проверяет индекс каждой секции.
+-- Горячие UPDATE по id (history_sync) передают и time_source_created; соединения
+-- flats_changes → flats_history в отчётах идут от фильтра по (house_id, floor, rooms),
+-- поэтому flats_history в них — внешняя сторона. Оставшиеся проверки по id
+-- (триггер market_stats по flats_changes) — Index Scan по pkey каждой секции;
+-- это контролирует server/explain_check.py («flats_history по id»).
+--
+-- Применение (в окно обслуживания: запись в таблицы ждёт всё время копирования;
+-- после DB/hot_path_indexes.sql и DB/market_stats_cache.sql — их индексы и триггеры
+-- переносятся):
+--     psql "$DATABASE_URL" -f DB/partition_flats_history.sql
+-- После проверки (python server/explain_check.py):
+--     DROP TABLE public.flats_history_legacy, public.flats_changes_legacy;
+-- Раз в месяц (cron) — секции на будущее:
+--     SELECT public.ensure_month_partitions('public.flats_history', 'time_source_created', 12);
+--     SELECT public.ensure_month_partitions('public.flats_changes', 'updated', 12);
+
+
+-- Список вставляемых колонок таблицы (без generated-колонок) через запятую
+CREATE OR REPLACE FUNCTION public.partition_insert_columns(p_table regclass)
+RETURNS text
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY a.attnum)
+    FROM pg_attribute a
+    WHERE a.attrelid = p_table
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND a.attgenerated = '';
+$$;
+
+
+-- Создаёт недостающие месячные секции от p_from до текущего месяца + p_months_ahead.
+-- Если подходящие строки уже лежат в DEFAULT-секции, они переносятся в новую секцию.
+-- p_name — префикс имён секций (по умолчанию имя родительской таблицы; миграция
+-- передаёт итоговое имя, пока копия ещё называется <table>_new).
+-- Возвращает число созданных секций.
+DROP FUNCTION IF EXISTS public.ensure_month_partitions(regclass, text, integer, date);
+CREATE OR REPLACE FUNCTION public.ensure_month_partitions(
+    p_parent       regclass,
+    p_key          text,
+    p_months_ahead integer DEFAULT 12,
+    p_from         date DEFAULT NULL,
+    p_name         text DEFAULT NULL
+) RETURNS integer
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_schema  text;
+    v_table   text;
+    v_default regclass;
+    v_cols    text := public.partition_insert_columns(p_parent);
+    v_month   date;
+    v_last    date := (date_trunc('month', now()) + make_interval(months => p_months_ahead))::date;
+    v_part    text;
+    v_moved   bigint;
+    v_created integer := 0;
+BEGIN
+    SELECT n.nspname, COALESCE(p_name, c.relname) INTO v_schema, v_table
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.oid = p_parent;
+
+    v_default := to_regclass(format('%I.%I', v_schema, v_table || '_default'));
+    v_month := date_trunc('month', COALESCE(p_from, now()::date))::date;
+
+    WHILE v_month <= v_last LOOP
+        v_part := format('%s_p%s', v_table, to_char(v_month, 'YYYY_MM'));
+        IF to_regclass(format('%I.%I', v_schema, v_part)) IS NULL THEN
+            v_moved := 0;
+            IF v_default IS NOT NULL THEN
+                EXECUTE format(
+                    'CREATE TEMP TABLE tmp_partition_move ON COMMIT DROP AS '
+                    'SELECT * FROM %s WHERE %I >= $1 AND %I < $2',
+                    v_default, p_key, p_key
+                ) USING v_month, (v_month + interval '1 month')::date;
+                SELECT count(*) INTO v_moved FROM pg_temp.tmp_partition_move;
+                IF v_moved > 0 THEN
+                    EXECUTE format('DELETE FROM %s WHERE %I >= $1 AND %I < $2', v_default, p_key, p_key)
+                        USING v_month, (v_month + interval '1 month')::date;
+                END IF;
+            END IF;
+
+            EXECUTE format(
+                'CREATE TABLE %I.%I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                v_schema, v_part, p_parent, v_month, (v_month + interval '1 month')::date
+            );
+
+            IF v_default IS NOT NULL THEN
+                IF v_moved > 0 THEN
+                    EXECUTE format(
+                        'INSERT INTO %s (%s) OVERRIDING SYSTEM VALUE SELECT %s FROM pg_temp.tmp_partition_move',
+                        p_parent, v_cols, v_cols
+                    );
+                END IF;
+                DROP TABLE pg_temp.tmp_partition_move;
+            END IF;
+            v_created := v_created + 1;
+        END IF;
+        v_month := (v_month + interval '1 month')::date;
+    END LOOP;
+
+    RETURN v_created;
+END;
+$$;
+
+
+CREATE OR REPLACE PROCEDURE public.partition_by_month(
+    p_table        text,
+    p_key          text,
+    p_months_ahead integer DEFAULT 12
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_old      regclass := to_regclass(format('public.%I', p_table));
+    v_new      text := p_table || '_new';
+    v_legacy   text := p_table || '_legacy';
+    v_cols     text;
+    v_pk       text[];
+    v_first    date;
+    v_indexes  text[];
+    v_fks      text[];
+    v_triggers text[];
+    v_stmt     text;
+    v_key_not_null boolean;
+    r          record;
+BEGIN
+    IF v_old IS NULL THEN
+        RAISE EXCEPTION 'Таблица public.% не найдена', p_table;
+    END IF;
+    IF (SELECT relkind FROM pg_class WHERE oid = v_old) = 'p' THEN
+        RAISE NOTICE 'public.% уже секционирована, пропускаем', p_table;
+        RETURN;
+    END IF;
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = v_old AND attname = p_key AND NOT attisdropped
+    ) THEN
+        RAISE EXCEPTION 'В public.% нет колонки %', p_table, p_key;
+    END IF;
+
+    -- 1. Проверки: представления и UNIQUE-индексы без ключа секционирования
+    IF EXISTS (
+        SELECT 1
+        FROM pg_depend d
+        JOIN pg_rewrite rw ON rw.oid = d.objid
+        WHERE d.refobjid = v_old
+          AND rw.ev_class <> v_old
+    ) THEN
+        RAISE EXCEPTION 'На public.% ссылаются представления — пересоздайте их после миграции вручную', p_table;
+    END IF;
+
+    FOR r IN
+        SELECT i.indexrelid::regclass AS idx
+        FROM pg_index i
+        WHERE i.indrelid = v_old
+          AND i.indisunique
+          AND NOT i.indisprimary
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_attribute a
+              WHERE a.attrelid = v_old AND a.attname = p_key AND a.attnum = ANY(i.indkey)
+          )
+    LOOP
+        RAISE EXCEPTION 'UNIQUE-индекс % не содержит % — секционирование изменило бы ограничение', r.idx, p_key;
+    END LOOP;
+
+    -- Чтение не блокируется, запись ждёт до COMMIT: копия не отстаёт от оригинала
+    EXECUTE format('LOCK TABLE %s IN EXCLUSIVE MODE', v_old);
+
+    -- 2. Сохраняем определения, которые нужно перенести на новую таблицу.
+    -- Индексы сразу строятся на <table>_new, поэтому имя таблицы в них подменяется.
+    SELECT array_agg(regexp_replace(
+               pg_get_indexdef(i.indexrelid), ' ON (ONLY )?\S+ USING ', format(' ON public.%I USING ', v_new)
+           ))
+      INTO v_indexes
+      FROM pg_index i
+     WHERE i.indrelid = v_old AND NOT i.indisprimary;
+
+    SELECT array_agg(format('ALTER TABLE public.%I ADD CONSTRAINT %I %s', v_new, c.conname, pg_get_constraintdef(c.oid)))
+      INTO v_fks
+      FROM pg_constraint c
+     WHERE c.conrelid = v_old AND c.contype = 'f';
+
+    -- Триггеры создаются после перестановки имён, определения ссылаются на <table>
+    SELECT array_agg(pg_get_triggerdef(t.oid))
+      INTO v_triggers
+      FROM pg_trigger t
+     WHERE t.tgrelid = v_old AND NOT t.tgisinternal;
+
+    SELECT array_agg(a.attname ORDER BY array_position(c.conkey, a.attnum))
+      INTO v_pk
+      FROM pg_constraint c
+      JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+     WHERE c.conrelid = v_old AND c.contype = 'p';
+
+    -- 3. Секционированная копия с DEFAULT-секцией
+    EXECUTE format(
+        'CREATE TABLE public.%I (LIKE %s INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY '
+        'INCLUDING STORAGE INCLUDING COMMENTS INCLUDING STATISTICS) PARTITION BY RANGE (%I)',
+        v_new, v_old, p_key
+    );
+    EXECUTE format('CREATE TABLE public.%I PARTITION OF public.%I DEFAULT', p_table || '_default', v_new);
+
+    -- Месячные секции до загрузки, чтобы строки сразу ложились по месяцам
+    EXECUTE format('SELECT date_trunc(''month'', min(%I))::date FROM %s', p_key, v_old) INTO v_first;
+    PERFORM public.ensure_month_partitions(
+        to_regclass(format('public.%I', v_new)), p_key, p_months_ahead, v_first, p_table
+    );
+
+    v_cols := public.partition_insert_columns(v_old);
+    EXECUTE format(
+        'INSERT INTO public.%I (%s) OVERRIDING SYSTEM VALUE SELECT %s FROM %s',
+        v_new, v_cols, v_cols, v_old
+    );
+
+    -- identity-колонки получили новый sequence — продолжаем нумерацию
+    FOR r IN
+        SELECT a.attname
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass(format('public.%I', v_new))
+          AND a.attidentity <> ''
+    LOOP
+        EXECUTE format(
+            'SELECT setval(pg_get_serial_sequence(%L, %L), COALESCE((SELECT max(%I) FROM public.%I), 0) + 1, false)',
+            'public.' || v_new, r.attname, r.attname, v_new
+        );
+    END LOOP;
+
+    -- Sequence (serial) теперь принадлежит новой таблице, чтобы DROP legacy её не удалил
+    FOR r IN
+        SELECT s.oid::regclass AS seq, a.attname
+        FROM pg_depend d
+        JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+        JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE d.refobjid = v_old
+          AND d.deptype = 'a'
+    LOOP
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY public.%I.%I', r.seq, v_new, r.attname);
+    END LOOP;
+
+    -- Индексы старой таблицы уступают имена новым
+    FOR r IN
+        SELECT c.relname
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = v_old
+    LOOP
+        EXECUTE format('ALTER INDEX public.%I RENAME TO %I', r.relname, left(r.relname, 55) || '_legacy');
+    END LOOP;
+
+    -- Ключ, индексы, внешние ключи (после загрузки), права
+    IF v_pk IS NOT NULL THEN
+        IF NOT p_key = ANY(v_pk) THEN
+            v_pk := v_pk || p_key;
+        END IF;
+        SELECT attnotnull INTO v_key_not_null
+        FROM pg_attribute
+        WHERE attrelid = v_old AND attname = p_key;
+        IF v_key_not_null THEN
+            EXECUTE format(
+                'ALTER TABLE public.%I ADD CONSTRAINT %I PRIMARY KEY (%s)',
+                v_new, p_table || '_pkey',
+                (SELECT string_agg(quote_ident(col), ', ') FROM unnest(v_pk) AS col)
+            );
+        ELSE
+            -- ключ секционирования допускает NULL: PRIMARY KEY невозможен, оставляем UNIQUE
+            RAISE NOTICE '% допускает NULL — вместо PRIMARY KEY создаётся UNIQUE (%)', p_key, array_to_string(v_pk, ', ');
+            EXECUTE format(
+                'CREATE UNIQUE INDEX %I ON public.%I (%s)',
+                p_table || '_pkey', v_new,
+                (SELECT string_agg(quote_ident(col), ', ') FROM unnest(v_pk) AS col)
+            );
+        END IF;
+    END IF;
+
+    FOREACH v_stmt IN ARRAY COALESCE(v_indexes, '{}') LOOP
+        EXECUTE v_stmt;
+    END LOOP;
+    FOREACH v_stmt IN ARRAY COALESCE(v_fks, '{}') LOOP
+        EXECUTE v_stmt;
+    END LOOP;
+
+    FOR r IN
+        SELECT acl.grantee, acl.privilege_type
+        FROM pg_class c, aclexplode(c.relacl) acl
+        WHERE c.oid = v_old
+    LOOP
+        EXECUTE format(
+            'GRANT %s ON public.%I TO %s',
+            r.privilege_type, v_new,
+            CASE WHEN r.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(r.grantee)) END
+        );
+    END LOOP;
+
+    EXECUTE format('ANALYZE public.%I', v_new);
+
+    -- 4. Перестановка имён: ACCESS EXCLUSIVE держится только до конца транзакции,
+    -- дальше нет тяжёлых шагов
+    -- Входящие внешние ключи (flats_changes → flats_history) на секционированную таблицу
+    -- без UNIQUE(id) не переносятся; для flats_changes их заменяют триггеры
+    -- flats_changes_history_ref / flats_history_changes_guard (см. заголовок)
+    FOR r IN
+        SELECT c.conname, c.conrelid::regclass AS tbl
+        FROM pg_constraint c
+        WHERE c.confrelid = v_old AND c.contype = 'f'
+    LOOP
+        IF EXISTS (
+            SELECT 1 FROM pg_trigger t
+            WHERE t.tgrelid = r.tbl AND t.tgname = 'flats_changes_history_ref'
+        ) THEN
+            RAISE NOTICE 'Удаляем внешний ключ % на % — ссылки проверяет триггер flats_changes_history_ref', r.conname, r.tbl;
+        ELSE
+            RAISE WARNING 'Удаляем внешний ключ % на % — ссылки больше не проверяются', r.conname, r.tbl;
+        END IF;
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', r.tbl, r.conname);
+    END LOOP;
+    FOR r IN
+        SELECT t.tgname FROM pg_trigger t WHERE t.tgrelid = v_old AND NOT t.tgisinternal
+    LOOP
+        EXECUTE format('DROP TRIGGER %I ON %s', r.tgname, v_old);
+    END LOOP;
+
+    EXECUTE format('ALTER TABLE public.%I RENAME TO %I', p_table, v_legacy);
+    EXECUTE format('ALTER TABLE public.%I RENAME TO %I', v_new, p_table);
+
+    FOREACH v_stmt IN ARRAY COALESCE(v_triggers, '{}') LOOP
+        EXECUTE v_stmt;
+    END LOOP;
+
+    RAISE NOTICE 'public.% секционирована по %, старая таблица — public.%', p_table, p_key, v_legacy;
+END;
+$$;
+
+
+-- Замена внешнего ключа flats_changes.flats_history_id → flats_history.id.
+-- Триггеры создаются до миграции (пока ключ ещё есть, проверки просто дублируются)
+-- и переносятся partition_by_month на секционированные таблицы.
+CREATE OR REPLACE FUNCTION public.flats_changes_check_history_ref()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.flats_history_id IS NULL THEN
+        RETURN NULL;
+    END IF;
+    PERFORM 1 FROM public.flats_history WHERE id = NEW.flats_history_id FOR KEY SHARE;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'flats_changes.flats_history_id = % отсутствует в flats_history', NEW.flats_history_id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.flats_history_check_changes_ref()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.id = OLD.id THEN
+        RETURN NULL;
+    END IF;
+    -- UPDATE с переносом строки в другую секцию выполняется как DELETE + INSERT:
+    -- id остаётся в flats_history, это не удаление
+    IF EXISTS (SELECT 1 FROM public.flats_changes WHERE flats_history_id = OLD.id)
+       AND NOT EXISTS (SELECT 1 FROM public.flats_history WHERE id = OLD.id) THEN
+        RAISE EXCEPTION 'На flats_history.id = % ссылается flats_changes', OLD.id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS flats_changes_history_ref ON public.flats_changes;
+CREATE CONSTRAINT TRIGGER flats_changes_history_ref
+    AFTER INSERT OR UPDATE OF flats_history_id ON public.flats_changes
+    FOR EACH ROW EXECUTE FUNCTION public.flats_changes_check_history_ref();
+
+DROP TRIGGER IF EXISTS flats_history_changes_guard ON public.flats_history;
+CREATE CONSTRAINT TRIGGER flats_history_changes_guard
+    AFTER DELETE OR UPDATE OF id ON public.flats_history
+    FOR EACH ROW EXECUTE FUNCTION public.flats_history_check_changes_ref();
+
+
+-- Отдельные транзакции: блокировка flats_history снимается до копирования flats_changes
+CALL public.partition_by_month('flats_history', 'time_source_created', 12);
+CALL public.partition_by_month('flats_changes', 'updated', 12);
@@ -1,18 +1,79 @@
--- DROP PROCEDURE public.process_cian_ads(int4);
+-- ============================================
+-- process_cian_ads: обработка ads_cian пачками, в том числе параллельно
+-- ============================================
+--
+-- Раньше процедура каждый раз делала TRUNCATE общей tmp_flats_history и
+-- сканировала ads_cian целиком (UPDATE пропусков и COUNT(*) по всем
+-- необработанным), поэтому запускать её можно было только в одном сеансе.
+-- Теперь пачка захватывается через FOR UPDATE SKIP LOCKED по частичному
+-- индексу, а tmp_flats_history создаётся временной таблицей сеанса.
+--
+-- Применение (индекс строится без блокировки записи, вне транзакции):
+--     psql "$DATABASE_URL" -f DB/process_cian_ads.sql
+-- Запуск N воркеров (deadlock / serialization failure пачки повторяются с паузой):
+--     python server/process_cian_ads_workers.py --workers 4 --batch-size 1000
 
-CREATE OR REPLACE PROCEDURE public.process_cian_ads(IN p_batch_size integer DEFAULT 1000)
+-- Очередь необработанных объявлений: воркеры забирают пачки по этому индексу
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ads_cian_unprocessed_idx
+    ON public.ads_cian (id)
+    WHERE processed IS FALSE;
+
+
+-- DROP FUNCTION public.process_cian_ads_batch(int4);
+
+-- Обрабатывает одну пачку объявлений ads_cian. Пачка захватывается через
+-- FOR UPDATE SKIP LOCKED, промежуточные данные лежат во временных таблицах
+-- сессии (в том числе tmp_flats_history, которую читает batch_upsert), поэтому
+-- несколько воркеров могут работать одновременно.
+-- Семантика processed / proc_at / debug та же, что у прежней process_cian_ads:
+--   * адреса Московской области и Новомосковского — processed = TRUE, debug.skip_reason;
+--   * найден house_id — processed = TRUE, debug = NULL;
+--   * не найден — processed = NULL, debug с причиной.
+CREATE OR REPLACE FUNCTION public.process_cian_ads_batch(p_batch_size integer DEFAULT 1000)
+RETURNS TABLE(claimed integer, skipped integer, imported integer, failed integer)
  LANGUAGE plpgsql
-AS $procedure$
+AS $function$
+#variable_conflict use_column
 DECLARE
-    now_ts TIMESTAMP := now();
-    v_processed_count INTEGER := 0;
-    v_total_count INTEGER;
-    v_batch_count INTEGER;
+    v_ids INTEGER[];
 BEGIN
+    claimed := 0;
+    skipped := 0;
+    imported := 0;
+    failed := 0;
+
+    ------------------------------------------------------------
+    -- 1. Захват пачки (чужие захваченные строки пропускаем)
+    ------------------------------------------------------------
+    -- id по возрастанию: строки в пачке всегда обрабатываются в одном порядке
+    SELECT array_agg(q.id ORDER BY q.id) INTO v_ids
+    FROM (
+        SELECT c.id
+        FROM ads_cian c
+        WHERE c.processed IS FALSE
+        ORDER BY c.id
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ) q;
+
+    IF v_ids IS NULL THEN
+        RETURN NEXT;
+        RETURN;
+    END IF;
+    claimed := array_length(v_ids, 1);
+
     ------------------------------------------------------------
-    -- 1. Подготовка временных таблиц
+    -- 2. Временные таблицы сессии
+    --    tmp_flats_history во pg_temp перекрывает общую таблицу для batch_upsert()
     ------------------------------------------------------------
-    TRUNCATE TABLE tmp_flats_history;
+    DROP TABLE IF EXISTS pg_temp.tmp_flats_history;
+    DROP TABLE IF EXISTS pg_temp.tmp_cian_enriched;
+    DROP TABLE IF EXISTS pg_temp.tmp_address_parsing;
+    DROP TABLE IF EXISTS pg_temp.tmp_cian_debug;
+
+    CREATE TEMP TABLE tmp_flats_history
+        (LIKE public.tmp_flats_history INCLUDING DEFAULTS)
+        ON COMMIT DROP;
 
     CREATE TEMP TABLE tmp_cian_debug (
         ad_id    INTEGER,
@@ -21,7 +82,7 @@ BEGIN
     ) ON COMMIT DROP;
 
     ------------------------------------------------------------
-    -- 2. Отмечаем все записи, которые нужно пропустить по адресу
+    -- 3. Пропуск адресов вне Москвы (только в своей пачке)
     ------------------------------------------------------------
     UPDATE ads_cian
     SET processed = TRUE,
@@ -33,27 +94,16 @@ BEGIN
                 WHEN address ILIKE '%Новомосковский%' THEN 'Новомосковский'
             END
         )
-    WHERE processed IS FALSE
+    WHERE id = ANY(v_ids)
       AND (address ILIKE '%Московская область%'
            OR address ILIKE '%Новомосковский%');
+    GET DIAGNOSTICS skipped = ROW_COUNT;
 
     ------------------------------------------------------------
-    -- 3. Пересчитываем количество необработанных
-    ------------------------------------------------------------
-    SELECT COUNT(*) INTO v_total_count
-    FROM ads_cian
-    WHERE processed IS FALSE;
-
-    IF v_total_count = 0 THEN
-        RAISE NOTICE 'Нет необработанных записей (все исключены фильтром адреса)';
-        RETURN;
-    END IF;
-
-    ------------------------------------------------------------
-    -- 4. Формируем батч без исключённых адресов
+    -- 4. Обогащение (parse_address один раз на строку)
     ------------------------------------------------------------
     CREATE TEMP TABLE tmp_cian_enriched ON COMMIT DROP AS
-    SELECT 
+    SELECT
         c.id            AS ad_id,
         c.url,
         c.avitoid,
@@ -72,68 +122,43 @@ BEGIN
         c.source_created,
         c.metro_id,
         c.district_id,
-        CASE 
-            WHEN c.address IS NOT NULL THEN
-                (SELECT norm_name FROM public.parse_address(c.address) LIMIT 1)
-            ELSE NULL
-        END AS street,
-        CASE 
-            WHEN c.address IS NOT NULL THEN
-                (SELECT street_type FROM public.parse_address(c.address) LIMIT 1)
-            ELSE 'ул'
-        END AS street_type,
-        CASE 
-            WHEN c.address IS NOT NULL THEN
-                (SELECT house_part FROM public.parse_address(c.address) LIMIT 1)
-            ELSE NULL
-        END AS house,
-        CASE 
+        pa.norm_name    AS street,
+        CASE WHEN c.address IS NOT NULL THEN pa.street_type ELSE 'ул' END AS street_type,
+        pa.house_part   AS house,
+        CASE
             WHEN c.complex ILIKE '%кирпич%' THEN 1
             WHEN c.complex ILIKE '%панель%' THEN 2
             WHEN c.complex ILIKE '%монолит%' THEN 3
             WHEN c.complex ILIKE '%блок%' THEN 4
             ELSE NULL
         END AS house_type_id,
-        CASE 
-            WHEN c.object_type_id IS NOT NULL THEN c.object_type_id
-            ELSE 1
-        END AS object_type_id,
+        COALESCE(c.object_type_id, 1) AS object_type_id,
         c.district_id AS ao_id
     FROM ads_cian c
-    WHERE c.processed IS FALSE
-      AND (
-            c.address IS NULL
-            OR (
-                c.address NOT ILIKE '%Московская область%'
-                AND c.address NOT ILIKE '%Новомосковский%'
-            )
-          )
-    ORDER BY c.id
-    LIMIT p_batch_size;
-
-    GET DIAGNOSTICS v_batch_count = ROW_COUNT;
-    
-    IF v_batch_count = 0 THEN
-        RAISE NOTICE 'Нет записей в батче для обработки';
-        RETURN;
-    END IF;
+    LEFT JOIN LATERAL (
+        SELECT p.norm_name, p.street_type, p.house_part
+        FROM public.parse_address(c.address) p
+        LIMIT 1
+    ) pa ON c.address IS NOT NULL
+    WHERE c.id = ANY(v_ids)
+      AND c.processed IS FALSE;
 
     ------------------------------------------------------------
     -- 5. Адресный матчинг
     ------------------------------------------------------------
     CREATE TEMP TABLE tmp_address_parsing ON COMMIT DROP AS
-    SELECT 
+    SELECT
         e.ad_id,
         e.complex,
         e.address,
-        CASE 
-            WHEN e.complex IS NOT NULL AND e.address IS NOT NULL 
+        CASE
+            WHEN e.complex IS NOT NULL AND e.address IS NOT NULL
             THEN get_house_id_by_jk(e.complex, e.address)
             ELSE NULL
         END AS complex_match_id,
-        CASE 
-            WHEN e.address IS NOT NULL 
-            THEN (SELECT result_id FROM get_house_id_by_address(e.address) LIMIT 1)
+        CASE
+            WHEN e.address IS NOT NULL
+            THEN (SELECT result_id FROM get_house_id_by_address_cached(e.address) LIMIT 1)
             ELSE NULL
         END AS addr_match_id
     FROM tmp_cian_enriched e;
@@ -151,7 +176,7 @@ BEGIN
         time_source_created, time_source_updated,
         avitoid, is_actual, description
     )
-    SELECT 
+    SELECT
         e.ad_id,
         COALESCE(ap.complex_match_id, ap.addr_match_id),
         CASE WHEN e.floor BETWEEN -32768 AND 32767 THEN e.floor::smallint ELSE 0 END,
@@ -184,7 +209,11 @@ BEGIN
     FROM tmp_cian_enriched e
     JOIN tmp_address_parsing ap ON ap.ad_id = e.ad_id
     WHERE e.avitoid IS NOT NULL
-      AND COALESCE(ap.complex_match_id, ap.addr_match_id) IS NOT NULL;
+      AND COALESCE(ap.complex_match_id, ap.addr_match_id) IS NOT NULL
+    -- batch_upsert читает tmp_flats_history в порядке вставки: параллельные пачки
+    -- блокируют строки flats / flats_history в одном порядке, а не встречно
+    ORDER BY COALESCE(ap.complex_match_id, ap.addr_match_id), e.floor, e.rooms, e.avitoid;
+    GET DIAGNOSTICS imported = ROW_COUNT;
 
     ------------------------------------------------------------
     -- 7. Логирование ошибок
@@ -204,6 +233,7 @@ BEGIN
     JOIN tmp_address_parsing ap ON e.ad_id = ap.ad_id
     WHERE e.avitoid IS NULL
        OR COALESCE(ap.complex_match_id, ap.addr_match_id) IS NULL;
+    GET DIAGNOSTICS failed = ROW_COUNT;
 
     ------------------------------------------------------------
     -- 8. Обновление статусов
@@ -212,13 +242,7 @@ BEGIN
     SET processed = TRUE,
         proc_at = now(),
         debug = NULL
-    WHERE id IN (
-        SELECT e.ad_id
-        FROM tmp_cian_enriched e
-        JOIN tmp_address_parsing ap ON ap.ad_id = e.ad_id
-        WHERE e.avitoid IS NOT NULL
-          AND COALESCE(ap.complex_match_id, ap.addr_match_id) IS NOT NULL
-    );
+    WHERE id IN (SELECT t.ad_id FROM tmp_flats_history t);
 
     UPDATE ads_cian
     SET processed = NULL,
@@ -228,16 +252,36 @@ BEGIN
     WHERE ads_cian.id = d.ad_id;
 
     ------------------------------------------------------------
-    -- 9. batch_upsert()
+    -- 9. batch_upsert() по tmp_flats_history этой сессии
     ------------------------------------------------------------
     CALL batch_upsert();
 
-    ------------------------------------------------------------
-    -- 10. Логи
-    ------------------------------------------------------------
-    RAISE NOTICE 'Импорт завершён. В батче: %, всего осталось: %', v_batch_count, v_total_count;
-    RAISE NOTICE 'Успешно импортировано: %', (SELECT COUNT(*) FROM tmp_flats_history);
-    RAISE NOTICE 'Ошибок: %', (SELECT COUNT(*) FROM tmp_cian_debug);
+    RETURN NEXT;
+END;
+$function$
+;
+
+
+-- DROP PROCEDURE public.process_cian_ads(int4);
+
+-- Прежняя точка входа: одна пачка через process_cian_ads_batch.
+-- Для нескольких параллельных воркеров: python server/process_cian_ads_workers.py
+CREATE OR REPLACE PROCEDURE public.process_cian_ads(IN p_batch_size integer DEFAULT 1000)
+ LANGUAGE plpgsql
+AS $procedure$
+DECLARE
+    r RECORD;
+BEGIN
+    SELECT * INTO r FROM public.process_cian_ads_batch(p_batch_size);
+
+    IF r.claimed = 0 THEN
+        RAISE NOTICE 'Нет необработанных записей';
+        RETURN;
+    END IF;
+
+    RAISE NOTICE 'Импорт завершён. В пачке: %, пропущено по адресу: %', r.claimed, r.skipped;
+    RAISE NOTICE 'Успешно импортировано: %', r.imported;
+    RAISE NOTICE 'Ошибок: %', r.failed;
 
 EXCEPTION
     WHEN OTHERS THEN
@@ -248,6 +292,11 @@ $procedure$
 
 -- Permissions
 
+ALTER FUNCTION public.process_cian_ads_batch(int4) OWNER TO postgres;
+GRANT ALL ON FUNCTION public.process_cian_ads_batch(int4) TO public;
+GRANT ALL ON FUNCTION public.process_cian_ads_batch(int4) TO postgres;
+GRANT ALL ON FUNCTION public.process_cian_ads_batch(int4) TO mwww;
+
 ALTER PROCEDURE public.process_cian_ads(int4) OWNER TO postgres;
 GRANT ALL ON PROCEDURE public.process_cian_ads(int4) TO public;
 GRANT ALL ON PROCEDURE public.process_cian_ads(int4) TO postgres;
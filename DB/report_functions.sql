@@ -1,6 +1,9 @@
 -- ============================================
 -- build_flat_report / build_flat_report_analogs
 -- ============================================
+--
+-- build_flat_report читает статистику рынка из users.market_stats_cache,
+-- поэтому сначала применяется DB/market_stats_cache.sql.
 
 CREATE OR REPLACE FUNCTION users.build_flat_report(
     p_tg_user_id BIGINT,
@@ -43,6 +46,7 @@ DECLARE
   v_top_items jsonb;
   v_price_history_subject jsonb;
   v_price_history_comp jsonb;
+  v_stats users.market_stats_cache;
 
   v_report_type text := 'near_rooms';
   v_params jsonb := '{}'::jsonb;
@@ -173,189 +177,35 @@ BEGIN
     v_subject_ppm := NULL;
   END IF;
 
-  -- конкуренты из users.ads (по радиусу) + топ
-  WITH near_houses AS (
-    SELECT p_house_id AS house_id, 0::int AS dist_m
-    UNION ALL
-    SELECT nh.house_id, nh.dist_m
-    FROM public.get_house_near_house(p_house_id, p_radius_m) nh
-  ),
-  ads_raw AS (
-    SELECT
-      a.*,
-      nh.dist_m AS near_dist_m,
-      lower(split_part(coalesce(a.url, ''), '?', 1)) AS norm_url
-    FROM near_houses nh
-    JOIN users.ads a ON a.house_id = nh.house_id
-    WHERE a.price IS NOT NULL
-      AND a.rooms = p_rooms
-      AND (a.status IS NULL OR a.status = TRUE)
-  ),
-  ads_dedup AS (
-    SELECT DISTINCT ON (COALESCE(norm_url, a.id::text))
-      a.id AS ad_id,
-      a.house_id,
-      a.floor,
-      a.rooms,
-      COALESCE(a.near_dist_m, 0) AS dist_m,
-      a.price,
-      COALESCE(a.total_area, a.living_area) AS area_m2,
-      a.kitchen_area,
-      a.living_area,
-      a.total_floors,
-      a.bathroom,
-      a.balcony,
-      a.renovation,
-      a.construction_year,
-      a.house_type,
-      a.ceiling_height,
-      a.furniture,
-      a.metro_station,
-      a.metro_time::smallint AS metro_time,
-      NULL::text AS metro_way,
-      a.url,
-      a.updated_at
-    FROM ads_raw a
-    ORDER BY COALESCE(norm_url, a.id::text), a.updated_at DESC NULLS LAST, a.id DESC
-  ),
-  comps AS (
-    SELECT
-      *,
-      CASE
-        WHEN area_m2 IS NOT NULL AND area_m2 > 0 THEN price::numeric / area_m2
-        ELSE NULL
-      END AS ppm
-    FROM ads_dedup
-  ),
-  stats AS (
-    SELECT
-      COUNT(*)::int AS cnt,
-      percentile_cont(0.25) WITHIN GROUP (ORDER BY ppm) AS p25_ppm,
-      percentile_cont(0.50) WITHIN GROUP (ORDER BY ppm) AS p50_ppm,
-      percentile_cont(0.75) WITHIN GROUP (ORDER BY ppm) AS p75_ppm
-    FROM comps
-    WHERE ppm IS NOT NULL
-  ),
-  pos AS (
-    SELECT
-      CASE
-        WHEN v_subject_ppm IS NULL THEN NULL
-        WHEN (SELECT cnt FROM stats) = 0 THEN NULL
-        ELSE (
-          SELECT (COUNT(*)::numeric / NULLIF((SELECT cnt FROM stats)::numeric,0))
-          FROM comps
-          WHERE ppm IS NOT NULL AND ppm <= v_subject_ppm
-        )
-      END AS position01
-  ),
-  top_items AS (
-    SELECT
-      COALESCE(
-        jsonb_agg(
-          jsonb_build_object(
-            'ad_id', ad_id,
-            'house_id', house_id,
-            'floor', floor,
-            'rooms', rooms,
-            'dist_m', dist_m,
-            'price', price,
-            'area_m2', area_m2,
-            'kitchen_area', kitchen_area,
-            'living_area', living_area,
-            'total_floors', total_floors,
-            'bathroom', bathroom,
-            'balcony', balcony,
-            'renovation', renovation,
-            'construction_year', construction_year,
-            'house_type', house_type,
-            'ceiling_height', ceiling_height,
-            'furniture', furniture,
-            'metro_station', metro_station,
-            'metro_time', metro_time,
-            'metro_way', metro_way,
-            'ppm', ppm,
-            'url', url,
-            'updated', updated_at
-          )
-          ORDER BY ppm ASC NULLS LAST, price ASC
-        ),
-        '[]'::jsonb
-      ) AS items
-    FROM (
-      SELECT * FROM comps
-      ORDER BY ppm ASC NULLS LAST, price ASC
-      LIMIT 20
-    ) t
-  ),
-  tracked_keys AS (
-    SELECT p_house_id AS house_id, p_floor AS floor, p_rooms AS rooms
-    UNION
-    SELECT DISTINCT house_id, floor, rooms FROM comps
-  ),
-  price_history AS (
-    SELECT
-      tk.house_id,
-      tk.floor,
-      tk.rooms,
-      COALESCE(
-        jsonb_agg(
-          jsonb_build_object(
-            'ts', t.ts,
-            'price', t.price
-          )
-          ORDER BY t.ts DESC
-        ) FILTER (WHERE t.ts IS NOT NULL),
-        '[]'::jsonb
-      ) AS history
-    FROM tracked_keys tk
-    LEFT JOIN LATERAL (
-      SELECT fh.time_source_updated AS ts, fh.price
-      FROM public.flats_history fh
-      WHERE fh.house_id = tk.house_id
-        AND fh.floor = tk.floor
-        AND fh.rooms = tk.rooms
-        AND fh.price IS NOT NULL
-      UNION ALL
-      SELECT fc.updated AS ts, fc.price
-      FROM public.flats_changes fc
-      JOIN public.flats_history fh ON fh.id = fc.flats_history_id
-      WHERE fh.house_id = tk.house_id
-        AND fh.floor = tk.floor
-        AND fh.rooms = tk.rooms
-        AND fc.price IS NOT NULL
-    ) t ON TRUE
-    GROUP BY tk.house_id, tk.floor, tk.rooms
-  )
-  SELECT
-    s.cnt, s.p25_ppm, s.p50_ppm, s.p75_ppm,
-    p.position01,
-    ti.items,
-    ph_subject.history AS price_hist_subject,
-    (
-      SELECT COALESCE(jsonb_agg(
-        jsonb_build_object(
-          'house_id', ph.house_id,
-          'floor', ph.floor,
-          'rooms', ph.rooms,
-          'history', ph.history
-        )
-      ), '[]'::jsonb)
-      FROM price_history ph
-      WHERE NOT (ph.house_id = p_house_id AND ph.floor = p_floor AND ph.rooms = p_rooms)
-    ) AS price_hist_comp
-  INTO
-    v_cnt, v_p25_ppm, v_p50_ppm, v_p75_ppm,
-    v_pos,
-    v_top_items,
-    v_price_history_subject,
-    v_price_history_comp
-  FROM stats s
-  CROSS JOIN pos p
-  CROSS JOIN top_items ti
-  LEFT JOIN price_history ph_subject
-    ON ph_subject.house_id = p_house_id
-   AND ph_subject.floor = p_floor
-   AND ph_subject.rooms = p_rooms;
+  -- конкуренты из users.ads (по радиусу) + топ: общая для дома статистика из кэша
+  -- (DB/market_stats_cache.sql), от субъекта зависят только позиция и его история цен
+  v_stats := users.market_stats_get(p_house_id, p_rooms, p_radius_m);
+
+  v_cnt := v_stats.competitors_count;
+  v_p25_ppm := v_stats.ppm_p25;
+  v_p50_ppm := v_stats.ppm_p50;
+  v_p75_ppm := v_stats.ppm_p75;
+  v_top_items := v_stats.top_items;
+
+  IF v_subject_ppm IS NOT NULL AND v_cnt > 0 THEN
+    SELECT COUNT(*)::numeric / v_cnt::numeric
+      INTO v_pos
+      FROM unnest(v_stats.ppm_sorted) AS x(ppm)
+     WHERE x.ppm <= v_subject_ppm;
+  ELSE
+    v_pos := NULL;
+  END IF;
+
+  v_price_history_subject := users.market_price_history(p_house_id, p_floor, p_rooms);
+
+  SELECT COALESCE(jsonb_agg(e.item), '[]'::jsonb)
+    INTO v_price_history_comp
+    FROM jsonb_array_elements(v_stats.comp_history) AS e(item)
+   WHERE NOT (
+         (e.item->>'house_id')::int = p_house_id
+     AND (e.item->>'floor')::int = p_floor
+     AND (e.item->>'rooms')::int = p_rooms
+   );
 
   v_report :=
     jsonb_build_object(
@@ -0,0 +1,121 @@
+"""Пакетный парсинг ссылок с отдельным лимитом параллелизма для каждого источника."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+def _env_limit(env_name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(env_name, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+def source_limits_from_env() -> Dict[str, int]:
+    """Лимиты по источникам: HTTP-источники параллельно, Avito — по числу браузеров."""
+
+    return {
+        "cian": _env_limit("BATCH_CIAN_CONCURRENCY", 6),
+        "yandex": _env_limit("BATCH_YANDEX_CONCURRENCY", 3),
+        "avito": _env_limit("BATCH_AVITO_CONCURRENCY", 1),
+        "unknown": 1,
+    }
+
+
+@dataclass
+class BatchItemResult:
+    """Результат парсинга одной ссылки из пакета."""
+
+    index: int
+    url: str
+    source: str
+    data: Any = None
+    error: Optional[str] = None
+    wait_seconds: float = 0.0
+    parse_seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.data is not None and self.error is None
+
+    def timing(self) -> Dict[str, Any]:
+        """Краткая сводка по времени для ответа API и логов."""
+
+        return {
+            "url": self.url,
+            "source": self.source,
+            "success": self.ok,
+            "wait_ms": round(self.wait_seconds * 1000, 1),
+            "parse_ms": round(self.parse_seconds * 1000, 1),
+            "error": self.error,
+        }
+
+
+class SourceBatchRunner:
+    """
+    Группирует ссылки по источнику и парсит каждую группу со своим семафором.
+
+    Группы выполняются одновременно, результаты возвращаются в порядке входного списка.
+    """
+
+    def __init__(
+        self,
+        classify: Callable[[str], str],
+        limits: Optional[Dict[str, int]] = None,
+        default_limit: int = 1,
+    ) -> None:
+        self._classify = classify
+        self._limits = dict(limits) if limits is not None else source_limits_from_env()
+        self._default_limit = max(1, default_limit)
+
+    def limit_for(self, source: str) -> int:
+        return max(1, self._limits.get(source, self._default_limit))
+
+    async def run(
+        self,
+        urls: Iterable[str],
+        parse: Callable[[str, str], Awaitable[Any]],
+    ) -> List[BatchItemResult]:
+        """
+        Парсит ссылки. ``parse(url, source)`` должен вернуть данные или None;
+        исключения перехватываются и попадают в ``BatchItemResult.error``.
+        """
+
+        items = [
+            BatchItemResult(index=index, url=url, source=self._classify(url))
+            for index, url in enumerate(urls)
+        ]
+        semaphores: Dict[str, asyncio.Semaphore] = {
+            source: asyncio.Semaphore(self.limit_for(source))
+            for source in {item.source for item in items}
+        }
+
+        async def _run_item(item: BatchItemResult) -> None:
+            queued_at = time.perf_counter()
+            async with semaphores[item.source]:
+                started_at = time.perf_counter()
+                item.wait_seconds = started_at - queued_at
+                try:
+                    item.data = await parse(item.url, item.source)
+                    if item.data is None:
+                        item.error = "no_data"
+                except Exception as exc:  # noqa: BLE001
+                    item.error = str(exc) or exc.__class__.__name__
+                finally:
+                    item.parse_seconds = time.perf_counter() - started_at
+
+        await asyncio.gather(*(_run_item(item) for item in items))
+        return items
+
+
+__all__ = [
+    "BatchItemResult",
+    "SourceBatchRunner",
+    "source_limits_from_env",
+]
@@ -0,0 +1,208 @@
+# bot_scheduler.py
+"""
+Планировщик тяжёлых запросов бота (подбор, Excel-отчёт).
+
+- Глобальный пул из BOT_WORKERS воркеров ограничивает число одновременных
+  парсингов, фото-задач и сессий БД.
+- У каждого пользователя своя очередь: одновременно выполняется не больше
+  одного его запроса, в очереди — не больше BOT_MAX_QUEUED_PER_USER.
+- Поставленный в очередь запрос получает сообщение «вы в очереди: N».
+- cancel_user() снимает ожидающие запросы пользователя и прерывает текущий.
+- Метрики: ожидание в очереди и время выполнения (последние N запросов).
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+@dataclass
+class Job:
+    user_id: int
+    run: Callable[[], Awaitable[None]]
+    enqueued_at: float = field(default_factory=time.perf_counter)
+    started_at: Optional[float] = None
+    task: Optional[asyncio.Task] = None
+    cancelled: bool = False
+    # Место в очереди при постановке (с 1); 0 — запрос сразу взят воркером
+    queue_position: int = 0
+
+
+class SchedulerMetrics:
+    """Счётчики и окно последних значений ожидания/выполнения (в секундах)."""
+
+    def __init__(self, window: int = 500):
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.wait_seconds: Deque[float] = deque(maxlen=window)
+        self.run_seconds: Deque[float] = deque(maxlen=window)
+
+    @staticmethod
+    def _percentile(values: Deque[float], q: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "wait_p50": round(self._percentile(self.wait_seconds, 0.5), 2),
+            "wait_p95": round(self._percentile(self.wait_seconds, 0.95), 2),
+            "run_p50": round(self._percentile(self.run_seconds, 0.5), 2),
+            "run_p95": round(self._percentile(self.run_seconds, 0.95), 2),
+        }
+
+
+class BotScheduler:
+    def __init__(self, workers: Optional[int] = None, max_queued_per_user: Optional[int] = None,
+                 log_every: int = 20):
+        self.workers = workers or _env_int("BOT_WORKERS", 4)
+        self.max_queued_per_user = max_queued_per_user or _env_int("BOT_MAX_QUEUED_PER_USER", 3)
+        self.metrics = SchedulerMetrics()
+        self._log_every = log_every
+        self._waiting: List[Job] = []          # общий FIFO ожидающих запросов
+        self._running: Dict[int, Job] = {}     # user_id -> выполняемый запрос
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    # --- жизненный цикл (dp.startup / dp.shutdown) ---
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._cond = asyncio.Condition()
+        for idx in range(self.workers):
+            task = asyncio.create_task(self._worker(), name=f"bot-worker-{idx}")
+            self._tasks.add(task)
+        logging.info(f"Планировщик запущен: воркеров {self.workers}, "
+                     f"очередь на пользователя {self.max_queued_per_user}")
+
+    async def stop(self) -> None:
+        for job in list(self._running.values()):
+            if job.task:
+                job.task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._waiting.clear()
+
+    # --- API для хэндлеров ---
+
+    def queued_count(self, user_id: int) -> int:
+        return sum(1 for job in self._waiting if job.user_id == user_id)
+
+    async def submit(self, user_id: int, run: Callable[[], Awaitable[None]]) -> Optional[Job]:
+        """
+        Ставит запрос в очередь. Возвращает Job, либо None, если у пользователя
+        уже максимум ожидающих запросов. job.queue_position > 0 — запрос ждёт
+        свободного воркера.
+        """
+        if self._cond is None:
+            await self.start()
+        if self.queued_count(user_id) >= self.max_queued_per_user:
+            self.metrics.rejected += 1
+            return None
+        job = Job(user_id=user_id, run=run)
+        async with self._cond:
+            # Запрос стартует сразу, если у пользователя ничего не выполняется
+            # и свободных воркеров хватает на всех, кто может стартовать раньше него
+            runnable_ahead = sum(1 for queued in self._waiting if queued.user_id not in self._running)
+            starts_now = (user_id not in self._running
+                          and len(self._running) + runnable_ahead < self.workers)
+            job.queue_position = 0 if starts_now else len(self._waiting) + 1
+            self._waiting.append(job)
+            self._cond.notify_all()
+        return job
+
+    async def cancel_user(self, user_id: int) -> int:
+        """Отменяет ожидающие и текущий запросы пользователя; возвращает их число."""
+        if self._cond is None:
+            return 0
+        cancelled = 0
+        async with self._cond:
+            for job in [job for job in self._waiting if job.user_id == user_id]:
+                self._waiting.remove(job)
+                job.cancelled = True
+                cancelled += 1
+                self.metrics.cancelled += 1
+        running = self._running.get(user_id)
+        if running and running.task and not running.task.done():
+            running.cancelled = True
+            running.task.cancel()
+            cancelled += 1
+        return cancelled
+
+    def stats(self) -> Dict[str, float]:
+        data = self.metrics.snapshot()
+        data.update(waiting=len(self._waiting), running=len(self._running), workers=self.workers)
+        return data
+
+    # --- воркеры ---
+
+    def _next_job(self) -> Optional[Job]:
+        # Первый по порядку запрос пользователя, у которого сейчас ничего не выполняется
+        for job in self._waiting:
+            if job.user_id not in self._running:
+                return job
+        return None
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: self._next_job() is not None)
+                job = self._next_job()
+                self._waiting.remove(job)
+                self._running[job.user_id] = job
+            try:
+                await self._execute(job)
+            finally:
+                async with self._cond:
+                    self._running.pop(job.user_id, None)
+                    self._cond.notify_all()
+
+    async def _execute(self, job: Job) -> None:
+        job.started_at = time.perf_counter()
+        wait = job.started_at - job.enqueued_at
+        job.task = asyncio.create_task(job.run())
+        # asyncio.wait не пробрасывает отмену задачи в воркер
+        await asyncio.wait({job.task})
+        run = time.perf_counter() - job.started_at
+
+        if job.task.cancelled():
+            self.metrics.cancelled += 1
+            outcome = "отменён"
+        elif job.task.exception() is not None:
+            self.metrics.failed += 1
+            outcome = f"ошибка: {job.task.exception()}"
+        else:
+            self.metrics.completed += 1
+            outcome = "выполнен"
+        self.metrics.wait_seconds.append(wait)
+        self.metrics.run_seconds.append(run)
+        logging.info(f"Запрос пользователя {job.user_id} {outcome}: "
+                     f"ожидание {wait:.2f} с, выполнение {run:.2f} с")
+
+        finished = self.metrics.completed + self.metrics.failed + self.metrics.cancelled
+        if finished % self._log_every == 0:
+            logging.info(f"Метрики планировщика: {self.stats()}")
+
+
+scheduler = BotScheduler()
@@ -0,0 +1,135 @@
+"""Ожидания по событиям страницы для Selenium вместо фиксированных пауз."""
+
+from __future__ import annotations
+
+import os
+from typing import Iterable, List, Optional, Sequence
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Картинки, шрифты и счётчики аналитики парсеру не нужны — блокируем их через CDP
+BLOCKED_URL_PATTERNS: List[str] = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*mc.yandex.ru*", "*an.yandex.ru*", "*yandex.ru/ads*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*",
+    "*top-fwz1.mail.ru*", "*counter.yadro.ru*", "*vk.com/rtrg*",
+    "*stats.avito.ru*", "*clickstream.avito.ru*",
+]
+
+_DOM_IDLE_SCRIPT = """
+const idleMs = arguments[0];
+const timeoutMs = arguments[1];
+const done = arguments[arguments.length - 1];
+let idleTimer = null;
+let hardTimer = null;
+let finished = false;
+const observer = new MutationObserver(() => {
+    clearTimeout(idleTimer);
+    idleTimer = setTimeout(() => finish(true), idleMs);
+});
+function finish(idle) {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(idleTimer);
+    clearTimeout(hardTimer);
+    done(idle);
+}
+// Только добавление/удаление узлов: тикеры, таймеры и карусели меняют атрибуты и
+// текст непрерывно и иначе не дали бы странице «успокоиться» до таймаута
+observer.observe(document.documentElement || document, {childList: true, subtree: true});
+idleTimer = setTimeout(() => finish(true), idleMs);
+hardTimer = setTimeout(() => finish(false), timeoutMs);
+"""
+
+
+def resource_blocking_enabled() -> bool:
+    return os.getenv("BROWSER_BLOCK_RESOURCES", "true").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def enable_request_blocking(driver, patterns: Optional[Iterable[str]] = None) -> bool:
+    """Включает блокировку картинок, шрифтов и аналитики через CDP (Network.setBlockedURLs)."""
+
+    if not resource_blocking_enabled():
+        return False
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd(
+            "Network.setBlockedURLs",
+            {"urls": list(patterns) if patterns is not None else BLOCKED_URL_PATTERNS},
+        )
+        return True
+    except Exception as exc:  # noqa: BLE001
+        print(f"⚠️ Не удалось включить блокировку ресурсов через CDP: {exc}")
+        return False
+
+
+def wait_for_document_ready(driver, timeout: float = 10.0) -> bool:
+    """Ждёт, пока document.readyState станет interactive/complete."""
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+            lambda d: d.execute_script("return document.readyState") in ("interactive", "complete")
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_for_any(driver, selectors: Sequence[str], timeout: float = 10.0) -> Optional[str]:
+    """Ждёт появления элемента по любому из CSS-селекторов; возвращает сработавший селектор."""
+
+    def _first_present(d):
+        for selector in selectors:
+            if d.find_elements(By.CSS_SELECTOR, selector):
+                return selector
+        return False
+
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.1).until(_first_present)
+    except TimeoutException:
+        return None
+
+
+def wait_for_dom_idle(driver, idle_ms: int = 300, timeout: float = 5.0) -> bool:
+    """
+    Ждёт, пока в DOM не добавляются и не удаляются узлы ``idle_ms`` миллисекунд
+    (MutationObserver, childList). Изменения атрибутов и текста не учитываются.
+
+    Возвращает False, если страница так и не успокоилась за ``timeout`` секунд.
+    """
+
+    timeout_ms = int(timeout * 1000)
+    try:
+        driver.set_script_timeout(timeout + 2)
+        return bool(driver.execute_async_script(_DOM_IDLE_SCRIPT, idle_ms, timeout_ms))
+    except Exception as exc:  # noqa: BLE001
+        print(f"⚠️ Ошибка ожидания простоя DOM: {exc}")
+        return False
+
+
+def wait_for_count_increase(driver, selector: str, previous: int, timeout: float = 5.0) -> int:
+    """Ждёт, пока число элементов по селектору превысит ``previous``; возвращает текущее число."""
+
+    def _increased(d):
+        count = len(d.find_elements(By.CSS_SELECTOR, selector))
+        return count if count > previous else False
+
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.1).until(_increased)
+    except TimeoutException:
+        return len(driver.find_elements(By.CSS_SELECTOR, selector))
+
+
+__all__ = [
+    "BLOCKED_URL_PATTERNS",
+    "enable_request_blocking",
+    "resource_blocking_enabled",
+    "wait_for_any",
+    "wait_for_count_increase",
+    "wait_for_document_ready",
+    "wait_for_dom_idle",
+]
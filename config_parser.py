@@ -24,8 +24,8 @@ METRO_ID = 2 # Парсим только Бульвар Рокоссовског
 # Рекомендуется: 3-5 секунд для избежания блокировки
 PAGE_DELAY = 5
 
-# Задержка после загрузки страницы (в секундах)
-# Рекомендуется: 3-5 секунд для полной загрузки
+# Максимальное ожидание появления карточек после загрузки страницы (в секундах)
+# Парсер продолжает сразу, как только карточки появились
 PAGE_LOAD_DELAY = 5
 
 # ========== НАСТРОЙКИ ПЛАВНОЙ ПРОКРУТКИ ==========
@@ -33,8 +33,8 @@ PAGE_LOAD_DELAY = 5
 # Включить плавную прокрутку для постепенной загрузки карточек
 ENABLE_SMOOTH_SCROLL = True
 
-# Пауза между прокрутками (в секундах)
-# Рекомендуется: 1.5-3 секунды для естественной загрузки
+# Базовое ожидание подгрузки новых карточек после прокрутки (в секундах)
+# Фактически ждем до SCROLL_PAUSE * 3, но продолжаем сразу после появления карточек
 SCROLL_PAUSE = 1.5
 
 # Максимальное количество попыток прокрутки
@@ -0,0 +1,126 @@
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from excel_stream import CSV_SUFFIXES, iter_batches, parquet_available, parquet_path_for
+from generate_pg_schema import SchemaInference
+from insert_all_batches import convert_column
+
+# Inferred SQL type -> (information_schema data_type for convert_column, Arrow type name).
+TYPE_MAP = {
+    "BOOLEAN": ("boolean", "bool_"),
+    "BIGINT": ("bigint", "int64"),
+    "DOUBLE PRECISION": ("double precision", "float64"),
+    "TIMESTAMP": ("timestamp without time zone", "timestamp_us"),
+    "TEXT": ("text", "string"),
+}
+
+
+def arrow_type(name: str) -> Any:
+    import pyarrow as pa
+
+    if name == "timestamp_us":
+        return pa.timestamp("us")
+    return getattr(pa, name)()
+
+
+def convert_to_parquet(
+    source: Path,
+    target: Path,
+    sheet: Optional[str] = None,
+    batch_size: int = 50000,
+    csv_options: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    Two streaming passes over the source: the first fixes column types
+    (SchemaInference over every row), the second writes row groups of
+    batch_size rows with those types. Memory holds one batch at a time.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    is_csv = source.suffix.lower() in CSV_SUFFIXES
+    if is_csv:
+        # Read CSV as text; the inferred types decide, not per-chunk pandas guesses.
+        csv_options = {"dtype": str, **(csv_options or {})}
+
+    inference = SchemaInference(parse_strings=is_csv)
+    for df in iter_batches(source, sheet=sheet, batch_size=batch_size, csv_options=csv_options):
+        inference.update(df)
+    column_types = inference.column_types()
+    schema = pa.schema([(col, arrow_type(TYPE_MAP[sql_type][1])) for col, sql_type in column_types.items()])
+    pg_types = [TYPE_MAP[sql_type][0] for sql_type in column_types.values()]
+
+    # Write to a temp file first so a half-written file never looks like a valid cache.
+    partial = target.with_name(target.name + ".partial")
+    written = 0
+    with pq.ParquetWriter(str(partial), schema, compression="zstd") as writer:
+        for df in iter_batches(source, sheet=sheet, batch_size=batch_size, csv_options=csv_options):
+            df.columns = [str(col) for col in df.columns]
+            arrays = [
+                pa.array(convert_column(df[col], pg_type), type=field.type)
+                for col, pg_type, field in zip(column_types, pg_types, schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            written += len(df)
+    partial.replace(target)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert an Excel sheet or CSV file to Parquet once, so later runs skip XLSX parsing."
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        default="server/Обработка БД.xlsx",
+        help="Path to the Excel/CSV file (default: server/Обработка БД.xlsx)",
+    )
+    parser.add_argument(
+        "-s",
+        "--sheet",
+        default=None,
+        help="Sheet name or index (0-based). Defaults to the first sheet.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Output .parquet path (default: next to the source, which the other tools pick up automatically).",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=50000,
+        help="Rows per batch and per Parquet row group (default: 50000).",
+    )
+    parser.add_argument("--csv-sep", default=",", help='CSV field separator (default: ",").')
+    parser.add_argument("--csv-encoding", default="utf-8", help='CSV encoding (default: "utf-8").')
+    args = parser.parse_args()
+
+    if not parquet_available():
+        raise SystemExit("pyarrow is not installed: pip install pyarrow")
+
+    file_path = Path(args.path).expanduser()
+    if not file_path.is_file():
+        raise FileNotFoundError(f"File not found: {file_path}")
+    target = Path(args.output).expanduser() if args.output else parquet_path_for(file_path, args.sheet)
+
+    started = time.perf_counter()
+    rows = convert_to_parquet(
+        file_path,
+        target,
+        sheet=args.sheet,
+        batch_size=args.batch_size,
+        csv_options={"sep": args.csv_sep, "encoding": args.csv_encoding},
+    )
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed > 0 else 0.0
+    print(f"Done. Wrote {rows} rows to {target} in {elapsed:.1f}s ({rate:,.0f} rows/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,12 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 # Database pool
 _db_pool: asyncpg.Pool | None = None
 
+# Версия DDL из init_schema. Увеличивать при каждом изменении схемы users.requests/users.listings.
+SCHEMA_VERSION = 1
+SCHEMA_COMPONENT = 'bot_listings'
+_schema_ready = False
+_schema_lock = asyncio.Lock()
+
 async def _get_pool() -> asyncpg.Pool:
     global _db_pool
     if _db_pool is None:
@@ -77,8 +83,57 @@ async def init_schema(conn: asyncpg.Connection) -> None:
         ts TIMESTAMP NOT NULL,
         other JSONB
     );
+
+    CREATE TABLE IF NOT EXISTS users.schema_versions (
+        component TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT now()
+    );
     """)
 
+
+async def _schema_version(conn: asyncpg.Connection) -> int | None:
+    # to_regclass не берёт блокировок и не падает, если таблицы ещё нет
+    if not await conn.fetchval("SELECT to_regclass('users.schema_versions') IS NOT NULL"):
+        return None
+    return await conn.fetchval(
+        "SELECT version FROM users.schema_versions WHERE component = $1", SCHEMA_COMPONENT
+    )
+
+
+async def ensure_schema() -> None:
+    """
+    Применяет init_schema один раз на процесс и только если версия схемы в БД
+    меньше SCHEMA_VERSION. Вызывается при старте бота; save_listings вызывает
+    её тоже, но после первого успеха это просто проверка флага.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    async with _schema_lock:
+        if _schema_ready:
+            return
+        pool = await _get_pool()
+        async with pool.acquire() as conn:
+            version = await _schema_version(conn)
+            if version is None or version < SCHEMA_VERSION:
+                async with conn.transaction():
+                    # Несколько процессов бота не должны выполнять DDL одновременно
+                    await conn.execute("SELECT pg_advisory_xact_lock(hashtext('db_handler.init_schema'))")
+                    version = await _schema_version(conn)
+                    if version is None or version < SCHEMA_VERSION:
+                        await init_schema(conn)
+                        await conn.execute(
+                            """
+                            INSERT INTO users.schema_versions(component, version, applied_at)
+                            VALUES ($1, $2, now())
+                            ON CONFLICT (component) DO UPDATE
+                            SET version = EXCLUDED.version, applied_at = EXCLUDED.applied_at
+                            """,
+                            SCHEMA_COMPONENT, SCHEMA_VERSION
+                        )
+        _schema_ready = True
+
 def clean_numeric(value: any) -> Decimal | None:
     if value is None:
         return None
@@ -141,8 +196,24 @@ def parse_lifts(text: any) -> tuple[int | None, int | None]:
     lift_g = int(g_nums[0]) if g_nums else None
     return lift_p, lift_g
 
-# Main save_listing function
-async def save_listing(conn: asyncpg.Connection, listing: dict, request_id: int) -> None:
+LISTING_COLUMNS = [
+    'request_id', 'url', 'status', 'labels', 'rooms', 'price',
+    'total_views', 'views_today', 'unique_views', 'floor', 'floors',
+    'total_area', 'living_area', 'kitchen_area', 'bathroom_num', 'bathroom_type',
+    'balcony_num', 'balcony_type', 'view_from_windows', 'renovation',
+    'furnished_binary', 'year_built', 'series', 'house_type', 'overlap_type',
+    'entrances', 'heating', 'emergency', 'gas', 'ceiling_height',
+    'garbage_chute', 'parking', 'lift_p', 'lift_g',
+    'min_metro', 'metro', 'housing_type', 'address', 'ts', 'other',
+]
+
+INSERT_LISTING_SQL = "INSERT INTO users.listings({}) VALUES ({})".format(
+    ', '.join(LISTING_COLUMNS),
+    ', '.join(f'${i}' for i in range(1, len(LISTING_COLUMNS) + 1)),
+)
+
+# Convert one parsed listing into a users.listings row (in LISTING_COLUMNS order)
+def listing_row(listing: dict, request_id: int, ts: datetime | None = None) -> tuple:
     listing = {k.replace('\u00A0', ' '): v for k, v in listing.items()}
 
     # Убрали отладочный вывод лифтов
@@ -192,7 +263,8 @@ async def save_listing(conn: asyncpg.Connection, listing: dict, request_id: int)
     year_built = int(year_val) if year_val is not None else None
 
     # Timestamp
-    ts = datetime.now(pytz.timezone("Europe/Moscow")).replace(tzinfo=None, microsecond=0)
+    if ts is None:
+        ts = datetime.now(pytz.timezone("Europe/Moscow")).replace(tzinfo=None, microsecond=0)
 
     # Other JSONB
     known = {
@@ -205,29 +277,7 @@ async def save_listing(conn: asyncpg.Connection, listing: dict, request_id: int)
     }
     other = {k: v for k, v in listing.items() if k not in known}
 
-    # Execute insert
-    await conn.execute(
-        """
-INSERT INTO users.listings(
-    request_id, url, status, labels, rooms, price,
-    total_views, views_today, unique_views, floor, floors,
-    total_area, living_area, kitchen_area, bathroom_num, bathroom_type,
-    balcony_num, balcony_type, view_from_windows, renovation,
-    furnished_binary, year_built, series, house_type, overlap_type,
-    entrances, heating, emergency, gas, ceiling_height,
-    garbage_chute, parking, lift_p, lift_g,
-    min_metro, metro, housing_type, address, ts, other
-) VALUES (
-    $1, $2, $3, $4, $5, $6,
-    $7, $8, $9, $10, $11,
-    $12, $13, $14, $15, $16,
-    $17, $18, $19, $20,
-    $21, $22, $23, $24, $25,
-    $26, $27, $28, $29, $30,
-    $31, $32, $33, $34, $35,
-    $36, $37, $38, $39, $40
-)
-        """,
+    return (
         request_id, url, status, labels, rooms, price,
         total_views, views_today, unique_views, floor_num, floors,
         total_area, living_area, kitchen_area, bathroom_num, bathroom_type,
@@ -239,26 +289,34 @@ INSERT INTO users.listings(
         json.dumps(other, ensure_ascii=False)
     )
 
+# Single-listing insert (save_listings пишет пачкой через COPY)
+async def save_listing(conn: asyncpg.Connection, listing: dict, request_id: int) -> None:
+    await conn.execute(INSERT_LISTING_SQL, *listing_row(listing, request_id))
+
 async def save_listings(listings: List[Dict], user_id: int) -> int:
+    if not isinstance(user_id, int):
+        raise ValueError(f"user_id must be int, got {type(user_id).__name__}")
+    await ensure_schema()
     pool = await _get_pool()
     async with pool.acquire() as conn:
-        await init_schema(conn)
-        if not isinstance(user_id, int):
-            raise ValueError(f"user_id must be int, got {type(user_id).__name__}")
-
         # отметка времени без микросекунд, без tzinfo
         ts = datetime.now(pytz.timezone("Europe/Moscow")).replace(tzinfo=None, microsecond=0)
 
-        # создаём запись в requests и получаем её id
-        row = await conn.fetchrow(
-            "INSERT INTO users.requests(userid, ts) VALUES($1::bigint, $2) RETURNING id",
-            user_id, ts
-        )
-        request_id = row["id"]
-
-        # сохраняем каждый listing
-        for lst in listings:
-            await save_listing(conn, lst, request_id)
+        # запрос и все его объявления — одна транзакция
+        async with conn.transaction():
+            # создаём запись в requests и получаем её id
+            row = await conn.fetchrow(
+                "INSERT INTO users.requests(userid, ts) VALUES($1::bigint, $2) RETURNING id",
+                user_id, ts
+            )
+            request_id = row["id"]
+
+            # все listings одним COPY вместо INSERT на каждое объявление
+            records = [listing_row(lst, request_id, ts) for lst in listings]
+            if records:
+                await conn.copy_records_to_table(
+                    'listings', schema_name='users', columns=LISTING_COLUMNS, records=records
+                )
 
     # возвращаем request_id вызывающему
     return request_id
@@ -0,0 +1,79 @@
+# excel_report.py
+"""
+Однопроходная запись Excel-отчётов бота.
+
+openpyxl в режиме write_only пишет строки сразу в поток: стили заголовков и
+форматы чисел задаются при добавлении строки, файл не перечитывается и не
+пересохраняется. Используется в export_listings_to_excel и в файле похожих
+объявлений (text_handlers).
+"""
+from io import BytesIO
+from typing import Any, Dict, Iterable, Optional
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+BOLD = Font(bold=True)
+THOUSANDS_FORMAT = '#,##0'
+
+
+def _plain(value: Any) -> Any:
+    """numpy-скаляры -> Python, NaN/NaT/pd.NA -> пустая ячейка"""
+    if value is None:
+        return None
+    if type(value).__module__ == 'numpy':
+        value = value.item()
+    try:
+        if value != value:  # NaN, NaT
+            return None
+    except TypeError:  # pd.NA
+        return None
+    return value
+
+
+class ExcelReportWriter:
+    """Лист Excel, который пишется строка за строкой и сохраняется один раз."""
+
+    def __init__(self, sheet_title: Optional[str] = None):
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet(title=sheet_title)
+        self.rows_written = 0
+
+    def _cell(self, value: Any, bold: bool = False, number_format: Optional[str] = None) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self._ws, value=_plain(value))
+        if bold:
+            cell.font = BOLD
+        # Формат только для чисел: текст вроде "по запросу" оставляем как есть
+        if number_format and isinstance(cell.value, (int, float)) and not isinstance(cell.value, bool):
+            cell.number_format = number_format
+        return cell
+
+    def append_header(self, values: Iterable[Any]) -> None:
+        """Строка жирных заголовков"""
+        self._ws.append([self._cell(value, bold=True) for value in values])
+        self.rows_written += 1
+
+    def append_title(self, text: Any) -> None:
+        """Жирный заголовок группы в первой колонке"""
+        self.append_header([text])
+
+    def append_row(self, values: Iterable[Any], number_formats: Optional[Dict[int, str]] = None) -> None:
+        """Строка данных; number_formats — {индекс колонки с 0: формат}"""
+        formats = number_formats or {}
+        self._ws.append([self._cell(value, number_format=formats.get(idx)) for idx, value in enumerate(values)])
+        self.rows_written += 1
+
+    def append_blank(self) -> None:
+        self._ws.append([])
+        self.rows_written += 1
+
+    def save(self, output_path: Optional[str] = None) -> BytesIO:
+        """Сохраняет книгу в BytesIO (и, если задан путь, те же байты на диск)"""
+        bio = BytesIO()
+        self._wb.save(bio)
+        bio.seek(0)
+        if output_path:
+            with open(output_path, 'wb') as f:
+                f.write(bio.getbuffer())
+        return bio
@@ -0,0 +1,246 @@
+"""Single-pass streaming reader for large Excel sheets (and CSV/Parquet files).
+
+pd.read_excel(skiprows=..., nrows=...) re-parses the workbook from the top for
+every batch. Here the workbook is opened once in openpyxl read_only mode and
+row batches are cut from one iterator. Parquet files written by
+convert_to_parquet.py are read through memory-mapped Arrow when pyarrow is installed.
+"""
+
+from __future__ import annotations
+
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for Parquet
+    pa = None
+    pq = None
+
+
+def _is_blank(row: Sequence[Any]) -> bool:
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in row)
+
+
+def make_header(raw: Sequence[Any]) -> List[str]:
+    """Column names the way pandas builds them: "Unnamed: N" for empty cells, "name.1" for duplicates."""
+    header: List[str] = []
+    seen: dict[str, int] = {}
+    for idx, value in enumerate(raw):
+        name = f"Unnamed: {idx}" if value is None or str(value).strip() == "" else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+    return header
+
+
+def resolve_sheet(workbook: Any, sheet: str | int | None) -> Any:
+    if sheet is None:
+        return workbook.worksheets[0]
+    if isinstance(sheet, str) and sheet in workbook.sheetnames:
+        return workbook[sheet]
+    if isinstance(sheet, int) or (isinstance(sheet, str) and sheet.isdigit()):
+        return workbook.worksheets[int(sheet)]
+    available = ", ".join(workbook.sheetnames)
+    raise ValueError(f"Worksheet named {sheet!r} not found. Available sheets: {available}")
+
+
+def iter_rows(path: Path, sheet: str | int | None = None) -> Tuple[List[str], Iterator[Tuple[Any, ...]]]:
+    """
+    Returns (header, data rows iterator). Blank rows inside the sheet are kept
+    (as pandas does), trailing blank rows are dropped.
+    """
+    workbook = load_workbook(filename=str(path), read_only=True, data_only=True)
+    worksheet = resolve_sheet(workbook, sheet)
+    # Dimensions stored in the file are often wrong; read until the real end.
+    worksheet.reset_dimensions()
+    rows = worksheet.iter_rows(values_only=True)
+    try:
+        raw_header = next(rows)
+    except StopIteration:
+        workbook.close()
+        return [], iter(())
+    header = make_header(raw_header)
+    width = len(header)
+
+    def _data() -> Iterator[Tuple[Any, ...]]:
+        pending_blank: List[Tuple[Any, ...]] = []
+        try:
+            for row in rows:
+                row = tuple(row[:width]) + (None,) * (width - len(row))
+                if _is_blank(row):
+                    pending_blank.append(row)
+                    continue
+                if pending_blank:
+                    yield from pending_blank
+                    pending_blank = []
+                yield row
+        finally:
+            workbook.close()
+
+    return header, _data()
+
+
+def iter_excel_batches(
+    path: Path,
+    sheet: str | int | None = None,
+    batch_size: int = 10000,
+    start_offset: int = 0,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields DataFrames of up to batch_size data rows, skipping the first
+    start_offset data rows (same meaning as the --start-offset of insert_all_batches).
+    """
+    header, rows = iter_rows(path, sheet)
+    if not header:
+        return
+    if columns is not None:
+        missing = [col for col in columns if col not in header]
+        if missing:
+            raise KeyError(f"Columns not found in sheet: {missing}")
+    if start_offset > 0:
+        # Skipped rows are still parsed once, but never converted to DataFrames.
+        for _ in islice(rows, start_offset):
+            pass
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        df = pd.DataFrame.from_records(chunk, columns=header)
+        yield df[list(columns)] if columns is not None else df
+
+
+EXCEL_SUFFIXES = {".xlsx", ".xlsm"}
+CSV_SUFFIXES = {".csv"}
+PARQUET_SUFFIXES = {".parquet"}
+
+
+def iter_csv_batches(
+    path: Path,
+    batch_size: int = 10000,
+    start_offset: int = 0,
+    columns: Optional[Sequence[str]] = None,
+    csv_options: Optional[Dict[str, Any]] = None,
+) -> Iterator[pd.DataFrame]:
+    options = dict(csv_options or {})
+    if start_offset > 0:
+        options["skiprows"] = range(1, start_offset + 1)
+    for df in pd.read_csv(path, chunksize=batch_size, **options):
+        if columns is not None:
+            missing = [col for col in columns if col not in df.columns]
+            if missing:
+                raise KeyError(f"Columns not found in file: {missing}")
+            df = df[list(columns)]
+        yield df
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def parquet_path_for(path: Path, sheet: str | int | None = None) -> Path:
+    """Where convert_to_parquet.py puts the Parquet copy: book.parquet or book.<sheet>.parquet."""
+    path = Path(path)
+    if sheet is None or path.suffix.lower() in CSV_SUFFIXES:
+        return path.with_suffix(".parquet")
+    return path.with_name(f"{path.stem}.{sheet}.parquet")
+
+
+def prefer_parquet(path: Path, sheet: str | int | None = None) -> Path:
+    """
+    Returns the Parquet copy of an Excel/CSV source if it exists, is not older
+    than the source and pyarrow is installed; otherwise the source itself.
+    """
+    path = Path(path)
+    if path.suffix.lower() in PARQUET_SUFFIXES or not parquet_available():
+        return path
+    cached = parquet_path_for(path, sheet)
+    if cached.is_file() and cached.stat().st_mtime >= path.stat().st_mtime:
+        return cached
+    return path
+
+
+def _require_pyarrow() -> None:
+    if pq is None:
+        raise ImportError("Reading Parquet needs pyarrow: pip install pyarrow")
+
+
+def _arrow_to_pandas(table: Any) -> pd.DataFrame:
+    # Nullable pandas dtypes keep integers exact when a column has NULLs.
+    mapping = {pa.int64(): pd.Int64Dtype(), pa.int32(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}
+    return table.to_pandas(types_mapper=mapping.get)
+
+
+def iter_parquet_batches(
+    path: Path,
+    batch_size: int = 10000,
+    start_offset: int = 0,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    _require_pyarrow()
+    parquet = pq.ParquetFile(str(path), memory_map=True)
+    if columns is not None:
+        missing = [col for col in columns if col not in parquet.schema_arrow.names]
+        if missing:
+            raise KeyError(f"Columns not found in file: {missing}")
+
+    # Whole row groups before start_offset are skipped via metadata, without reading them.
+    metadata = parquet.metadata
+    first_group, skip = 0, max(start_offset, 0)
+    while first_group < metadata.num_row_groups and skip >= metadata.row_group(first_group).num_rows:
+        skip -= metadata.row_group(first_group).num_rows
+        first_group += 1
+    if first_group >= metadata.num_row_groups:
+        return
+
+    buffer: List[Any] = []
+    buffered = 0
+    for batch in parquet.iter_batches(
+        batch_size=batch_size,
+        row_groups=range(first_group, metadata.num_row_groups),
+        columns=list(columns) if columns is not None else None,
+    ):
+        if skip:
+            dropped = min(skip, batch.num_rows)
+            batch = batch.slice(dropped)
+            skip -= dropped
+        if not batch.num_rows:
+            continue
+        buffer.append(batch)
+        buffered += batch.num_rows
+        # Record batches stop at row group borders; re-cut them into batch_size rows.
+        while buffered >= batch_size:
+            table = pa.Table.from_batches(buffer)
+            yield _arrow_to_pandas(table.slice(0, batch_size))
+            rest = table.slice(batch_size)
+            buffer, buffered = rest.to_batches(), rest.num_rows
+    if buffered:
+        yield _arrow_to_pandas(pa.Table.from_batches(buffer))
+
+
+def iter_batches(
+    path: Path,
+    sheet: str | int | None = None,
+    batch_size: int = 10000,
+    start_offset: int = 0,
+    columns: Optional[Sequence[str]] = None,
+    csv_options: Optional[Dict[str, Any]] = None,
+) -> Iterator[pd.DataFrame]:
+    """iter_excel_batches / iter_csv_batches / iter_parquet_batches by file extension."""
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        return iter_parquet_batches(path, batch_size, start_offset, columns)
+    if suffix in CSV_SUFFIXES:
+        return iter_csv_batches(path, batch_size, start_offset, columns, csv_options)
+    if suffix in EXCEL_SUFFIXES:
+        return iter_excel_batches(path, sheet, batch_size, start_offset, columns)
+    raise ValueError(f"Unsupported file type: {path}")
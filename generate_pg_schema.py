@@ -1,17 +1,61 @@
 import argparse
+from itertools import islice
 from pathlib import Path
+from typing import Dict, Iterable, Optional
 
 import pandas as pd
 
+from excel_stream import PARQUET_SUFFIXES, iter_batches, prefer_parquet
 
-def infer_sql_type(series: pd.Series) -> str:
+TRUE_FALSE_STRINGS = {"true", "false"}
+
+
+def merge_sql_types(left: Optional[str], right: Optional[str]) -> Optional[str]:
     """
-    Infer a reasonable PostgreSQL column type from a pandas Series.
-    Falls back to TEXT when unsure.
+    Join of two column types in the lattice
+    EMPTY < BOOLEAN | BIGINT | TIMESTAMP < TEXT, BIGINT < DOUBLE PRECISION < TEXT.
+    None stands for EMPTY (no non-null values seen yet).
+    """
+    if left is None:
+        return right
+    if right is None or left == right:
+        return left
+    if {left, right} == {"BIGINT", "DOUBLE PRECISION"}:
+        return "DOUBLE PRECISION"
+    return "TEXT"
+
+
+def _infer_string_type(s: pd.Series) -> Optional[str]:
+    # CSV cells arrive as strings; look at what the strings hold.
+    stripped = s.astype(str).str.strip()
+    stripped = stripped[stripped != ""]
+    if stripped.empty:
+        return None
+    if stripped.str.lower().isin(TRUE_FALSE_STRINGS).all():
+        return "BOOLEAN"
+    numeric = pd.to_numeric(stripped, errors="coerce")
+    if numeric.notna().all():
+        return infer_chunk_type(numeric)
+    try:
+        stamps = pd.to_datetime(stripped, errors="coerce", format="mixed")
+    except (TypeError, ValueError):
+        return "TEXT"
+    return "TIMESTAMP" if stamps.notna().all() else "TEXT"
+
+
+def infer_chunk_type(series: pd.Series, parse_strings: bool = False) -> Optional[str]:
+    """
+    Type of one batch of a column, None when the batch has only nulls.
+    parse_strings also recognises numbers/dates/booleans written as text (CSV).
     """
     s = series.dropna()
     if s.empty:
-        return "TEXT"
+        return None
+    if s.dtype == object:
+        # Object columns from openpyxl/from_records still hold typed values.
+        s = s.infer_objects()
+    if parse_strings and s.dtype == object and s.map(lambda v: isinstance(v, str)).all():
+        return _infer_string_type(s)
 
     if pd.api.types.is_bool_dtype(s):
         return "BOOLEAN"
@@ -31,13 +75,73 @@ def infer_sql_type(series: pd.Series) -> str:
     return "TEXT"
 
 
+def infer_sql_type(series: pd.Series) -> str:
+    """
+    Infer a reasonable PostgreSQL column type from a pandas Series.
+    Falls back to TEXT when unsure.
+    """
+    return infer_chunk_type(series) or "TEXT"
+
+
+class SchemaInference:
+    """Running column types over any number of batches and files; columns keep first-seen order."""
+
+    def __init__(self, parse_strings: bool = False) -> None:
+        self.parse_strings = parse_strings
+        self.types: Dict[str, Optional[str]] = {}
+
+    def update(self, df: pd.DataFrame) -> None:
+        for col in df.columns:
+            chunk_type = infer_chunk_type(df[col], self.parse_strings)
+            self.types[str(col)] = merge_sql_types(self.types.get(str(col)), chunk_type)
+
+    def merge(self, types: Dict[str, Optional[str]]) -> None:
+        for col, col_type in types.items():
+            self.types[col] = merge_sql_types(self.types.get(col), col_type)
+
+    def column_types(self) -> Dict[str, str]:
+        return {col: col_type or "TEXT" for col, col_type in self.types.items()}
+
+
+def create_table_sql(column_types: Dict[str, str], table_name: str, drop: bool = True) -> str:
+    # "schema.table" is quoted part by part.
+    table_sql = ".".join(f'"{part}"' for part in table_name.split(".", 1))
+    columns_sql = ",\n  ".join(f'"{col}" {col_type}' for col, col_type in column_types.items())
+    if drop:
+        return f"DROP TABLE IF EXISTS {table_sql};\nCREATE TABLE {table_sql} (\n  {columns_sql}\n);"
+    return f"CREATE TABLE IF NOT EXISTS {table_sql} (\n  {columns_sql}\n);"
+
+
 def build_create_table_sql(df: pd.DataFrame, table_name: str) -> str:
-    column_defs = []
-    for col in df.columns:
-        col_type = infer_sql_type(df[col])
-        column_defs.append(f'"{col}" {col_type}')
-    columns_sql = ",\n  ".join(column_defs)
-    return f'DROP TABLE IF EXISTS "{table_name}";\nCREATE TABLE "{table_name}" (\n  {columns_sql}\n);'
+    return create_table_sql({str(col): infer_sql_type(df[col]) for col in df.columns}, table_name)
+
+
+def parquet_column_types(path: Path) -> Dict[str, str]:
+    """Types of a Parquet file are fixed by convert_to_parquet.py; read them from the footer only."""
+    import pyarrow.parquet as pq
+    import pyarrow.types as pa_types
+
+    schema = pq.read_schema(str(path), memory_map=True)
+    column_types: Dict[str, str] = {}
+    for field in schema:
+        if pa_types.is_boolean(field.type):
+            column_types[field.name] = "BOOLEAN"
+        elif pa_types.is_integer(field.type):
+            column_types[field.name] = "BIGINT"
+        elif pa_types.is_floating(field.type) or pa_types.is_decimal(field.type):
+            column_types[field.name] = "DOUBLE PRECISION"
+        elif pa_types.is_timestamp(field.type) or pa_types.is_date(field.type):
+            column_types[field.name] = "TIMESTAMP"
+        else:
+            column_types[field.name] = "TEXT"
+    return column_types
+
+
+def infer_schema(batches: Iterable[pd.DataFrame], parse_strings: bool = False) -> SchemaInference:
+    inference = SchemaInference(parse_strings)
+    for df in batches:
+        inference.update(df)
+    return inference
 
 
 def main() -> None:
@@ -48,7 +152,7 @@ def main() -> None:
         "-p",
         "--path",
         default="server/Обработка БД.xlsx",
-        help="Path to the Excel file (default: server/Обработка БД.xlsx)",
+        help="Path to the Excel/CSV/Parquet file (default: server/Обработка БД.xlsx)",
     )
     parser.add_argument(
         "-s",
@@ -61,7 +165,7 @@ def main() -> None:
         "--sample-rows",
         type=int,
         default=500,
-        help="Number of rows to read for type inference (default: 500).",
+        help="Number of rows to read for type inference (default: 500, 0 = every row).",
     )
     parser.add_argument(
         "-t",
@@ -75,9 +179,19 @@ def main() -> None:
     if not file_path.is_file():
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    df = pd.read_excel(file_path, sheet_name=args.sheet if args.sheet else 0, nrows=args.sample_rows)
+    source_path = prefer_parquet(file_path, args.sheet)
+    if source_path.suffix.lower() in PARQUET_SUFFIXES:
+        print(create_table_sql(parquet_column_types(source_path), args.table))
+        return
+
+    # Types are merged batch by batch, so even a full pass keeps one batch in memory.
+    batch_size = min(args.sample_rows, 10000) if args.sample_rows > 0 else 10000
+    batches = iter_batches(file_path, sheet=args.sheet, batch_size=batch_size)
+    if args.sample_rows > 0:
+        batches = islice(batches, -(-args.sample_rows // batch_size))
+    inference = infer_schema(batches, parse_strings=file_path.suffix.lower() == ".csv")
 
-    sql = build_create_table_sql(df, args.table)
+    sql = create_table_sql(inference.column_types(), args.table)
     print(sql)
 
 
@@ -1,11 +1,14 @@
 import argparse
 import asyncio
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
 
 import asyncpg
 import pandas as pd
 
+from excel_stream import iter_batches, prefer_parquet
+
 
 def parse_table_name(table: str) -> Tuple[str, str]:
     if "." in table:
@@ -79,14 +82,157 @@ def normalize_row(row: Tuple[Any, ...], types: List[str]) -> Tuple[Any, ...]:
     return tuple(normalized)
 
 
-def read_chunk(path: Path, sheet: str | int | None, skip: int, batch_size: int) -> pd.DataFrame:
-    # skiprows skips data rows (header is row 0).
-    return pd.read_excel(
-        path,
-        sheet_name=sheet if sheet is not None else 0,
-        skiprows=range(1, skip + 1),
-        nrows=batch_size,
-    )
+INTEGER_TYPES = {"smallint", "integer", "bigint"}
+FLOAT_TYPES = {"numeric", "real", "double precision"}
+TRUE_STRINGS = {"1", "true", "t", "yes", "y"}
+FALSE_STRINGS = {"0", "false", "f", "no", "n"}
+
+
+def _to_numeric(series: pd.Series) -> pd.Series:
+    if series.dtype == object:
+        series = series.map(lambda v: v.strip() if isinstance(v, str) else v)
+    return pd.to_numeric(series, errors="coerce")
+
+
+def _to_boolean(series: pd.Series) -> pd.Series:
+    def convert(value: Any) -> Any:
+        if not isinstance(value, str):
+            return bool(value)
+        lowered = value.strip().lower()
+        if lowered in TRUE_STRINGS:
+            return True
+        if lowered in FALSE_STRINGS:
+            return False
+        raise ValueError(f"Cannot convert string {value} to boolean")
+
+    if series.dtype == bool:
+        return series
+    return series.map(convert, na_action="ignore")
+
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        return pd.to_datetime(series, format="mixed")
+    except (TypeError, ValueError):
+        # Older pandas without format="mixed", or values pandas cannot parse
+        # as one column: fall back to per-value parsing like convert_value.
+        return series.map(pd.to_datetime, na_action="ignore")
+
+
+def convert_column(series: pd.Series, data_type: str) -> List[Any]:
+    """Column-wise equivalent of convert_value: returns Python values with None for NULL."""
+    if data_type in INTEGER_TYPES:
+        numeric = _to_numeric(series)
+        # Non-integer values in an integer column become NULL.
+        numeric = numeric.where(numeric.notna() & (numeric % 1 == 0))
+        converted = numeric.astype("Int64")
+    elif data_type in FLOAT_TYPES:
+        converted = _to_numeric(series).astype("float64")
+    elif data_type == "boolean":
+        converted = _to_boolean(series)
+    elif data_type.startswith("timestamp"):
+        stamps = _to_datetime(series)
+        return [None if pd.isna(v) else pd.Timestamp(v).to_pydatetime() for v in stamps]
+    elif data_type == "date":
+        stamps = _to_datetime(series)
+        return [None if pd.isna(v) else pd.Timestamp(v).date() for v in stamps]
+    else:
+        converted = series.map(str, na_action="ignore")
+    converted = converted.astype(object)
+    return converted.where(converted.notna(), None).tolist()
+
+
+def frame_to_records(df: pd.DataFrame, types: Sequence[str]) -> List[Tuple[Any, ...]]:
+    columns = [convert_column(df.iloc[:, idx], data_type) for idx, data_type in enumerate(types)]
+    return list(zip(*columns))
+
+
+def rows_python(df: pd.DataFrame, types: List[str]) -> List[Tuple[Any, ...]]:
+    # Original per-cell path, kept for --load-mode executemany and --benchmark.
+    return [normalize_row(tuple(row), types) for row in df.itertuples(index=False, name=None)]
+
+
+def quote_table(table: str) -> str:
+    schema, name = parse_table_name(table)
+    return f'"{schema}"."{name}"'
+
+
+Loader = Callable[[asyncpg.Connection, str, List[str], List[Tuple[Any, ...]]], Awaitable[None]]
+
+
+async def load_executemany(conn: asyncpg.Connection, table: str, columns: List[str], rows: List[Tuple[Any, ...]]) -> None:
+    col_sql = ", ".join(f'"{col}"' for col in columns)
+    placeholders = ", ".join(f"${i+1}" for i in range(len(columns)))
+    await conn.executemany(f"INSERT INTO {quote_table(table)} ({col_sql}) VALUES ({placeholders})", rows)
+
+
+async def load_copy(conn: asyncpg.Connection, table: str, columns: List[str], rows: List[Tuple[Any, ...]]) -> None:
+    schema, name = parse_table_name(table)
+    await conn.copy_records_to_table(name, records=rows, columns=columns, schema_name=schema)
+
+
+STAGING_TABLE = "insert_all_batches_stage"
+
+
+async def load_staging(conn: asyncpg.Connection, table: str, columns: List[str], rows: List[Tuple[Any, ...]]) -> None:
+    # COPY into a session temp table (not WAL-logged, no target triggers/indexes),
+    # then a single INSERT ... SELECT into the target.
+    col_sql = ", ".join(f'"{col}"' for col in columns)
+    async with conn.transaction():
+        await conn.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS "{STAGING_TABLE}" (LIKE {quote_table(table)} INCLUDING DEFAULTS)'
+        )
+        await conn.execute(f'TRUNCATE "{STAGING_TABLE}"')
+        await conn.copy_records_to_table(STAGING_TABLE, records=rows, columns=columns)
+        await conn.execute(
+            f'INSERT INTO {quote_table(table)} ({col_sql}) SELECT {col_sql} FROM "{STAGING_TABLE}"'
+        )
+
+
+LOADERS: Dict[str, Loader] = {
+    "copy": load_copy,
+    "staging": load_staging,
+    "executemany": load_executemany,
+}
+
+
+async def run_benchmark(
+    conn: asyncpg.Connection,
+    table: str,
+    df: pd.DataFrame,
+    columns: List[str],
+    column_types: List[str],
+) -> None:
+    """Times old vs column-wise conversion and every loader on one batch; all inserts are rolled back."""
+    print(f"Benchmark on {len(df)} rows, table {table}")
+
+    started = time.perf_counter()
+    old_rows = rows_python(df, column_types)
+    old_convert = time.perf_counter() - started
+
+    started = time.perf_counter()
+    new_rows = frame_to_records(df, column_types)
+    new_convert = time.perf_counter() - started
+
+    mismatches = sum(1 for old, new in zip(old_rows, new_rows) if old != new)
+    print(f"  convert  per-cell:    {old_convert:8.3f}s ({len(df) / max(old_convert, 1e-9):,.0f} rows/s)")
+    print(f"  convert  column-wise: {new_convert:8.3f}s ({len(df) / max(new_convert, 1e-9):,.0f} rows/s)")
+    if mismatches:
+        print(f"  warning: {mismatches} rows differ between conversion paths")
+
+    for mode, loader in LOADERS.items():
+        rows = old_rows if mode == "executemany" else new_rows
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            started = time.perf_counter()
+            await loader(conn, table, columns, rows)
+            elapsed = time.perf_counter() - started
+        finally:
+            await tr.rollback()
+        print(f"  load     {mode:<12} {elapsed:8.3f}s ({len(rows) / max(elapsed, 1e-9):,.0f} rows/s)")
 
 
 async def main() -> None:
@@ -102,7 +248,8 @@ async def main() -> None:
         "-p",
         "--path",
         default="server/Обработка БД.xlsx",
-        help="Path to the Excel file (default: server/Обработка БД.xlsx)",
+        help="Path to the Excel/CSV/Parquet file (default: server/Обработка БД.xlsx). "
+        "A fresh Parquet copy made by convert_to_parquet.py is used instead when present.",
     )
     parser.add_argument(
         "-s",
@@ -129,42 +276,82 @@ async def main() -> None:
         default="realty_data_raw",
         help='Target table name (default: "realty_data_raw").',
     )
+    parser.add_argument(
+        "--load-mode",
+        choices=sorted(LOADERS),
+        default="copy",
+        help="copy: COPY straight into the table; staging: COPY into a temp table, then INSERT ... SELECT; "
+        "executemany: the old per-row INSERT path (default: copy).",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare conversion and load paths on the first batch (inserts are rolled back) and exit.",
+    )
     args = parser.parse_args()
 
     file_path = Path(args.path).expanduser()
     if not file_path.is_file():
         raise FileNotFoundError(f"File not found: {file_path}")
+    source_path = prefer_parquet(file_path, args.sheet)
+    if source_path != file_path:
+        print(f"Reading Parquet copy {source_path}")
 
     async with asyncpg.create_pool(args.dsn, statement_cache_size=0) as pool:
         async with pool.acquire() as conn:
             column_types_map = await fetch_column_types(conn, args.table)
             columns = list(column_types_map.keys())
             column_types = [column_types_map[col] for col in columns]
-
-            col_sql = ", ".join(f'"{col}"' for col in columns)
-            placeholders = ", ".join(f"${i+1}" for i in range(len(columns)))
-            insert_sql = f'INSERT INTO "{args.table}" ({col_sql}) VALUES ({placeholders})'
+            loader = LOADERS[args.load_mode]
 
             total_inserted = 0
             offset = max(args.start_offset, 0)
             batch_idx = offset // args.batch_size + 1
+            started = time.perf_counter()
+
+            # The file is opened once; batches come from a single row iterator
+            # and come out in table column order.
+            batches = iter_batches(
+                source_path,
+                sheet=args.sheet,
+                batch_size=args.batch_size,
+                start_offset=offset,
+                columns=columns,
+            )
+            if args.benchmark:
+                df = next(batches, None)
+                if df is None:
+                    print("No rows to benchmark.")
+                else:
+                    await run_benchmark(conn, args.table, df, columns, column_types)
+                return
 
-            while True:
-                df = read_chunk(file_path, args.sheet, offset, args.batch_size)
-                if df.empty:
-                    break
-                # Ensure column order matches the table.
-                df = df[columns]
-                rows = [normalize_row(tuple(row), column_types) for row in df.itertuples(index=False, name=None)]
+            batch_started = started
+            for df in batches:
+                if args.load_mode == "executemany":
+                    rows = rows_python(df, column_types)
+                else:
+                    rows = frame_to_records(df, column_types)
                 print(f"Batch {batch_idx}: inserting {len(rows)} rows (offset {offset})...")
-                await conn.executemany(insert_sql, rows)
+                await loader(conn, args.table, columns, rows)
                 inserted_now = len(rows)
                 total_inserted += inserted_now
                 offset += inserted_now
-                print(f"Batch {batch_idx} done. Total inserted: {total_inserted}")
+                # Read + convert + insert time of this batch.
+                batch_elapsed = time.perf_counter() - batch_started
+                print(
+                    f"Batch {batch_idx} done. Total inserted: {total_inserted} "
+                    f"({inserted_now / batch_elapsed:,.0f} rows/s)"
+                )
                 batch_idx += 1
+                batch_started = time.perf_counter()
 
-            print(f"Done. Inserted total {total_inserted} rows into {args.table}.")
+            elapsed = time.perf_counter() - started
+            rate = total_inserted / elapsed if elapsed > 0 else 0.0
+            print(
+                f"Done. Inserted total {total_inserted} rows into {args.table} "
+                f"in {elapsed:.1f}s ({rate:,.0f} rows/s)."
+            )
 
 
 if __name__ == "__main__":
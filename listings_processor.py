@@ -2,12 +2,11 @@ import re, json
 import pandas as pd
 import requests
 from bs4 import BeautifulSoup
-from openpyxl import Workbook,load_workbook
-from openpyxl.styles import Font
-from openpyxl.utils import get_column_letter
 from io import BytesIO
 from typing import List, Dict, Any, Tuple
 import asyncio
+import threading
+import time
 from datetime import datetime
 from selenium.webdriver.common.by import By
 
@@ -17,6 +16,15 @@ from db_handler import save_listings, find_similar_ads_grouped, call_update_ad
 # Импортируем модуль для работы с фотографиями
 from photo_processor import PhotoProcessor
 
+# Пакетный парсинг с лимитами по источникам
+from batch_parser import SourceBatchRunner
+
+# Однопроходная запись Excel-отчётов
+from excel_report import ExcelReportWriter, THOUSANDS_FORMAT
+
+# Разбор сообщений: ссылки, комментарии, подбор, метро
+from message_tokenizer import extract_urls as find_urls
+
 # Импортируем парсер Avito
 try:
     from avito_parser_integration import AvitoCardParser
@@ -61,6 +69,16 @@ class ListingsProcessor:
         """Определяет, является ли ссылка ссылкой на Yandex Realty"""
         return 'realty.yandex.ru' in url.lower()
     
+    def get_url_source_name(self, url: str) -> str:
+        """Возвращает имя источника ссылки для пакетного парсинга"""
+        if self.is_avito_url(url):
+            return 'avito'
+        elif self.is_cian_url(url):
+            return 'cian'
+        elif self.is_yandex_url(url):
+            return 'yandex'
+        return 'unknown'
+
     def get_url_source(self, url: str) -> int:
         """Возвращает источник ссылки: 1 - Avito, 4 - Cian, 3 - Yandex Realty"""
         if self.is_avito_url(url):
@@ -84,8 +102,9 @@ class ListingsProcessor:
             # Создаем парсер Avito с параметром skip_photos
             parser = AvitoCardParser(skip_photos=skip_photos)
             
-            # Парсим полную страницу объявления
-            parsed_data = parser.parse_avito_page(url)
+            # Парсим полную страницу объявления (Selenium блокирует поток — уводим в executor)
+            loop = asyncio.get_running_loop()
+            parsed_data = await loop.run_in_executor(None, parser.parse_avito_page, url)
             if not parsed_data:
                 print("❌ Не удалось спарсить данные объявления Avito")
                 return None
@@ -125,8 +144,9 @@ class ListingsProcessor:
             # Создаем парсер Yandex Realty
             parser = YandexCardParser()
             
-            # Парсим полную страницу объявления
-            parsed_data = parser.parse_card(url)
+            # Парсим полную страницу объявления (Selenium блокирует поток — уводим в executor)
+            loop = asyncio.get_running_loop()
+            parsed_data = await loop.run_in_executor(None, parser.parse_card, url)
             if not parsed_data:
                 print("❌ Не удалось спарсить данные объявления Yandex Realty")
                 return None
@@ -261,14 +281,14 @@ class ListingsProcessor:
             if self.is_avito_url(listing_url):
                 print(f"📸 Извлекаем фотографии с Avito: {listing_url}")
                 # Для Avito используем более надежный способ для асинхронных запросов
-                response = await asyncio.get_event_loop().run_in_executor(None, lambda: requests.get(listing_url, headers=HEADERS))
+                response = await asyncio.get_running_loop().run_in_executor(None, lambda: requests.get(listing_url, headers=HEADERS))
                 response.raise_for_status()
                 soup = BeautifulSoup(response.text, 'html.parser')
                 photo_urls = self.extract_avito_photo_urls(soup)
             else:
                 print(f"📸 Извлекаем фотографии с Cian: {listing_url}")
                 # Для Cian используем существующую логику
-                response = await asyncio.get_event_loop().run_in_executor(None, lambda: requests.get(listing_url, headers=HEADERS))
+                response = await asyncio.get_running_loop().run_in_executor(None, lambda: requests.get(listing_url, headers=HEADERS))
                 response.raise_for_status()
                 soup = BeautifulSoup(response.text, 'html.parser')
                 photo_urls = self.extract_photo_urls(soup)
@@ -651,8 +671,11 @@ class ListingsProcessor:
         
         return ''.join(html_parts)
     
-    async def generate_html_gallery_embedded(self, listing_urls: list[str], user_id: int, subtitle: str = None, remove_watermarks: bool = False, max_photos_per_listing: int = None, listing_comments: list[str] = None) -> tuple[str, list[dict]]:
-        """Генерирует HTML галерею с встроенными Base64 изображениями и возвращает статистику по фото"""
+    async def generate_html_gallery_embedded(self, listing_urls: list[str], user_id: int, subtitle: str = None, remove_watermarks: bool = False, max_photos_per_listing: int = None, listing_comments: list[str] = None, progress=None) -> tuple[str, list[dict]]:
+        """Генерирует HTML галерею с встроенными Base64 изображениями и возвращает статистику по фото
+
+        progress — необязательный ProgressReporter: получает начало и итог по каждому объявлению
+        """
         html_content = f"""
         <!DOCTYPE html>
         <html lang="ru">
@@ -988,6 +1011,8 @@ class ListingsProcessor:
         db_listings = []
         
         for i, listing_url in enumerate(listing_urls, 1):
+            if progress:
+                progress.listing_started(i, listing_url)
             try:
                 print(f"🔍 Обрабатываю объявление {i}: {listing_url}")
                 
@@ -1011,6 +1036,14 @@ class ListingsProcessor:
                             </div>
                         </div>
                         """
+                        photo_stats.append({
+                            'listing_number': i,
+                            'photo_count': 0,
+                            'url': listing_url,
+                            'error': 'не удалось спарсить объявление Avito'
+                        })
+                        if progress:
+                            progress.listing_done(photo_stats[-1])
                         continue
                     
                     # Сохраняем данные для БД
@@ -1143,6 +1176,8 @@ class ListingsProcessor:
                     'photo_count': len(processed_photos) if processed_photos else 0,
                     'url': listing_url
                 })
+                if progress:
+                    progress.listing_done(photo_stats[-1])
                 
                 html_content += f"""
                     </div>
@@ -1156,6 +1191,8 @@ class ListingsProcessor:
                     'url': listing_url,
                     'error': str(e)
                 })
+                if progress:
+                    progress.listing_done(photo_stats[-1])
                 
                 html_content += f"""
                 <div class="listing">
@@ -1372,52 +1409,35 @@ class ListingsProcessor:
         return html_content, photo_stats
 
     async def parse_listings_batch(self, listing_urls: list[str]) -> list[dict]:
-        """Универсальный метод для парсинга списка объявлений с Cian, Avito и Yandex Realty"""
+        """Универсальный метод для параллельного парсинга списка объявлений с Cian, Avito и Yandex Realty.
+
+        Ссылки группируются по источнику, у каждой группы свой лимит параллелизма.
+        Порядок результатов совпадает с порядком ссылок.
+        """
+        loop = asyncio.get_running_loop()
+        source_ids = {'avito': 1, 'cian': 4, 'yandex': 3}
+
+        async def _parse(url: str, source: str):
+            if source == 'avito':
+                return await self.parse_avito_listing(url)
+            if source == 'cian':
+                return await loop.run_in_executor(None, parse_listing_in_thread, url)
+            if source == 'yandex':
+                return await self.parse_yandex_listing(url)
+            print(f"⚠️ Неизвестный источник ссылки: {url}")
+            return None
+
+        items = await SourceBatchRunner(self.get_url_source_name).run(listing_urls, _parse)
+
         parsed_listings = []
-        
-        for i, url in enumerate(listing_urls, 1):
-            try:
-                print(f"🔄 Парсим объявление {i}/{len(listing_urls)}: {url}")
-                
-                if self.is_avito_url(url):
-                    print(f"🏠 Источник: Avito")
-                    listing_data = await self.parse_avito_listing(url)
-                    if listing_data:
-                        # Добавляем источник
-                        listing_data['source'] = 1  # Avito
-                        parsed_listings.append(listing_data)
-                        print(f"✅ Объявление Avito успешно спарсено")
-                    else:
-                        print(f"❌ Не удалось спарсить объявление Avito")
-                elif self.is_cian_url(url):
-                    print(f"🏠 Источник: Cian")
-                    # Для Cian используем существующую логику
-                    session = requests.Session()
-                    listing_data = parse_listing(url, session)
-                    if listing_data:
-                        # Добавляем источник
-                        listing_data['source'] = 4  # Cian
-                        parsed_listings.append(listing_data)
-                        print(f"✅ Объявление Cian успешно спарсено")
-                    else:
-                        print(f"❌ Не удалось спарсить объявление Cian")
-                elif self.is_yandex_url(url):
-                    print(f"🏠 Источник: Yandex Realty")
-                    listing_data = await self.parse_yandex_listing(url)
-                    if listing_data:
-                        # Добавляем источник
-                        listing_data['source'] = 3  # Yandex Realty
-                        parsed_listings.append(listing_data)
-                        print(f"✅ Объявление Yandex Realty успешно спарсено")
-                    else:
-                        print(f"❌ Не удалось спарсить объявление Yandex Realty")
-                else:
-                    print(f"⚠️ Неизвестный источник ссылки: {url}")
-                
-            except Exception as e:
-                print(f"❌ Ошибка при парсинге {url}: {e}")
-                continue
-        
+        for item in items:
+            if item.ok:
+                item.data['source'] = source_ids[item.source]
+                parsed_listings.append(item.data)
+                print(f"✅ [{item.index + 1}/{len(items)}] {item.source}: {item.url} ({item.parse_seconds:.2f} сек)")
+            elif item.source != 'unknown':
+                print(f"❌ [{item.index + 1}/{len(items)}] Не удалось спарсить {item.url}: {item.error}")
+
         print(f"📊 Всего успешно спарсено: {len(parsed_listings)} из {len(listing_urls)}")
         return parsed_listings
     
@@ -1443,6 +1463,72 @@ def extract_number(text: str):
     except ValueError:
         return None
 
+def avito_excel_row(url: str, avito_data: dict) -> dict:
+    """Преобразует данные Avito в строку Excel-отчёта"""
+    return {
+        'URL': url,
+        'Комнат': avito_data.get('rooms', ''),
+        'Цена_raw': avito_data.get('price', ''),
+        'Этаж': avito_data.get('floor', ''),
+        'Общая площадь': avito_data.get('total_area', ''),
+        'Жилая площадь': avito_data.get('living_area', ''),
+        'Площадь кухни': avito_data.get('kitchen_area', ''),
+        'Санузел': avito_data.get('bathroom', ''),
+        'Балкон/лоджия': avito_data.get('balcony', ''),
+        'Вид из окон': avito_data.get('windows', ''),
+        'Ремонт': avito_data.get('renovation', ''),
+        'Год постройки': avito_data.get('construction_year', ''),
+        'Строительная серия': '',  # Пусто в Avito
+        'Тип дома': avito_data.get('house_type', ''),
+        'Тип перекрытий': '',  # Пусто в Avito
+        'Пассажирских лифтов': avito_data.get('passenger_elevator', ''),
+        'Грузовых лифтов': avito_data.get('cargo_elevator', ''),
+        'Парковка': avito_data.get('parking', ''),
+        'Газоснабжение': avito_data.get('gas_supply', ''),  # Берем из "В доме"
+        'Высота потолков': avito_data.get('ceiling_height', ''),
+        'Мебель': avito_data.get('furniture', ''),
+        'Способ продажи': avito_data.get('sale_type', ''),
+        'Просмотров сегодня': avito_data.get('today_views', ''),
+        'Адрес': avito_data.get('address', ''),
+        'Минут метро': avito_data.get('metro_time', ''),
+        'Метки': avito_data.get('tags', ''),
+        'Статус': 'Активно',
+        'Тип жилья': 'Квартира',
+    }
+
+def yandex_excel_row(url: str, yandex_data: dict) -> dict:
+    """Преобразует данные Yandex Realty в строку Excel-отчёта"""
+    return {
+        'URL': url,
+        'Комнат': yandex_data.get('rooms', ''),
+        'Цена_raw': yandex_data.get('price', ''),
+        'Этаж': yandex_data.get('floor', ''),
+        'Общая площадь': yandex_data.get('area_total', ''),
+        'Жилая площадь': yandex_data.get('living_area', ''),
+        'Площадь кухни': yandex_data.get('kitchen_area', ''),
+        'Санузел': yandex_data.get('bathroom', ''),
+        'Балкон/лоджия': yandex_data.get('balcony', ''),
+        'Вид из окон': yandex_data.get('view', ''),
+        'Ремонт': yandex_data.get('renovation', ''),
+        'Год постройки': yandex_data.get('year_built', ''),
+        'Строительная серия': '',  # Yandex не предоставляет
+        'Тип дома': yandex_data.get('house_type', ''),
+        'Тип перекрытий': '',  # Yandex не предоставляет
+        'Пассажирских лифтов': '',
+        'Грузовых лифтов': '',
+        'Парковка': '',
+        'Газоснабжение': '',
+        'Высота потолков': '',
+        'Мебель': '',
+        'Способ продажи': '',
+        'Просмотров сегодня': yandex_data.get('views', ''),
+        'Адрес': yandex_data.get('address', ''),
+        'Минут метро': yandex_data.get('metro_time', ''),
+        'Метки': '',
+        'Статус': yandex_data.get('status', 'Активно'),
+        'Тип жилья': 'Квартира',
+    }
+
 async def export_listings_to_excel(listing_urls: list[str], user_id: int, output_path: str = None) -> tuple[BytesIO, int]:
     """
     Парсит список объявлений, сохраняет их в БД и возвращает Excel-файл и request_id.
@@ -1452,99 +1538,40 @@ async def export_listings_to_excel(listing_urls: list[str], user_id: int, output
     :param output_path: опциональный путь для сохранения файла на диск
     :return: tuple (BytesIO с данными файла, request_id)
     """
-    sess = requests.Session()
-    rows = []
-    
-    # Создаем экземпляр процессора для определения источника ссылок
     processor = ListingsProcessor()
-    
-    for url in listing_urls:
-        try:
-            if processor.is_avito_url(url):
-                print(f"🏠 Парсим объявление Avito: {url}")
-                # Для Avito используем асинхронный парсинг без фото
-                avito_data = await processor.parse_avito_listing(url, skip_photos=True)
-                if avito_data:
-                    # Преобразуем данные Avito в формат для Excel
-                    excel_data = {
-                        'URL': url,
-                        'Комнат': avito_data.get('rooms', ''),
-                        'Цена_raw': avito_data.get('price', ''),
-                        'Этаж': avito_data.get('floor', ''),
-                        'Общая площадь': avito_data.get('total_area', ''),
-                        'Жилая площадь': avito_data.get('living_area', ''),
-                        'Площадь кухни': avito_data.get('kitchen_area', ''),
-                        'Санузел': avito_data.get('bathroom', ''),
-                        'Балкон/лоджия': avito_data.get('balcony', ''),
-                        'Вид из окон': avito_data.get('windows', ''),
-                        'Ремонт': avito_data.get('renovation', ''),
-                        'Год постройки': avito_data.get('construction_year', ''),
-                        'Строительная серия': '',  # Пусто в Avito
-                        'Тип дома': avito_data.get('house_type', ''),
-                        'Тип перекрытий': '',  # Пусто в Avito
-                        'Пассажирских лифтов': avito_data.get('passenger_elevator', ''),
-                        'Грузовых лифтов': avito_data.get('cargo_elevator', ''),
-                        'Парковка': avito_data.get('parking', ''),
-                        'Газоснабжение': avito_data.get('gas_supply', ''),  # Берем из "В доме"
-                        'Высота потолков': avito_data.get('ceiling_height', ''),
-                        'Мебель': avito_data.get('furniture', ''),
-                        'Способ продажи': avito_data.get('sale_type', ''),
-                        'Просмотров сегодня': avito_data.get('today_views', ''),
-                        'Адрес': avito_data.get('address', ''),
-                        'Минут метро': avito_data.get('metro_time', ''),
-                        'Метки': avito_data.get('tags', ''),
-                        'Статус': 'Активно',
-                        'Тип жилья': 'Квартира',
-                    }
-                    rows.append(excel_data)
-                else:
-                    print(f"❌ Не удалось спарсить объявление Avito: {url}")
-            elif processor.is_yandex_url(url):
-                print(f"🏠 Парсим объявление Yandex Realty: {url}")
-                # Для Yandex Realty используем асинхронный парсинг
-                yandex_data = await processor.parse_yandex_listing(url)
-                if yandex_data:
-                    # Преобразуем данные Yandex в формат для Excel
-                    excel_data = {
-                        'URL': url,
-                        'Комнат': yandex_data.get('rooms', ''),
-                        'Цена_raw': yandex_data.get('price', ''),
-                        'Этаж': yandex_data.get('floor', ''),
-                        'Общая площадь': yandex_data.get('area_total', ''),
-                        'Жилая площадь': yandex_data.get('living_area', ''),
-                        'Площадь кухни': yandex_data.get('kitchen_area', ''),
-                        'Санузел': yandex_data.get('bathroom', ''),
-                        'Балкон/лоджия': yandex_data.get('balcony', ''),
-                        'Вид из окон': yandex_data.get('view', ''),
-                        'Ремонт': yandex_data.get('renovation', ''),
-                        'Год постройки': yandex_data.get('year_built', ''),
-                        'Строительная серия': '',  # Yandex не предоставляет
-                        'Тип дома': yandex_data.get('house_type', ''),
-                        'Тип перекрытий': '',  # Yandex не предоставляет
-                        'Пассажирских лифтов': '',
-                        'Грузовых лифтов': '',
-                        'Парковка': '',
-                        'Газоснабжение': '',
-                        'Высота потолков': '',
-                        'Мебель': '',
-                        'Способ продажи': '',
-                        'Просмотров сегодня': yandex_data.get('views', ''),
-                        'Адрес': yandex_data.get('address', ''),
-                        'Минут метро': yandex_data.get('metro_time', ''),
-                        'Метки': '',
-                        'Статус': yandex_data.get('status', 'Активно'),
-                        'Тип жилья': 'Квартира',
-                    }
-                    rows.append(excel_data)
-                else:
-                    print(f"❌ Не удалось спарсить объявление Yandex Realty: {url}")
-            else:
-                print(f"🏠 Парсим объявление Cian: {url}")
-                # Для Cian используем существующую логику
-                cian_data = parse_listing(url, sess)
-                rows.append(cian_data)
-        except Exception as e:
-            print(f"Ошибка при парсинге {url}: {e}")
+    loop = asyncio.get_running_loop()
+
+    # Всё, что не Avito и не Yandex, парсим как Cian (как и раньше)
+    def _source(url: str) -> str:
+        name = processor.get_url_source_name(url)
+        return name if name in ('avito', 'yandex') else 'cian'
+
+    async def _parse(url: str, source: str):
+        if source == 'avito':
+            # Для Avito используем асинхронный парсинг без фото
+            avito_data = await processor.parse_avito_listing(url, skip_photos=True)
+            return avito_excel_row(url, avito_data) if avito_data else None
+        if source == 'yandex':
+            yandex_data = await processor.parse_yandex_listing(url)
+            return yandex_excel_row(url, yandex_data) if yandex_data else None
+        # Синхронный парсер Cian — в пуле потоков (своя сессия у каждого потока)
+        return await loop.run_in_executor(None, parse_listing_in_thread, url)
+
+    # Источники парсятся параллельно со своими лимитами, порядок строк — как у ссылок
+    started = time.perf_counter()
+    items = await SourceBatchRunner(_source).run(listing_urls, _parse)
+
+    rows = []
+    source_titles = {'avito': 'Avito', 'yandex': 'Yandex Realty', 'cian': 'Cian'}
+    for item in items:
+        if item.ok:
+            rows.append(item.data)
+            print(f"🏠 {source_titles[item.source]}: {item.url} ({item.parse_seconds:.2f} сек, ожидание {item.wait_seconds:.2f} сек)")
+        elif item.error == 'no_data':
+            print(f"❌ Не удалось спарсить объявление {source_titles[item.source]}: {item.url}")
+        else:
+            print(f"Ошибка при парсинге {item.url}: {item.error}")
+    print(f"📊 Спарсено {len(rows)} из {len(listing_urls)} за {time.perf_counter() - started:.2f} сек")
 
     # Сохраняем и получаем request_id
     request_id = await save_listings(rows, user_id)
@@ -1582,35 +1609,31 @@ async def export_listings_to_excel(listing_urls: list[str], user_id: int, output
     ]
     df = df[[c for c in ordered if c in df.columns]]
 
-    # Запись в BytesIO
-    bio = BytesIO()
-    df.to_excel(bio, index=False)
-    bio.seek(0)
+    # Один проход: заголовки жирные, у цены формат тысяч; при output_path те же байты пишутся на диск
+    writer = ExcelReportWriter('Sheet1')
+    writer.append_header(df.columns)
+    number_formats = {df.columns.get_loc('Цена'): THOUSANDS_FORMAT} if 'Цена' in df.columns else None
+    for row in df.itertuples(index=False, name=None):
+        writer.append_row(row, number_formats)
+    bio = writer.save(output_path)
 
-    # Если указан путь, сохраняем файл и форматируем столбец 'Цена'
-    if output_path:
-        with open(output_path, 'wb') as f:
-            f.write(bio.getbuffer())
+    return bio, request_id
 
-        wb = load_workbook(output_path)
-        ws = wb.active
-        # Выделяем заголовки
-        for cell in ws[1]:
-            cell.font = Font(bold=True)
+# requests.Session не потокобезопасна: у каждого потока пула executor своя сессия
+_thread_local = threading.local()
 
-        # Определяем колонку 'Цена' и задаем формат тысяч
-        if 'Цена' in df.columns:
-            price_idx = df.columns.get_loc('Цена') + 1
-            price_col = get_column_letter(price_idx)
-            custom_format = '#,##0'
-            for row in range(2, ws.max_row + 1):
-                cell = ws[f"{price_col}{row}"]
-                if isinstance(cell.value, (int, float)):
-                    cell.number_format = custom_format
 
-        wb.save(output_path)
+def _thread_session() -> requests.Session:
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = _thread_local.session = requests.Session()
+    return session
+
+
+def parse_listing_in_thread(url: str) -> dict:
+    """parse_listing для run_in_executor: сессия текущего потока (keep-alive сохраняется)"""
+    return parse_listing(url, _thread_session())
 
-    return bio, request_id
 
 # Полный парсинг страницы объявления
 def parse_listing(url: str, session: requests.Session) -> dict:
@@ -1720,8 +1743,12 @@ def parse_listing(url: str, session: requests.Session) -> dict:
 
 def extract_urls(raw_input: str) -> tuple[list[str], int]:
     """Извлекает URL из текста и определяет их источник"""
-    urls = re.findall(r'https?://[^\s,;]+', raw_input)
-    
+    urls = find_urls(raw_input)
+    log_url_sources(urls)
+    return urls, len(urls)
+
+def log_url_sources(urls: list[str]) -> None:
+    """Печатает статистику ссылок по источникам"""
     # Создаем экземпляр процессора для определения источника
     processor = ListingsProcessor()
     
@@ -1752,8 +1779,6 @@ def extract_urls(raw_input: str) -> tuple[list[str], int]:
             print(f"   🏠 Yandex Realty: {yandex_count}")
         if unknown_count > 0:
             print(f"   ⚠️ Неизвестные: {unknown_count}")
-    
-    return urls, len(urls)
 
 # Создаем экземпляр класса для использования в других модулях
 listings_processor = ListingsProcessor()
@@ -1,6 +1,6 @@
 # main.py
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart
+from aiogram.filters import Command, CommandStart
 from aiogram.exceptions import TelegramForbiddenError
 import asyncio
 import logging
@@ -10,6 +10,8 @@ from dotenv import load_dotenv
 
 from text_handlers import handle_text_message
 from start_handlers import start_handler
+from db_handler import ensure_schema
+from bot_scheduler import scheduler
 
 load_dotenv()
 API_TOKEN = os.getenv('API_TOKEN')
@@ -35,8 +37,53 @@ async def safe_text_handler(message):
     except Exception as e:
         logging.error(f"Ошибка обработки текста: {e}")
 
+def is_heavy_request(text: str) -> bool:
+    """Запросы со ссылками (подбор, Excel-отчёт) парсят объявления — их ведёт планировщик"""
+    lowered = text.lower()
+    return "http" in lowered and "кабинет" not in lowered
+
+@dp.message(Command("cancel"))
+async def cancel_handler(message):
+    cancelled = await scheduler.cancel_user(message.from_user.id)
+    if cancelled:
+        await message.answer(f"🛑 Отменено запросов: {cancelled}")
+    else:
+        await message.answer("ℹ️ Нет запросов в очереди")
+
+# Тяжёлые запросы — через планировщик: общий пул воркеров и очередь на пользователя
+async def scheduled_text_handler(message):
+    if not is_heavy_request(message.text or ""):
+        await safe_text_handler(message)
+        return
+
+    job = await scheduler.submit(message.from_user.id, lambda: safe_text_handler(message))
+    try:
+        if job is None:
+            await message.answer(f"⚠️ У вас уже {scheduler.max_queued_per_user} запроса в очереди. "
+                                 f"Дождитесь результата или отправьте /cancel")
+        elif job.queue_position:
+            await message.answer(f"⏳ Вы в очереди: {job.queue_position}. Отменить — /cancel")
+    except TelegramForbiddenError:
+        logging.warning(f"Пользователь {message.from_user.id} заблокировал бота")
+
 # Регистрируем хэндлер для текстовых сообщений (без голоса и фото)
-dp.message.register(safe_text_handler, F.text & ~F.voice & ~F.photo)
+dp.message.register(scheduled_text_handler, F.text & ~F.voice & ~F.photo)
+
+# Миграция схемы users.* один раз при старте (дальше save_listings её не трогает)
+async def on_startup():
+    await scheduler.start()
+    try:
+        await ensure_schema()
+    except Exception as e:
+        # БД может быть недоступна при старте — save_listings повторит попытку
+        logging.error(f"Не удалось проверить схему БД при старте: {e}")
+
+async def on_shutdown():
+    logging.info(f"Метрики планировщика: {scheduler.stats()}")
+    await scheduler.stop()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
 
 # Настройка логирования
 os.makedirs("logs", exist_ok=True)
@@ -0,0 +1,165 @@
+"""Разбор сообщения со ссылками на объявления за один проход.
+
+Один предкомпилированный шаблон находит в тексте ссылки и ключевое слово
+«подбор»/«подбор-»; по позициям совпадений без повторного сканирования
+вычисляются комментарии к ссылкам, подзаголовок подбора и лимит фото.
+Подсказка метро ищется по индексу названий станций из standalone/metro/stations.csv
+(кириллица и транслит, как в адресах объявлений).
+
+Используется ботом (text_handlers, listings_processor) и сервером (parser_service).
+"""
+
+from __future__ import annotations
+
+import csv
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+STATIONS_CSV = Path(__file__).resolve().parent / "standalone" / "metro" / "stations.csv"
+
+URL_PATTERN = r"https?://[^\s,;]+"
+URL_RE = re.compile(URL_PATTERN)
+TOKEN_RE = re.compile(rf"(?P<url>{URL_PATTERN})|(?P<keyword>подбор-?)", re.IGNORECASE)
+KEYWORD_RE = re.compile(r"подбор-?", re.IGNORECASE)
+LEADING_NUMBER_RE = re.compile(r"^(\d+)\s*")
+TRAILING_NUMBER_RE = re.compile(r"(\d+)\s*$")
+WORD_SPLIT_RE = re.compile(r"[^0-9a-zа-я]+")
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+
+
+@dataclass
+class MessageTokens:
+    urls: List[str] = field(default_factory=list)
+    comments: List[str] = field(default_factory=list)
+    is_selection: bool = False
+    use_embedded: bool = False
+    subtitle: Optional[str] = None
+    photo_limit: Optional[int] = None
+    metro_hint: Optional[str] = None
+
+    @property
+    def url_count(self) -> int:
+        return len(self.urls)
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in WORD_SPLIT_RE.split(text.lower().replace("ё", "е")) if word]
+
+
+def transliterate(text: str) -> str:
+    return "".join(TRANSLIT.get(ch, ch) for ch in text.lower())
+
+
+@lru_cache(maxsize=1)
+def station_index() -> tuple[Dict[str, str], int]:
+    """
+    {нормализованное название: название станции} и максимальная длина названия в словах.
+    Ключи — слова через пробел, по-русски и в транслите («парк победы», «park pobedy»).
+    """
+    index: Dict[str, str] = {}
+    max_words = 1
+    try:
+        with open(STATIONS_CSV, encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                name = (row.get("station_name") or "").strip()
+                words = _words(name)
+                if not words:
+                    continue
+                max_words = max(max_words, len(words))
+                index.setdefault(" ".join(words), name)
+                index.setdefault(" ".join(transliterate(word) for word in words), name)
+    except FileNotFoundError:
+        print(f"⚠️ Не найден список станций метро: {STATIONS_CSV}")
+    return index, max_words
+
+
+def find_metro(text: str) -> Optional[str]:
+    """Первая по тексту станция метро; при совпадении в одной позиции — самое длинное название."""
+    index, max_words = station_index()
+    if not index:
+        return None
+    words = _words(text)
+    for start in range(len(words)):
+        for size in range(min(max_words, len(words) - start), 0, -1):
+            name = index.get(" ".join(words[start:start + size]))
+            if name:
+                return name
+    return None
+
+
+def _clean_comment(comment: str) -> str:
+    comment = KEYWORD_RE.sub("", comment).strip()
+    # Цифры в начале комментария — это ограничение фото, а не текст
+    return LEADING_NUMBER_RE.sub("", comment).strip()
+
+
+def extract_urls(text: str) -> List[str]:
+    """Ссылки из текста в порядке появления."""
+    return URL_RE.findall(text)
+
+
+def tokenize_message(text: str) -> MessageTokens:
+    tokens = MessageTokens()
+    url_spans: List[tuple[int, int]] = []
+    keyword = None
+
+    for match in TOKEN_RE.finditer(text):
+        if match.group("url"):
+            tokens.urls.append(match.group("url"))
+            url_spans.append(match.span())
+        elif keyword is None:
+            keyword = match
+
+    # «подбор» = фото встроены в HTML, «подбор-» = обычные ссылки на фото
+    lowered = text.lower()
+    tokens.is_selection = keyword is not None
+    tokens.use_embedded = tokens.is_selection and "подбор-" not in lowered
+
+    # Комментарий к ссылке — текст до следующей ссылки (или до конца сообщения)
+    for idx, (_, end) in enumerate(url_spans):
+        next_start = url_spans[idx + 1][0] if idx + 1 < len(url_spans) else len(text)
+        tokens.comments.append(_clean_comment(text[end:next_start]))
+
+    if keyword is not None:
+        # Лимит фото — число перед «подбор»: в начале сообщения или сразу перед словом
+        before = text[:keyword.start()].strip()
+        limit = LEADING_NUMBER_RE.search(before) or TRAILING_NUMBER_RE.search(before)
+        if limit:
+            tokens.photo_limit = int(limit.group(1))
+
+        # Подзаголовок — текст после «подбор» до первой ссылки за ним
+        next_url = next((start for start, _ in url_spans if start >= keyword.end()), len(text))
+        subtitle = KEYWORD_RE.sub("", text[keyword.end():next_url]).strip()
+        tokens.subtitle = subtitle or None
+
+    # Метро: сначала в ссылках (транслит в адресе), затем в тексте до первой ссылки
+    for url in tokens.urls:
+        tokens.metro_hint = find_metro(url)
+        if tokens.metro_hint:
+            break
+    if not tokens.metro_hint:
+        head = text[:url_spans[0][0]] if url_spans else text
+        tokens.metro_hint = find_metro(KEYWORD_RE.sub(" ", head))
+
+    return tokens
+
+
+__all__ = [
+    "MessageTokens",
+    "URL_RE",
+    "extract_urls",
+    "find_metro",
+    "station_index",
+    "tokenize_message",
+    "transliterate",
+]
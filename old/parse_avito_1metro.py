@@ -21,8 +21,45 @@ from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
+
+# Попытка импорта ожиданий по событиям страницы (browser_waits.py в корне репозитория)
+try:
+    from browser_waits import (
+        enable_request_blocking,
+        wait_for_any,
+        wait_for_count_increase,
+        wait_for_document_ready,
+        wait_for_dom_idle,
+    )
+    BROWSER_WAITS_AVAILABLE = True
+except ImportError:
+    BROWSER_WAITS_AVAILABLE = False
+    print("⚠️ Модуль browser_waits не найден, используются фиксированные паузы")
+
+    def enable_request_blocking(driver, patterns=None):
+        return False
+
+    def wait_for_document_ready(driver, timeout=10.0):
+        time.sleep(min(timeout, 1))
+        return True
+
+    def wait_for_dom_idle(driver, idle_ms=300, timeout=5.0):
+        time.sleep(min(timeout, 1))
+        return True
+
+    def wait_for_any(driver, selectors, timeout=10.0):
+        try:
+            return WebDriverWait(driver, timeout).until(
+                lambda d: next((sel for sel in selectors if d.find_elements(By.CSS_SELECTOR, sel)), False)
+            )
+        except TimeoutException:
+            return None
+
+    def wait_for_count_increase(driver, selector, previous, timeout=5.0):
+        time.sleep(timeout)
+        return len(driver.find_elements(By.CSS_SELECTOR, selector))
+
 import re
 from datetime import datetime, timedelta
 import base64
@@ -599,8 +636,14 @@ class EnhancedMetroParser:
                 "profile.managed_default_content_settings.images": 2
             })
             
+            # Страница считается загруженной по DOMContentLoaded, дальше ждём карточки по селекторам
+            options.page_load_strategy = "eager"
+
             # print("🔧 Создаем браузер...")  # Убрано из лога
             self.driver = webdriver.Chrome(options=options)
+
+            # Картинки, шрифты и аналитика не нужны для парсинга
+            enable_request_blocking(self.driver)
             
             # Убираем webdriver
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
@@ -858,16 +901,9 @@ class EnhancedMetroParser:
             # Сначала переходим на домен
             # print("🌐 Переходим на AVITO...")  # Убрано из лога
             self.driver.get("https://avito.ru")
-            time.sleep(5)  # Увеличиваем время ожидания
             
             # Проверяем, что страница загрузилась
-            try:
-                # Ждем появления элемента, подтверждающего загрузку
-                WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.TAG_NAME, "body"))
-                )
-                # print("✅ Страница AVITO загружена")  # Убрано из лога
-            except:
+            if not wait_for_document_ready(self.driver, timeout=10):
                 print("⚠️ Страница AVITO загрузилась частично, продолжаем...")
             
             # Применяем cookies
@@ -924,7 +960,8 @@ class EnhancedMetroParser:
             # Обновляем страницу с примененными cookies
             print("🔄 Обновляем страницу с cookies...")
             self.driver.refresh()
-            time.sleep(5)
+            wait_for_document_ready(self.driver, timeout=10)
+            wait_for_dom_idle(self.driver, idle_ms=500, timeout=5)
             
             # Проверяем, что мы все еще на AVITO
             current_url = self.driver.current_url
@@ -1070,17 +1107,18 @@ class EnhancedMetroParser:
             print("❌ avito_id для метро не определен")
             return None
     
-    def wait_for_dom_stability(self, timeout=15):
-        """Упрощенная версия: простая пауза + проверка на пустую страницу
+    def wait_for_dom_stability(self, timeout=1.5):
+        """Ждет простоя DOM (MutationObserver) + проверка на пустую страницу
         
-        Заменяет сложную логику ожидания DOM на простую паузу в 1 секунду
-        и быструю проверку на пустую страницу.
+        Вместо фиксированной паузы ~1 сек ждем, пока в DOM 300 мс не появляются
+        новые узлы, но не дольше timeout (порядка прежней паузы), затем быстро
+        проверяем страницу на пустоту.
         """
         try:
-            print("⏳ Простая пауза для стабилизации DOM (1 сек)...")
+            print("⏳ Ждем стабилизации DOM...")
             
-            # Простая пауза вместо сложной логики
-            time.sleep(1)
+            if not wait_for_dom_idle(self.driver, idle_ms=300, timeout=timeout):
+                print(f"⚠️ DOM не успокоился за {timeout} сек, продолжаем")
             
             # БЫСТРАЯ ПРОВЕРКА на пустую страницу
             page_text = self.driver.page_source.lower()
@@ -1116,7 +1154,7 @@ class EnhancedMetroParser:
                     print("🔄 Завершаем парсинг метро - переходим к следующему")
                     return True
             
-            print("✅ DOM стабилизирован (простая пауза)")
+            print("✅ DOM стабилизирован")
             return True
             
         except Exception as e:
@@ -1189,13 +1227,10 @@ class EnhancedMetroParser:
                 # Продолжаем с текстовой проверкой
             
             # ДОПОЛНИТЕЛЬНАЯ ПРОВЕРКА: ждем появления карточек с таймаутом
-            start_time = time.time()
-            while time.time() - start_time < timeout:
+            if wait_for_any(self.driver, ['[data-marker="item"]'], timeout=timeout):
                 cards = self.driver.find_elements(By.CSS_SELECTOR, '[data-marker="item"]')
-                if cards:
-                    print(f"✅ Карточки загружены: {len(cards)}")
-                    return True
-                time.sleep(0.5)  # Проверяем каждые 0.5 секунды
+                print(f"✅ Карточки загружены: {len(cards)}")
+                return True
             
             # Если таймаут истек, проверяем еще раз на пустую страницу
             print(f"⚠️ Таймаут ожидания карточек ({timeout}с), финальная проверка...")
@@ -1246,19 +1281,19 @@ class EnhancedMetroParser:
                     # Плавно прокручиваем вниз
                     self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
                     
-                    # Ждем загрузки новых карточек
-                    time.sleep(actual_scroll_pause)
-                    
-                    # Проверяем, появились ли новые карточки
-                    new_cards = self.driver.find_elements(By.CSS_SELECTOR, '[data-marker="item"]')
-                    if len(new_cards) <= current_cards:
-                        time.sleep(actual_scroll_pause * 2)  # Увеличиваем паузу
+                    # Ждем появления новых карточек (scroll_pause — максимум ожидания, а не пауза)
+                    new_count = wait_for_count_increase(
+                        self.driver, '[data-marker="item"]', current_cards, timeout=actual_scroll_pause * 3
+                    )
+                    if new_count <= current_cards:
+                        # Новые карточки не подгружаются — дальше крутить бессмысленно
+                        break
                     
                     scroll_attempts += 1
                     
                 except Exception as e:
                     print(f"⚠️ Ошибка при прокрутке: {e}")
-                    time.sleep(actual_scroll_pause * 2)
+                    wait_for_dom_idle(self.driver, idle_ms=300, timeout=actual_scroll_pause * 2)
                     scroll_attempts += 1
                     continue
             
@@ -3063,7 +3098,8 @@ class EnhancedMetroParser:
             
             # Переходим на страницу
             self.driver.get(metro_url)
-            time.sleep(self.page_load_delay)
+            # page_load_delay — верхняя граница ожидания карточек, а не фиксированная пауза
+            wait_for_any(self.driver, ['[data-marker="item"]'], timeout=self.page_load_delay)
             
             # Проверяем текущий URL
             current_url = self.driver.current_url
@@ -3167,9 +3203,9 @@ class EnhancedMetroParser:
             except Exception as e:
                 print(f"[URL_CHECK] Ошибка проверки URL: {e}")
             
-            # Увеличиваем время ожидания для загрузки страницы и DOM
+            # Ждем появления карточек (пустые страницы распознает wait_for_dom_stability ниже)
             print(f"⏳ Ожидаем загрузку страницы {page}...")
-            time.sleep(5)  # Увеличиваем с 2 до 5 секунд
+            wait_for_any(self.driver, ['[data-marker="item"]'], timeout=self.page_load_delay)
             
             # Дополнительная проверка готовности страницы
             # Простая и надежная логика загрузки карточек (как в старой версии)
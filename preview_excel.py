@@ -3,6 +3,8 @@ from pathlib import Path
 
 import pandas as pd
 
+from excel_stream import iter_batches, prefer_parquet
+
 
 def preview_excel(path: str, sheet: str | int | None, rows: int) -> None:
     file_path = Path(path).expanduser()
@@ -10,17 +12,12 @@ def preview_excel(path: str, sheet: str | int | None, rows: int) -> None:
         raise FileNotFoundError(f"File not found: {file_path}")
 
     sheet_name = sheet if sheet else 0
-    try:
-        df = pd.read_excel(file_path, sheet_name=sheet_name, nrows=rows)
-    except ValueError as exc:
-        # Surface available sheet names if a wrong sheet was provided.
-        if sheet:
-            workbook = pd.ExcelFile(file_path)
-            available = ", ".join(workbook.sheet_names)
-            raise ValueError(f"{exc}. Available sheets: {available}") from exc
-        raise
-
-    print(f"Preview from {file_path} (sheet={sheet_name!r}) — showing up to {rows} rows")
+    # Only the first batch is read: a Parquet copy via memory-mapped Arrow,
+    # Excel via openpyxl read_only (wrong sheet names list the available ones).
+    source_path = prefer_parquet(file_path, sheet)
+    df = next(iter_batches(source_path, sheet=sheet, batch_size=max(rows, 1)), pd.DataFrame())
+
+    print(f"Preview from {source_path} (sheet={sheet_name!r}) — showing up to {rows} rows")
     print(df.to_string(index=False))
 
 
@@ -32,7 +29,7 @@ def parse_args() -> argparse.Namespace:
         "-p",
         "--path",
         default="server/Обработка БД.xlsx",
-        help="Path to the Excel file (default: server/Обработка БД.xlsx)",
+        help="Path to the Excel/CSV/Parquet file (default: server/Обработка БД.xlsx)",
     )
     parser.add_argument(
         "-s",
@@ -0,0 +1,113 @@
+# progress_reporter.py
+"""
+Прогресс обработки объявлений в одном сообщении Telegram.
+
+Вместо отдельного message.answer на каждое объявление бот отправляет одно
+статусное сообщение и редактирует его не чаще раза в min_interval секунд
+(по умолчанию 1 с). Итог — одно финальное редактирование в finish().
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+# Лимит Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+class ProgressReporter:
+    def __init__(self, message: Message, total: int, title: str = "📸 Загрузка фото",
+                 photo_limit: Optional[int] = None, min_interval: float = 1.0):
+        self._message = message
+        self._total = total
+        self._title = title
+        self._photo_limit = photo_limit
+        self._min_interval = min_interval
+        self._status: Optional[Message] = None
+        self._current: Optional[int] = None
+        self._stats: Dict[int, dict] = {}
+        self._last_text = ""
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # --- вызовы из generate_html_gallery_embedded ---
+
+    def listing_started(self, number: int, url: str = "") -> None:
+        self._current = number
+        self._schedule()
+
+    def listing_done(self, stat: dict) -> None:
+        self._stats[stat['listing_number']] = stat
+        self._schedule()
+
+    # --- сообщение ---
+
+    async def start(self) -> None:
+        self._last_text = self._render()
+        self._status = await self._message.answer(self._last_text)
+        self._last_edit = time.monotonic()
+
+    async def finish(self) -> None:
+        """Отменяет отложенное обновление и один раз показывает итог"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._current = None
+        await self._edit(self._render(final=True))
+
+    def _schedule(self) -> None:
+        # Одно отложенное обновление на интервал: промежуточные изменения склеиваются
+        if self._status is None or (self._flush_task and not self._flush_task.done()):
+            return
+        self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        delay = self._last_edit + self._min_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._edit(self._render())
+
+    async def _edit(self, text: str) -> None:
+        if self._status is None or text == self._last_text:
+            return
+        try:
+            await self._status.edit_text(text)
+        except TelegramRetryAfter as e:
+            # Flood control: ждём и пробуем ещё раз с актуальным текстом
+            await asyncio.sleep(e.retry_after)
+            await self._edit(text)
+            return
+        except TelegramBadRequest as e:
+            # "message is not modified" и подобное — не повод прерывать подбор
+            logging.warning(f"Не удалось обновить статус: {e}")
+        self._last_text = text
+        self._last_edit = time.monotonic()
+
+    def _render(self, final: bool = False) -> str:
+        done = len(self._stats)
+        photos = sum(stat.get('photo_count', 0) for stat in self._stats.values())
+        if final:
+            header = f"{self._title}: готово {done}/{self._total}, всего фото: {photos}"
+        else:
+            header = f"{self._title}: {done}/{self._total}"
+        lines = [header]
+        if self._photo_limit:
+            lines.append(f"🔢 Ограничение: максимум {self._photo_limit} фото на объявление")
+
+        for number in sorted(self._stats):
+            stat = self._stats[number]
+            if stat.get('photo_count', 0) > 0:
+                lines.append(f"✅ {number}: {stat['photo_count']} фото")
+            elif 'error' in stat:
+                lines.append(f"❌ {number}: ошибка — {stat['error']}")
+            else:
+                lines.append(f"⚠️ {number}: фото не найдены")
+        if self._current is not None and self._current not in self._stats:
+            lines.append(f"⏳ {self._current}: обрабатывается")
+
+        text = "\n".join(lines)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - 1] + "…"
+        return text
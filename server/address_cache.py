@@ -0,0 +1,262 @@
+"""Python helper for public.address_cache (memoized get_house_id_by_address).
+
+Таблица и функции — ``DB/address_cache.sql``. Пример отчёта:
+    python server/address_cache.py report
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+logger = logging.getLogger(__name__)
+
+_COMMA_RE = re.compile(r"\s*,\s*")
+_SPACE_RE = re.compile(r"\s+")
+
+CachedResult = Tuple[Optional[int], bool, Optional[str]]
+
+
+def normalize_address_key(address: Optional[str]) -> Optional[str]:
+    """То же, что ``public.normalize_address_key``: пробелы схлопнуты, регистр сохранён."""
+
+    if address is None:
+        return None
+    key = _SPACE_RE.sub(" ", _COMMA_RE.sub(", ", address.strip()))
+    return key or None
+
+
+def cache_available(cursor: RealDictCursor) -> bool:
+    cursor.execute("SELECT to_regclass('public.address_cache') IS NOT NULL AS ok")
+    return bool(cursor.fetchone()["ok"])
+
+
+def fetch_versions(cursor: RealDictCursor) -> Tuple[str, str]:
+    cursor.execute("SELECT resolver_version, fias_version FROM public.address_cache_meta WHERE id")
+    row = cursor.fetchone()
+    if not row:
+        raise RuntimeError("public.address_cache_meta is empty; apply DB/address_cache.sql")
+    return row["resolver_version"], row["fias_version"]
+
+
+def resolve_addresses(
+    cursor: RealDictCursor,
+    addresses: Sequence[Optional[str]],
+    resolver: Any = None,
+) -> List[CachedResult]:
+    """
+    Разрешает адреса через кэш; результаты в порядке входа.
+
+    Промахи разбираются ``resolver.resolve_many`` (in-process резолвер), а без
+    него — одним запросом к ``get_house_id_by_address``. Новые результаты
+    сохраняются в кэш с текущими версиями резолвера и FIAS.
+    """
+
+    keys = [normalize_address_key(address) for address in addresses]
+    unique_keys = sorted({key for key in keys if key})
+    if not unique_keys:
+        return [(None, False, None) for _ in keys]
+
+    resolver_version, fias_version = fetch_versions(cursor)
+    # Чтение кэша — обычный SELECT: счётчики попаданий ведут sequence, не строки кэша
+    cursor.execute(
+        """
+        SELECT c.normalized_address, c.house_id, c.street_found, c.house_part
+        FROM public.address_cache c
+        WHERE c.normalized_address = ANY(%s)
+          AND c.resolver_version = %s
+          AND c.fias_version = %s
+        """,
+        (unique_keys, resolver_version, fias_version),
+    )
+    found: Dict[str, CachedResult] = {
+        row["normalized_address"]: (row["house_id"], bool(row["street_found"]), row["house_part"])
+        for row in cursor.fetchall()
+    }
+
+    missing = [key for key in unique_keys if key not in found]
+    cursor.execute("SELECT public.address_cache_count(%s, %s)", (len(found), len(missing)))
+    if missing:
+        fresh, resolved_by = _resolve_uncached(cursor, missing, resolver)
+        execute_values(
+            cursor,
+            """
+            INSERT INTO public.address_cache AS c (
+                normalized_address, house_id, street_found, house_part,
+                resolver_version, fias_version, resolved_by
+            )
+            VALUES %s
+            ON CONFLICT (normalized_address) DO UPDATE
+               SET house_id = EXCLUDED.house_id,
+                   street_found = EXCLUDED.street_found,
+                   house_part = EXCLUDED.house_part,
+                   resolver_version = EXCLUDED.resolver_version,
+                   fias_version = EXCLUDED.fias_version,
+                   resolved_at = now(),
+                   resolved_by = EXCLUDED.resolved_by
+            """,
+            [
+                (key, *fresh[key], resolver_version, fias_version, resolved_by.get(key, resolver_version))
+                for key in missing
+            ],
+        )
+        found.update(fresh)
+
+    return [found.get(key, (None, False, None)) if key else (None, False, None) for key in keys]
+
+
+def _resolve_uncached(
+    cursor: RealDictCursor,
+    keys: Sequence[str],
+    resolver: Any,
+) -> Tuple[Dict[str, CachedResult], Dict[str, str]]:
+    """Результаты промахов и версия in-process резолвера для адресов, найденных им."""
+
+    results: Dict[str, CachedResult] = {}
+    resolved_by: Dict[str, str] = {}
+    if resolver is not None:
+        try:
+            resolutions = resolver.resolve_many(keys, cursor=cursor)
+        except Exception:  # noqa: BLE001
+            logger.exception("In-process address resolver failed, falling back to SQL")
+            resolutions = []
+        results = {
+            key: (res.house_id, res.street_found, res.house_part)
+            for key, res in zip(keys, resolutions)
+        }
+        version = getattr(resolver, "version", None)
+        if version:
+            resolved_by = {key: version for key, result in results.items() if result[0] is not None}
+        # Промахи индекса перепроверяем SQL-функцией, чтобы не закэшировать ложный NULL
+        keys = [key for key in keys if results.get(key, (None,))[0] is None]
+        if not keys:
+            return results, resolved_by
+
+    cursor.execute(
+        """
+        SELECT a.address, r.result_id, r.street_found, r.house_part
+        FROM unnest(%s::text[]) AS a(address)
+        LEFT JOIN LATERAL (
+            SELECT * FROM public.get_house_id_by_address(a.address) LIMIT 1
+        ) r ON TRUE
+        """,
+        (list(keys),),
+    )
+    for row in cursor.fetchall():
+        results[row["address"]] = (row["result_id"], bool(row["street_found"]), row["house_part"])
+    return results, resolved_by
+
+
+def bump_fias_version(cursor: RealDictCursor, version: Optional[str] = None) -> str:
+    cursor.execute("SELECT public.address_cache_bump_fias_version(%s) AS version", (version,))
+    return cursor.fetchone()["version"]
+
+
+def bump_resolver_version(cursor: RealDictCursor, version: str) -> str:
+    cursor.execute("SELECT public.address_cache_bump_resolver_version(%s) AS version", (version,))
+    return cursor.fetchone()["version"]
+
+
+def hit_rate_report(cursor: RealDictCursor) -> Dict[str, Any]:
+    """
+    Сводка по кэшу. Попадания и промахи — счётчики ``address_cache_hits_seq`` /
+    ``address_cache_misses_seq`` с последней смены версий, hit_rate = hits / lookups.
+    """
+
+    resolver_version, fias_version = fetch_versions(cursor)
+    cursor.execute(
+        """
+        SELECT
+            count(*) FILTER (WHERE fresh)                              AS entries,
+            count(*) FILTER (WHERE NOT fresh)                          AS stale_entries,
+            count(*) FILTER (WHERE fresh AND house_id IS NULL)         AS unresolved,
+            count(*) FILTER (WHERE fresh AND resolved_at > now() - interval '1 day') AS resolved_last_day
+        FROM (
+            SELECT c.*, (c.resolver_version = %s AND c.fias_version = %s) AS fresh
+            FROM public.address_cache c
+        ) s
+        """,
+        (resolver_version, fias_version),
+    )
+    row = dict(cursor.fetchone())
+    cursor.execute(
+        """
+        SELECT COALESCE(resolved_by, resolver_version) AS resolved_by, count(*) AS entries
+        FROM public.address_cache
+        WHERE resolver_version = %s AND fias_version = %s
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        (resolver_version, fias_version),
+    )
+    row["entries_by_resolver"] = {item["resolved_by"]: int(item["entries"]) for item in cursor.fetchall()}
+    cursor.execute(
+        """
+        SELECT
+            (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM public.address_cache_hits_seq)   AS hits,
+            (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM public.address_cache_misses_seq) AS misses
+        """
+    )
+    counters = cursor.fetchone()
+    hits = int(counters["hits"])
+    misses = int(counters["misses"])
+    lookups = hits + misses
+    row.update(
+        {
+            "hits": hits,
+            "misses": misses,
+            "resolver_version": resolver_version,
+            "fias_version": fias_version,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+        }
+    )
+    return row
+
+
+def _load_dsn() -> str:
+    from dotenv import load_dotenv
+
+    repo_root = Path(__file__).resolve().parents[1]
+    env_file = os.getenv("REPORT_ENV_FILE") or (repo_root / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Кэш разрешения адресов public.address_cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("report", help="Показать hit rate и размер кэша")
+    bump = sub.add_parser("bump-fias", help="Инвалидировать кэш после загрузки FIAS")
+    bump.add_argument("--version", default=None)
+    resolver = sub.add_parser("bump-resolver", help="Инвалидировать кэш после изменения резолвера")
+    resolver.add_argument("version")
+    sub.add_parser("purge", help="Удалить записи устаревших версий")
+    args = parser.parse_args()
+
+    with psycopg2.connect(_load_dsn()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if args.command == "report":
+            for key, value in hit_rate_report(cur).items():
+                print(f"{key:>20}: {value}")
+        elif args.command == "bump-fias":
+            print(f"✅ fias_version = {bump_fias_version(cur, args.version)}")
+        elif args.command == "bump-resolver":
+            print(f"✅ resolver_version = {bump_resolver_version(cur, args.version)}")
+        elif args.command == "purge":
+            cur.execute("SELECT public.address_cache_purge_stale() AS deleted")
+            print(f"🧹 Удалено записей: {cur.fetchone()['deleted']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+"""In-process address → house_id resolver over a preloaded FIAS index.
+
+Повторяет логику ``public.get_house_id_by_address`` (``parse_address`` →
+``find_parentobjids_by_parsed`` → ``parse_and_find_house``), но работает по
+индексам в памяти: улицы и дома из ``fias_objects``/``fias_houses`` и
+справочник ``lookup_types`` загружаются один раз.
+
+Адреса с ЖК (``get_house_id_by_jk``) индекс не разбирает — такие адреса
+помечаются ``needs_sql`` и в ``resolve_many`` уходят в SQL-функцию.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Pattern, Sequence, Set, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger(__name__)
+
+RESOLVER_VERSION = "py-1"
+
+_BIG_VARIANTS = ("большой", "большая", "большое", "большие", "б.")
+_SMALL_VARIANTS = ("малый", "малая", "малое", "малые", "м.")
+_BOULEVARD_QUARTER_RE = re.compile(r"^([^,]*?)\s+бульвар\s+кв-л\s*(.*)$", re.IGNORECASE)
+_JK_RE = re.compile(r"жилой комплекс|жк", re.IGNORECASE)
+_SEGMENT_SPLIT_RE = re.compile(r"\s*,\s*")
+_WORD_SPLIT_RE = re.compile(r"\s+")
+_LETTER_SUFFIX_RE = re.compile(r"([0-9/]+)[а-яa-z]+$")
+
+# (house_id, addtype1, addnum1, addtype2, addnum2); addnum хранится строкой, '' вместо NULL
+HouseEntry = Tuple[int, Optional[int], str, Optional[int], str]
+
+
+@dataclass
+class AddressResolution:
+    """Результат разбора адреса, совместимый с ``get_house_id_by_address``."""
+
+    address: str
+    house_id: Optional[int] = None
+    street_found: bool = False
+    house_part: Optional[str] = None
+    street_type: Optional[str] = None
+    norm_name: Optional[str] = None
+    needs_sql: bool = False
+
+
+def _compile_alias(alias: str) -> Pattern[str]:
+    try:
+        return re.compile(alias)
+    except re.error:
+        return re.compile(re.escape(alias))
+
+
+def _strip_pattern(alias: str, optional_dot: bool) -> Pattern[str]:
+    body = alias + (r"\.?" if optional_dot else "")
+    try:
+        return re.compile(rf"(^|\s){body}($|\s)")
+    except re.error:
+        return re.compile(rf"(^|\s){re.escape(alias)}($|\s)")
+
+
+class FiasAddressIndex:
+    """
+    Компактный индекс FIAS для разбора адресов в памяти.
+
+    * ``_token_index`` — инвертированный индекс токен → номера улиц;
+    * ``_gram_index`` — подстроки токенов длиной 1–3 символа → номера токенов
+      (ILIKE '%слово%' без перебора всего словаря);
+    * ``_houses`` — (objectid улицы, номер дома в верхнем регистре) → дома.
+    """
+
+    def __init__(
+        self,
+        street_types: Sequence[Tuple[str, Sequence[str]]],
+        housetypes: Sequence[Tuple[str, int]],
+        addtypes: Sequence[Tuple[str, int]],
+        streets: Iterable[Tuple[int, str, str]],
+        houses: Iterable[Tuple[int, int, Optional[str], Optional[int], Optional[object], Optional[int], Optional[object]]],
+    ) -> None:
+        # Справочник типов улиц в порядке lookup_types (как перебирает parse_address)
+        self._type_rules: List[Tuple[str, Pattern[str]]] = []
+        self._type_strip: Dict[str, List[Pattern[str]]] = {}
+        for kind, aliases in street_types:
+            strip = self._type_strip.setdefault(kind, [])
+            for alias in aliases:
+                self._type_rules.append((kind, _compile_alias(alias)))
+                strip.append(_strip_pattern(alias, optional_dot=True))
+            strip.append(_strip_pattern(kind, optional_dot=False))
+
+        self._housetypes = sorted(
+            ((name.lower(), type_id) for name, type_id in housetypes if name),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._default_housetype = next((type_id for name, type_id in self._housetypes if name == "д"), None)
+        self._addtypes = sorted(
+            ((name.lower(), type_id) for name, type_id in addtypes if name),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._addnum_patterns = {name: _compile_alias(rf"^{name}([0-9]+)") for name, _ in self._addtypes}
+
+        self._street_ids: List[int] = []
+        self._street_names: List[str] = []
+        self._token_index: Dict[str, List[int]] = {}
+        self._type_index: Dict[str, Set[int]] = {}
+        for objectid, typename, norm_name in streets:
+            position = len(self._street_ids)
+            name = (norm_name or "").lower()
+            self._street_ids.append(int(objectid))
+            self._street_names.append(name)
+            self._type_index.setdefault(typename, set()).add(position)
+            for token in set(name.split()):
+                self._token_index.setdefault(token, []).append(position)
+        self._tokens: List[str] = list(self._token_index)
+        self._gram_index: Dict[str, List[int]] = {}
+        for token_id, token in enumerate(self._tokens):
+            grams = {token[i:i + n] for n in (1, 2, 3) for i in range(len(token) - n + 1)}
+            for gram in grams:
+                self._gram_index.setdefault(gram, []).append(token_id)
+        self._all_streets: FrozenSet[int] = frozenset(range(len(self._street_ids)))
+        self._word_cache: Dict[str, FrozenSet[int]] = {}
+        self._word_cache_lock = threading.Lock()
+
+        self._houses: Dict[Tuple[int, str], List[HouseEntry]] = {}
+        house_count = 0
+        for house_id, parent_id, housenum, addtype1, addnum1, addtype2, addnum2 in houses:
+            if housenum is None:
+                continue
+            key = (int(parent_id), housenum.upper())
+            self._houses.setdefault(key, []).append(
+                (
+                    int(house_id),
+                    addtype1,
+                    "" if addnum1 is None else str(addnum1),
+                    addtype2,
+                    "" if addnum2 is None else str(addnum2),
+                )
+            )
+            house_count += 1
+
+        self.loaded_at = time.time()
+        self.street_count = len(self._street_ids)
+        self.house_count = house_count
+        self.token_count = len(self._token_index)
+
+    # ------------------------------------------------------------------ загрузка
+
+    @classmethod
+    def load(cls, conn) -> "FiasAddressIndex":
+        """Загружает справочники и подмножество улиц/домов FIAS из БД."""
+
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT l.name, array_remove(array_agg(a.alias ORDER BY a.ord), NULL)
+                FROM public.lookup_types l
+                LEFT JOIN LATERAL unnest(l.aliases) WITH ORDINALITY AS a(alias, ord) ON TRUE
+                WHERE l.category = 'street_type'
+                GROUP BY l.id, l.name
+                ORDER BY l.id
+                """
+            )
+            street_types = [(name, list(aliases or [])) for name, aliases in cur.fetchall()]
+            cur.execute("SELECT name, id FROM public.lookup_types WHERE category = 'housetype'")
+            housetypes = cur.fetchall()
+            cur.execute("SELECT name, id FROM public.lookup_types WHERE category = 'addtype'")
+            addtypes = cur.fetchall()
+
+            kinds = [name for name, _ in street_types]
+            cur.execute(
+                """
+                SELECT objectid, typename, norm_name
+                FROM public.fias_objects
+                WHERE typename = ANY(%s)
+                ORDER BY objectid
+                """,
+                (kinds,),
+            )
+            streets = cur.fetchall()
+            cur.execute(
+                """
+                SELECT h.id, h.parentobjid, h.housenum, h.addtype1, h.addnum1, h.addtype2, h.addnum2
+                FROM public.fias_houses h
+                WHERE h.parentobjid IN (
+                    SELECT objectid FROM public.fias_objects WHERE typename = ANY(%s)
+                )
+                ORDER BY h.id
+                """,
+                (kinds,),
+            )
+            houses = cur.fetchall()
+
+        index = cls(street_types, housetypes, addtypes, streets, houses)
+        logger.info(
+            "FIAS address index loaded: %s streets, %s houses, %s tokens in %.1fs",
+            index.street_count,
+            index.house_count,
+            index.token_count,
+            time.perf_counter() - started,
+        )
+        return index
+
+    # ------------------------------------------------------------------ разбор
+
+    def resolve(self, address: Optional[str]) -> AddressResolution:
+        """Разбирает один адрес; ``needs_sql=True`` — адрес с ЖК, нужен SQL-резолвер."""
+
+        result = AddressResolution(address=address or "")
+        if address is None or not address.strip():
+            return result
+
+        processed = address
+        if re.search("бульвар", address, re.IGNORECASE) and re.search("кв-л", address, re.IGNORECASE):
+            processed = _BOULEVARD_QUARTER_RE.sub(r"кв-л, \1 \2", address)
+
+        if _JK_RE.search(processed):
+            result.needs_sql = True
+            return result
+
+        parsed = self.parse_address(processed)
+        if parsed is None:
+            # parse_address не нашёл тип улицы: SQL ищет дом по пустому house_part и ничего не находит
+            result.street_found = True
+            return result
+
+        street_type, norm_name, house_part = parsed
+        result.street_type = street_type
+        result.norm_name = norm_name
+        result.house_part = house_part
+
+        parent_positions = self.find_street_positions(street_type, norm_name)
+        result.street_found = bool(parent_positions)
+        if parent_positions:
+            result.house_id = self.find_house([self._street_ids[pos] for pos in sorted(parent_positions)], house_part)
+        return result
+
+    def parse_address(self, street_raw: str) -> Optional[Tuple[str, str, Optional[str]]]:
+        """Аналог ``public.parse_address``: (street_type, norm_name, house_part) или None."""
+
+        clean = street_raw.replace("ё", "е")
+        clean = re.sub(r"\.+", ".", clean).strip()
+        segments = _SEGMENT_SPLIT_RE.split(clean)
+
+        found_kind: Optional[str] = None
+        found_index = -1
+        for index, segment in enumerate(segments):
+            for word in _WORD_SPLIT_RE.split(segment):
+                base_word = word[:-1] if word.endswith(".") else word
+                for kind, pattern in self._type_rules:
+                    if pattern.search(base_word) or kind == base_word:
+                        found_kind = kind
+                        break
+                if found_kind is not None:
+                    break
+            if found_kind is not None:
+                clean = segment
+                found_index = index
+                break
+
+        if found_kind is None:
+            return None
+
+        for pattern in self._type_strip.get(found_kind, []):
+            clean = pattern.sub(" ", clean)
+        clean = clean.strip()
+
+        house_part = segments[found_index + 1] if found_index + 1 < len(segments) else None
+        return found_kind, clean, house_part
+
+    def find_street_positions(self, street_type: Optional[str], norm_name: Optional[str]) -> FrozenSet[int]:
+        """Аналог ``find_parentobjids_by_parsed``: номера подходящих улиц в индексе."""
+
+        main_words: List[str] = []
+        want_big = want_small = False
+        num_clean: Optional[str] = None
+        for word in _WORD_SPLIT_RE.split(norm_name or ""):
+            lowered = word.lower()
+            if re.search(r"\d", word):
+                num_clean = re.sub(r"\D", "", word)
+            elif lowered in _BIG_VARIANTS:
+                want_big = True
+            elif lowered in _SMALL_VARIANTS:
+                want_small = True
+            else:
+                main_words.append(lowered)
+
+        if main_words:
+            candidates: Set[int] = set()
+            for word in main_words:
+                candidates |= self._positions_for_word(word)
+        else:
+            candidates = set(self._all_streets)
+
+        if street_type is not None:
+            candidates &= self._type_index.get(street_type, set())
+
+        if want_big or want_small or num_clean is not None:
+            num_re = re.compile(rf"(?:^| ){num_clean}[^ ]*(?: |$)") if num_clean is not None else None
+            filtered = set()
+            for position in candidates:
+                name = self._street_names[position]
+                if want_big and not any(variant in name for variant in _BIG_VARIANTS):
+                    continue
+                if want_small and not any(variant in name for variant in _SMALL_VARIANTS):
+                    continue
+                if num_re is not None and not num_re.search(name):
+                    continue
+                filtered.add(position)
+            candidates = filtered
+
+        return frozenset(candidates)
+
+    def _positions_for_word(self, word: str) -> FrozenSet[int]:
+        # ILIKE '%word%' по norm_name: слово без пробелов совпадает внутри одного токена
+        cached = self._word_cache.get(word)
+        if cached is not None:
+            return cached
+        positions: Set[int] = set()
+        for token_id in self._tokens_containing(word):
+            positions.update(self._token_index[self._tokens[token_id]])
+        result = frozenset(positions)
+        with self._word_cache_lock:
+            if len(self._word_cache) > 50_000:
+                self._word_cache.clear()
+            self._word_cache[word] = result
+        return result
+
+    def _tokens_containing(self, word: str) -> Iterable[int]:
+        """Номера токенов, содержащих word: пересечение списков триграмм и проверка кандидатов."""
+
+        if not word:
+            return range(len(self._tokens))
+        if len(word) <= 3:
+            # Все подстроки до 3 символов проиндексированы — список точный
+            return self._gram_index.get(word, ())
+        postings = []
+        for gram in {word[i:i + 3] for i in range(len(word) - 2)}:
+            posting = self._gram_index.get(gram)
+            if not posting:
+                return ()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return ()
+        return [token_id for token_id in candidates if word in self._tokens[token_id]]
+
+    def find_house(self, parent_ids: Sequence[int], hs_raw: Optional[str]) -> Optional[int]:
+        """Аналог ``public.parse_and_find_house``."""
+
+        if hs_raw is None:
+            return None
+        hs = hs_raw.strip().lower()
+        hs = re.sub(r"^.*\s+", "", hs)
+
+        housetype = next((name for name, _ in self._housetypes if hs.startswith(name)), None)
+        if housetype is not None:
+            prefix = hs[len(housetype):]
+        else:
+            prefix = re.sub(r"^д\.?\s*", "", hs)
+
+        rest = prefix
+        a1_id: Optional[int] = None
+        a2_id: Optional[int] = None
+        n1 = n2 = ""
+        first = None
+        for name, type_id in self._addtypes:
+            pos = rest.find(name)
+            if pos >= 0 and (first is None or pos < first[0]):
+                first = (pos, name, type_id)
+        if first is not None:
+            pos, name, a1_id = first
+            prefix = rest[:pos]
+            rest = rest[pos:]
+            match = self._addnum_patterns[name].match(rest)
+            n1 = match.group(1) if match else ""
+            rest = rest[len(name + n1):]
+            if rest:
+                second = next(((n, t) for n, t in self._addtypes if rest.startswith(n)), None)
+                if second is not None:
+                    a2_id = second[1]
+                    match = self._addnum_patterns[second[0]].match(rest)
+                    n2 = match.group(1) if match else ""
+        else:
+            prefix = rest
+
+        number = prefix.upper()
+        for parent_id in parent_ids:
+            for house_id, addtype1, addnum1, addtype2, addnum2 in self._houses.get((parent_id, number), ()):
+                if addtype1 == a1_id and addnum1 == n1 and addtype2 == a2_id and addnum2 == n2:
+                    return house_id
+
+        for parent_id in parent_ids:
+            entries = self._houses.get((parent_id, number))
+            if entries:
+                return entries[0][0]
+
+        number = _LETTER_SUFFIX_RE.sub(r"\1", prefix).upper()
+        for parent_id in parent_ids:
+            entries = self._houses.get((parent_id, number))
+            if entries:
+                return entries[0][0]
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "resolver_version": RESOLVER_VERSION,
+            "streets": self.street_count,
+            "houses": self.house_count,
+            "tokens": self.token_count,
+            "grams": len(self._gram_index),
+            "loaded_at": self.loaded_at,
+        }
+
+
+class AddressResolver:
+    """Ленивая обёртка над ``FiasAddressIndex`` с пакетным API и SQL-фолбэком для ЖК."""
+
+    # Пишется в address_cache.resolved_by для записей, разобранных индексом
+    version = RESOLVER_VERSION
+
+    def __init__(self, dsn: str) -> None:
+        self._dsn = dsn
+        self._index: Optional[FiasAddressIndex] = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self) -> FiasAddressIndex:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    with psycopg2.connect(self._dsn) as conn:
+                        self._index = FiasAddressIndex.load(conn)
+        return self._index
+
+    def reload(self) -> FiasAddressIndex:
+        with psycopg2.connect(self._dsn) as conn:
+            index = FiasAddressIndex.load(conn)
+        with self._lock:
+            self._index = index
+        return index
+
+    def resolve(self, address: str, cursor: Optional[RealDictCursor] = None) -> Optional[int]:
+        return self.resolve_many([address], cursor=cursor)[0].house_id
+
+    def resolve_many(
+        self,
+        addresses: Sequence[Optional[str]],
+        cursor: Optional[RealDictCursor] = None,
+    ) -> List[AddressResolution]:
+        """
+        Разбирает пачку адресов; результаты в порядке входа.
+
+        Адреса с ЖК разрешаются одной SQL-выборкой через ``cursor`` (или
+        собственное соединение), остальные — только по индексу.
+        """
+
+        index = self.index
+        results = [index.resolve(address) for address in addresses]
+        pending = sorted({res.address for res in results if res.needs_sql})
+        if pending:
+            resolved = self._resolve_via_sql(pending, cursor)
+            for res in results:
+                if res.needs_sql:
+                    res.house_id, res.street_found, res.house_part = resolved.get(res.address, (None, False, None))
+        return results
+
+    def _resolve_via_sql(
+        self,
+        addresses: Sequence[str],
+        cursor: Optional[RealDictCursor],
+    ) -> Dict[str, Tuple[Optional[int], bool, Optional[str]]]:
+        query = """
+            SELECT a.address, r.result_id, r.street_found, r.house_part
+            FROM unnest(%s::text[]) AS a(address)
+            LEFT JOIN LATERAL (
+                SELECT * FROM public.get_house_id_by_address(a.address) LIMIT 1
+            ) r ON TRUE
+        """
+        if cursor is not None:
+            cursor.execute(query, (list(addresses),))
+            rows = cursor.fetchall()
+        else:
+            with psycopg2.connect(self._dsn) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(query, (list(addresses),))
+                rows = cur.fetchall()
+        return {
+            row["address"]: (row["result_id"], bool(row["street_found"]), row["house_part"])
+            for row in rows
+        }
+
+
+_resolvers: Dict[str, AddressResolver] = {}
+_resolvers_lock = threading.Lock()
+
+
+def inprocess_resolver_enabled() -> bool:
+    return os.getenv("ADDRESS_RESOLVER_INPROCESS", "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def get_address_resolver(dsn: str) -> AddressResolver:
+    """Один резолвер (и один индекс в памяти) на DSN на процесс."""
+
+    with _resolvers_lock:
+        resolver = _resolvers.get(dsn)
+        if resolver is None:
+            resolver = _resolvers[dsn] = AddressResolver(dsn)
+        return resolver
+
+
+__all__ = [
+    "AddressResolution",
+    "AddressResolver",
+    "FiasAddressIndex",
+    "RESOLVER_VERSION",
+    "get_address_resolver",
+    "inprocess_resolver_enabled",
+]
@@ -0,0 +1,106 @@
+"""Сверяет in-process резолвер адресов с SQL-функцией public.get_house_id_by_address.
+
+Пример:
+    python server/address_resolver_parity.py --sample 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SERVER_DIR = Path(__file__).resolve().parent
+for path in (REPO_ROOT, SERVER_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from address_resolver import FiasAddressIndex  # noqa: E402
+
+SAMPLE_SQL = """
+    SELECT address FROM (
+        SELECT DISTINCT address FROM public.ads_cian WHERE address IS NOT NULL AND btrim(address) <> ''
+        UNION
+        SELECT DISTINCT address FROM public.ads WHERE address IS NOT NULL AND btrim(address) <> ''
+    ) a
+    ORDER BY random()
+    LIMIT %s
+"""
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Паритет Python-резолвера адресов с get_house_id_by_address")
+    parser.add_argument("--sample", type=int, default=500, help="Сколько случайных адресов проверить")
+    parser.add_argument("--show", type=int, default=20, help="Сколько расхождений вывести")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    dsn = _load_dsn()
+
+    with psycopg2.connect(dsn) as conn:
+        index = FiasAddressIndex.load(conn)
+        print(f"📚 Индекс: {index.street_count} улиц, {index.house_count} домов, {index.token_count} токенов")
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SAMPLE_SQL, (args.sample,))
+            addresses = [row["address"] for row in cur.fetchall()]
+
+            sql_started = time.perf_counter()
+            expected = {}
+            for address in addresses:
+                cur.execute(
+                    "SELECT result_id FROM public.get_house_id_by_address(%s) LIMIT 1",
+                    (address,),
+                )
+                row = cur.fetchone()
+                expected[address] = row["result_id"] if row else None
+            sql_seconds = time.perf_counter() - sql_started
+
+    py_started = time.perf_counter()
+    actual = {address: index.resolve(address) for address in addresses}
+    py_seconds = time.perf_counter() - py_started
+
+    checked = matched = skipped = 0
+    mismatches = []
+    for address in addresses:
+        resolution = actual[address]
+        if resolution.needs_sql:
+            skipped += 1
+            continue
+        checked += 1
+        if resolution.house_id == expected[address]:
+            matched += 1
+        else:
+            mismatches.append((address, expected[address], resolution.house_id))
+
+    total = len(addresses) or 1
+    print(f"✅ Совпало: {matched}/{checked} (адресов с ЖК через SQL: {skipped})")
+    print(f"⏱️ SQL: {sql_seconds / total * 1000:.2f} мс/адрес, Python: {py_seconds / total * 1e6:.1f} мкс/адрес")
+    for address, sql_id, py_id in mismatches[: args.show]:
+        print(f"❌ {address!r}: SQL={sql_id} Python={py_id}")
+
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
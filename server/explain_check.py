@@ -0,0 +1,309 @@
+"""Проверяет планы горячих запросов: индексы из DB/hot_path_indexes.sql должны использоваться.
+
+Для каждого запроса берутся реальные параметры из БД, строится EXPLAIN (FORMAT JSON)
+и ищется Seq Scan по проверяемой таблице (или её секциям). Таблицы меньше
+--min-rows строк не проверяются — там последовательное чтение нормально.
+Для секционированных таблиц дополнительно проверяется запас месячных секций
+(DB/partition_flats_history.sql). Код возврата 1 при регрессии. Пример:
+    python server/explain_check.py --analyze
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+SAMPLE_HISTORY_SQL = """
+    SELECT id, url, house_id, floor, rooms, avitoid, source_id, time_source_created
+    FROM public.flats_history
+    WHERE url IS NOT NULL AND house_id IS NOT NULL
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+SAMPLE_REPORT_SQL = """
+    SELECT tg_user_id, house_id, floor, rooms, radius_m
+    FROM users.flat_reports
+    ORDER BY updated_at DESC
+    LIMIT 1
+"""
+
+# (название, таблица, запрос, имена параметров из образца)
+CHECKS: Sequence[Tuple[str, str, str, Sequence[str]]] = (
+    (
+        "очередь ads_cian",
+        "ads_cian",
+        "SELECT id FROM public.ads_cian WHERE processed IS FALSE ORDER BY id LIMIT 1000",
+        (),
+    ),
+    (
+        "очередь ads_avito",
+        "ads_avito",
+        "SELECT id FROM public.ads_avito WHERE processed IS FALSE ORDER BY id LIMIT 1000",
+        (),
+    ),
+    (
+        "flats_history по url",
+        "flats_history",
+        """
+        SELECT id, price, is_actual FROM public.flats_history
+        WHERE url = %(url)s
+        ORDER BY time_source_updated DESC NULLS LAST
+        LIMIT 1
+        """,
+        ("url",),
+    ),
+    (
+        "flats_history по квартире",
+        "flats_history",
+        """
+        SELECT * FROM public.flats_history
+        WHERE house_id = %(house_id)s AND rooms = %(rooms)s AND floor = %(floor)s
+        ORDER BY time_source_updated DESC NULLS LAST
+        LIMIT 50
+        """,
+        ("house_id", "rooms", "floor"),
+    ),
+    (
+        # После секционирования поиск по одному id проверяет pkey каждой секции —
+        # допустимо для редких обращений (триггер market_stats), но не Seq Scan
+        "flats_history по id",
+        "flats_history",
+        "SELECT id, price, is_actual FROM public.flats_history WHERE id = %(id)s",
+        ("id",),
+    ),
+    (
+        "flats_history по id и ключу секции",
+        "flats_history",
+        """
+        SELECT id FROM public.flats_history
+        WHERE id = %(id)s AND time_source_created = %(time_source_created)s
+        """,
+        ("id", "time_source_created"),
+    ),
+    (
+        # users.market_price_history: flats_history — внешняя сторона соединения
+        "история цен квартиры",
+        "flats_history",
+        """
+        SELECT fc.updated, fc.price
+        FROM public.flats_changes fc
+        JOIN public.flats_history fh ON fh.id = fc.flats_history_id
+        WHERE fh.house_id = %(house_id)s AND fh.floor = %(floor)s AND fh.rooms = %(rooms)s
+          AND fc.price IS NOT NULL
+        """,
+        ("house_id", "floor", "rooms"),
+    ),
+    (
+        "flats_history по avitoid",
+        "flats_history",
+        "SELECT id FROM public.flats_history WHERE avitoid = %(avitoid)s AND source_id = %(source_id)s",
+        ("avitoid", "source_id"),
+    ),
+    (
+        "flats_changes по объявлению",
+        "flats_changes",
+        "SELECT updated, price FROM public.flats_changes WHERE flats_history_id = %(id)s ORDER BY updated DESC",
+        ("id",),
+    ),
+    (
+        "users.flat_reports по ключу",
+        "flat_reports",
+        """
+        SELECT report_json FROM users.flat_reports
+        WHERE tg_user_id = %(tg_user_id)s AND house_id = %(report_house_id)s
+          AND floor = %(report_floor)s AND rooms = %(report_rooms)s AND radius_m = %(radius_m)s
+        ORDER BY updated_at DESC
+        LIMIT 1
+        """,
+        ("tg_user_id", "report_house_id", "report_floor", "report_rooms", "radius_m"),
+    ),
+    (
+        "users.ads конкуренты дома",
+        "ads",
+        "SELECT id, price FROM users.ads WHERE house_id = %(house_id)s AND rooms = %(rooms)s AND price IS NOT NULL",
+        ("house_id", "rooms"),
+    ),
+)
+
+PARTITIONED = (("public", "flats_history"), ("public", "flats_changes"))
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Проверка планов горячих запросов через EXPLAIN")
+    parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE: выполнить запросы и показать время")
+    parser.add_argument("--min-rows", type=int, default=10000, help="Не проверять таблицы меньше этого числа строк")
+    parser.add_argument("--show", action="store_true", help="Печатать план каждого запроса")
+    return parser.parse_args()
+
+
+def _walk(plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def _is_table_or_partition(relation: Optional[str], table: str) -> bool:
+    if not relation:
+        return False
+    return relation == table or relation.startswith(f"{table}_p") or relation == f"{table}_default"
+
+
+def _estimated_rows(cur: RealDictCursor, table: str) -> int:
+    cur.execute(
+        """
+        SELECT COALESCE(sum(GREATEST(c.reltuples, 0)), 0)::bigint AS rows
+        FROM pg_class c
+        WHERE c.relkind = 'r'
+          AND (c.relname = %s OR c.relname LIKE %s OR c.relname = %s)
+        """,
+        (table, f"{table}\\_p%", f"{table}_default"),
+    )
+    return int(cur.fetchone()["rows"])
+
+
+def _sample_params(cur: RealDictCursor) -> Dict[str, Any]:
+    params: Dict[str, Any] = {}
+    cur.execute(SAMPLE_HISTORY_SQL)
+    row = cur.fetchone()
+    if row:
+        params.update(row)
+    cur.execute("SELECT to_regclass('users.flat_reports') IS NOT NULL AS ok")
+    if cur.fetchone()["ok"]:
+        cur.execute(SAMPLE_REPORT_SQL)
+        row = cur.fetchone()
+        if row:
+            params.update(
+                tg_user_id=row["tg_user_id"],
+                report_house_id=row["house_id"],
+                report_floor=row["floor"],
+                report_rooms=row["rooms"],
+                radius_m=row["radius_m"],
+            )
+    return params
+
+
+def _check_query(
+    cur: RealDictCursor,
+    name: str,
+    table: str,
+    query: str,
+    params: Dict[str, Any],
+    args: argparse.Namespace,
+) -> bool:
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if args.analyze else "FORMAT JSON"
+    cur.execute(f"EXPLAIN ({options}) {query}", params)
+    explain = cur.fetchone()
+    document = next(iter(explain.values()))
+    if isinstance(document, str):
+        document = json.loads(document)
+    root = document[0]
+    plan = root["Plan"]
+    seq_scans = [
+        node["Relation Name"]
+        for node in _walk(plan)
+        if node.get("Node Type") == "Seq Scan" and _is_table_or_partition(node.get("Relation Name"), table)
+    ]
+    indexes = sorted({node["Index Name"] for node in _walk(plan) if node.get("Index Name")})
+    # Сколько секций читает запрос: без ключа секционирования — все
+    scanned = {
+        node["Relation Name"] for node in _walk(plan) if _is_table_or_partition(node.get("Relation Name"), table)
+    }
+    partitions = f" | секций: {len(scanned)}" if len(scanned) > 1 else ""
+    timing = f" | {root.get('Execution Time', 0):.1f} мс" if args.analyze else ""
+    if args.show:
+        print(json.dumps(plan, ensure_ascii=False, indent=2))
+    if seq_scans:
+        print(f"❌ {name}: Seq Scan по {', '.join(sorted(set(seq_scans)))} (стоимость {plan['Total Cost']:.0f}){timing}")
+        return False
+    print(f"✅ {name}: {', '.join(indexes) or plan['Node Type']} (стоимость {plan['Total Cost']:.0f}){partitions}{timing}")
+    return True
+
+
+def _check_partitions(cur: RealDictCursor) -> bool:
+    ok = True
+    for schema, table in PARTITIONED:
+        cur.execute(
+            """
+            SELECT c.relkind,
+                   (SELECT count(*) FROM pg_inherits i WHERE i.inhparent = c.oid) AS partitions,
+                   (SELECT count(*)
+                    FROM pg_inherits i
+                    JOIN pg_class p ON p.oid = i.inhrelid
+                    WHERE i.inhparent = c.oid
+                      AND p.relname >= %s) AS ahead
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s
+            """,
+            (f"{table}_p" + _next_month_suffix(cur), schema, table),
+        )
+        row = cur.fetchone()
+        if not row:
+            continue
+        if row["relkind"] != "p":
+            print(f"ℹ️ {schema}.{table} не секционирована (DB/partition_flats_history.sql не применён)")
+            continue
+        if row["ahead"] < 2:
+            ok = False
+            print(
+                f"❌ {schema}.{table}: секций на будущее {row['ahead']} — выполните "
+                f"SELECT public.ensure_month_partitions('{schema}.{table}', ...)"
+            )
+        else:
+            print(f"✅ {schema}.{table}: секций {row['partitions']}, на будущее {row['ahead']}")
+    return ok
+
+
+def _next_month_suffix(cur: RealDictCursor) -> str:
+    cur.execute("SELECT to_char(date_trunc('month', now()) + interval '1 month', 'YYYY_MM') AS suffix")
+    return cur.fetchone()["suffix"]
+
+
+def main() -> None:
+    args = _parse_args()
+    failures: List[str] = []
+    with psycopg2.connect(_load_dsn()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        params = _sample_params(cur)
+        for name, table, query, needed in CHECKS:
+            missing = [key for key in needed if params.get(key) is None]
+            if missing:
+                print(f"⚠️ {name}: нет данных для параметров {', '.join(missing)}, пропускаем")
+                continue
+            rows = _estimated_rows(cur, table)
+            if rows < args.min_rows:
+                print(f"ℹ️ {name}: в таблице ~{rows} строк, план не проверяется")
+                continue
+            if not _check_query(cur, name, table, query, params, args):
+                failures.append(name)
+        if not _check_partitions(cur):
+            failures.append("секции")
+        conn.rollback()
+
+    if failures:
+        print(f"❌ Регрессии: {', '.join(failures)}")
+        raise SystemExit(1)
+    print("🏁 Все планы используют индексы")
+
+
+if __name__ == "__main__":
+    main()
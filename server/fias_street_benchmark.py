@@ -0,0 +1,140 @@
+"""Замеряет поиск улиц: прежняя find_parentobjids_by_parsed против новой.
+
+«До» — исходное тело функции из дампа DB/schema_public.sql, созданное на время
+прогона как pg_temp.find_parentobjids_by_parsed_baseline (транзакция откатывается);
+«после» — public.find_parentobjids_by_parsed из DB/fias_trgm_indexes.sql.
+Прежняя функция выполняется как до миграции — с SET LOCAL enable_indexscan /
+enable_bitmapscan = off, чтобы её ILIKE не пользовались индексами из
+DB/fias_trgm_indexes.sql; новая — с планами по умолчанию. Пример:
+    python server/fias_street_benchmark.py --sample 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import statistics
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+SAMPLE_SQL = """
+    SELECT pr.street_type, pr.norm_name
+    FROM (
+        SELECT DISTINCT address FROM public.ads_cian
+        WHERE address IS NOT NULL AND btrim(address) <> ''
+        ORDER BY random()
+        LIMIT %s
+    ) a
+    CROSS JOIN LATERAL public.parse_address(a.address) pr
+"""
+
+FIND_SQL = "SELECT public.find_parentobjids_by_parsed(%s, %s) AS ids"
+BASELINE_NAME = "pg_temp.find_parentobjids_by_parsed_baseline"
+BASELINE_SQL = f"SELECT {BASELINE_NAME}(%s, %s) AS ids"
+
+# Дамп схемы до DB/fias_trgm_indexes.sql: там исходное тело функции
+BASELINE_DUMP = REPO_ROOT / "DB" / "schema_public.sql"
+_BASELINE_RE = re.compile(
+    r"CREATE FUNCTION public\.find_parentobjids_by_parsed\((?P<rest>.*?\n    AS (?P<tag>\$\w*\$).*?(?P=tag));",
+    re.DOTALL,
+)
+
+
+def _baseline_ddl() -> str:
+    """CREATE FUNCTION прежней версии под временным именем в pg_temp."""
+    match = _BASELINE_RE.search(BASELINE_DUMP.read_text(encoding="utf-8"))
+    if not match:
+        raise SystemExit(f"В {BASELINE_DUMP} не найдена исходная find_parentobjids_by_parsed")
+    return f"CREATE FUNCTION {BASELINE_NAME}({match.group('rest')};"
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк find_parentobjids_by_parsed")
+    parser.add_argument("--sample", type=int, default=300, help="Сколько случайных адресов ads_cian взять")
+    return parser.parse_args()
+
+
+def _run(
+    cur: RealDictCursor,
+    inputs: Sequence[Tuple[str, str]],
+    query: str,
+    use_indexes: bool,
+) -> Tuple[List[float], Dict[Tuple[str, str], list]]:
+    # Индексы fias_objects появились только в DB/fias_trgm_indexes.sql: без них — состояние до миграции
+    cur.execute("SET LOCAL enable_indexscan = %s", ("on" if use_indexes else "off",))
+    cur.execute("SET LOCAL enable_bitmapscan = %s", ("on" if use_indexes else "off",))
+    timings: List[float] = []
+    results: Dict[Tuple[str, str], list] = {}
+    for street_type, norm_name in inputs:
+        started = time.perf_counter()
+        cur.execute(query, (street_type, norm_name))
+        results[(street_type, norm_name)] = sorted(cur.fetchone()["ids"] or [])
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, results
+
+
+def _summary(label: str, timings: List[float]) -> None:
+    if not timings:
+        print(f"{label}: нет данных")
+        return
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{label:>18}: median {statistics.median(ordered):8.2f} мс | "
+        f"p95 {p95:8.2f} мс | max {ordered[-1]:8.2f} мс | всего {sum(ordered) / 1000:6.2f} с"
+    )
+
+
+def main() -> None:
+    args = _parse_args()
+    with psycopg2.connect(_load_dsn()) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(SAMPLE_SQL, (args.sample,))
+        inputs = [(row["street_type"], row["norm_name"]) for row in cur.fetchall()]
+        print(f"📊 Адресов с распознанной улицей: {len(inputs)}")
+        if not inputs:
+            return
+
+        cur.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'fias_objects_norm_name_trgm_idx'")
+        if not cur.fetchone():
+            print("⚠️ trigram-индекс не найден — примените DB/fias_trgm_indexes.sql")
+
+        cur.execute(_baseline_ddl())
+
+        # Прогрев кэша страниц, чтобы оба прогона читали одинаково «тёплые» данные
+        _run(cur, inputs[:20], BASELINE_SQL, use_indexes=False)
+        _run(cur, inputs[:20], FIND_SQL, use_indexes=True)
+        before, before_ids = _run(cur, inputs, BASELINE_SQL, use_indexes=False)
+        after, after_ids = _run(cur, inputs, FIND_SQL, use_indexes=True)
+        conn.rollback()
+
+    print("до:    прежняя функция, index/bitmap scan off (как до DB/fias_trgm_indexes.sql)")
+    print("после: новая функция, планы по умолчанию (trigram GIN и btree из миграции)")
+    _summary("до", before)
+    _summary("после", after)
+    diff = [key for key in before_ids if before_ids[key] != after_ids.get(key)]
+    if diff:
+        print(f"❌ Результаты отличаются для {len(diff)} адресов, например: {diff[:5]}")
+    else:
+        print("✅ Результаты совпадают")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
 
 from psycopg2 import sql
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import Json, RealDictCursor
 
 
 def _fetch_columns(cursor: RealDictCursor, table: str, schema: str = "public") -> set[str]:
@@ -25,6 +27,12 @@ class PublicHistoryMeta:
     def __init__(self, cursor: RealDictCursor) -> None:
         self.history_columns = _fetch_columns(cursor, "flats_history", "public")
         self.change_columns = _fetch_columns(cursor, "flats_changes", "public")
+        cursor.execute(
+            "SELECT to_regprocedure('public.sync_ads_to_public_history(jsonb)') IS NOT NULL AS available"
+        )
+        row = cursor.fetchone()
+        # DB/history_sync.sql: пакетная синхронизация одним вызовом
+        self.batch_available = bool(row["available"] if isinstance(row, Mapping) else row[0])
 
     def has_history(self, column: str) -> bool:
         return column in self.history_columns
@@ -78,11 +86,13 @@ def sync_ad_to_public_history(
     description = ad_row.get("description")
     address = ad_row.get("address")
 
+    # Ключ секционирования (DB/partition_flats_history.sql) нужен для UPDATE по id
+    key_select = ", time_source_created" if meta.has_history("time_source_created") else ""
     existing: Optional[Dict[str, Any]] = None
     if url:
         cursor.execute(
-            """
-            SELECT id, price, is_actual
+            f"""
+            SELECT id, price, is_actual{key_select}
             FROM public.flats_history
             WHERE url = %s
             ORDER BY time_source_updated DESC NULLS LAST
@@ -93,8 +103,8 @@ def sync_ad_to_public_history(
         existing = cursor.fetchone()
     if existing is None and house_id is not None and floor is not None and rooms is not None:
         cursor.execute(
-            """
-            SELECT id, price, is_actual
+            f"""
+            SELECT id, price, is_actual{key_select}
             FROM public.flats_history
             WHERE house_id = %s AND floor = %s AND rooms = %s
             ORDER BY time_source_updated DESC NULLS LAST
@@ -145,13 +155,23 @@ def sync_ad_to_public_history(
             updates["description"] = description
         if updates:
             cols = list(updates.keys())
+            where = sql.SQL("id = %s")
+            params: List[Any] = [*updates.values(), history_id]
+            if key_select:
+                # Без ключа секционирования UPDATE проверяет индекс каждой секции
+                if existing.get("time_source_created") is None:
+                    where = sql.SQL("id = %s AND time_source_created IS NULL")
+                else:
+                    where = sql.SQL("id = %s AND time_source_created = %s")
+                    params.append(existing["time_source_created"])
             cursor.execute(
-                sql.SQL("UPDATE public.flats_history SET {set_clause} WHERE id = %s").format(
+                sql.SQL("UPDATE public.flats_history SET {set_clause} WHERE {where}").format(
                     set_clause=sql.SQL(", ").join(
                         sql.SQL("{} = %s").format(sql.Identifier(col)) for col in cols
-                    )
+                    ),
+                    where=where,
                 ),
-                (*updates.values(), history_id),
+                params,
             )
         return history_id
 
@@ -180,3 +200,79 @@ def sync_ad_to_public_history(
     )
     row = cursor.fetchone()
     return int(row["id"]) if row else None
+
+
+def _json_number(value: Any) -> Any:
+    """12500000.0 / Decimal('12500000.0') -> 12500000: bigint-колонки не принимают дробную запись."""
+    if isinstance(value, (float, Decimal)):
+        try:
+            if value == int(value):
+                return int(value)
+        except (ArithmeticError, ValueError):  # NaN, inf
+            pass
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(_json_number(value))
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+def sync_ads_to_public_history(
+    cursor: RealDictCursor,
+    ad_rows: Sequence[Mapping[str, Any]],
+    *,
+    meta: Optional[PublicHistoryMeta] = None,
+    timestamps: Optional[Sequence[Optional[datetime]]] = None,
+) -> List[Optional[int]]:
+    """
+    Batch variant of sync_ad_to_public_history: one server call for all ads via
+    public.sync_ads_to_public_history (DB/history_sync.sql), falling back to per-row
+    sync when the function is not installed.
+    Returns flats_history.id (or None) for each ad, in input order.
+    """
+    if not ad_rows:
+        return []
+    if meta is None:
+        meta = PublicHistoryMeta(cursor)
+    if not meta.history_columns:
+        return [None] * len(ad_rows)
+
+    now = datetime.utcnow()
+    ts_list = list(timestamps) if timestamps is not None else [None] * len(ad_rows)
+    if not meta.batch_available:
+        return [
+            sync_ad_to_public_history(cursor, row, meta=meta, timestamp=ts or now)
+            for row, ts in zip(ad_rows, ts_list)
+        ]
+
+    snapshots = [
+        {
+            "url": row.get("url"),
+            "house_id": _json_number(row.get("house_id")),
+            "floor": _json_number(row.get("floor")),
+            "rooms": _json_number(row.get("rooms")),
+            "price": _json_number(row.get("price")),
+            "is_actual": _normalize_is_actual(row.get("status")),
+            "description": row.get("description"),
+            "address": row.get("address"),
+            "ts": ts or now,
+        }
+        for row, ts in zip(ad_rows, ts_list)
+    ]
+    cursor.execute(
+        "SELECT ord, history_id FROM public.sync_ads_to_public_history(%s::jsonb)",
+        (Json(snapshots, dumps=_dumps),),
+    )
+    result: List[Optional[int]] = [None] * len(ad_rows)
+    for row in cursor.fetchall():
+        ord_value, history_id = (row["ord"], row["history_id"]) if isinstance(row, Mapping) else row
+        result[ord_value] = int(history_id) if history_id is not None else None
+    return result
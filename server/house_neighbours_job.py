@@ -0,0 +1,80 @@
+"""Строит и обновляет public.house_neighbours (см. DB/house_neighbours.sql).
+
+Первый запуск считает пары для всех домов, последующие — только для новых
+и сдвинутых в moscow_geo. Каждая пачка коммитится отдельно, поэтому задачу
+можно прервать и продолжить. Пример:
+    python server/house_neighbours_job.py --batch-size 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Обновление таблицы соседних домов house_neighbours")
+    parser.add_argument("--batch-size", type=int, default=500, help="Домов в одной транзакции")
+    parser.add_argument("--skip-sync", action="store_true", help="Не перечитывать moscow_geo, только досчитать dirty")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    conn = psycopg2.connect(_load_dsn())
+    try:
+        with conn.cursor() as cur:
+            if args.skip_sync:
+                cur.execute("SELECT count(*) FROM public.house_geo_points WHERE dirty")
+            else:
+                print("🗺️ Сверяем координаты домов с moscow_geo...")
+                cur.execute("SELECT public.house_neighbours_sync_points()")
+            dirty = cur.fetchone()[0]
+        conn.commit()
+        print(f"📊 Домов к пересчёту: {dirty}")
+
+        done = 0
+        started = time.perf_counter()
+        while True:
+            batch_started = time.perf_counter()
+            with conn.cursor() as cur:
+                cur.execute("SELECT public.house_neighbours_refresh_batch(%s)", (args.batch_size,))
+                processed = cur.fetchone()[0]
+            conn.commit()
+            if not processed:
+                break
+            done += processed
+            elapsed = time.perf_counter() - started
+            rate = done / elapsed if elapsed else 0.0
+            print(
+                f"✅ {done}/{dirty} домов | пачка {time.perf_counter() - batch_started:.1f} с | "
+                f"{rate:.1f} домов/с"
+            )
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.house_neighbours")
+            pairs = cur.fetchone()[0]
+        print(f"🏁 Готово: пересчитано {done} домов за {time.perf_counter() - started:.1f} с, пар в таблице: {pairs}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Тайлы карты кабинета из public.map_tiles (см. DB/map_tiles.sql).
+
+fetch_tile отдаёт готовый JSON тайла и его etag для GET /api/map/tiles/{z}/{x}/{y}.json.
+CLI обновляет агрегаты:
+    python server/map_tiles.py rebuild    # первичное построение: все дома в очередь
+    python server/map_tiles.py refresh    # только дома, изменившиеся в flats_history
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+MIN_ZOOM = 10
+MAX_ZOOM = 16
+TILE_MAX_AGE = int(os.getenv("MAP_TILE_MAX_AGE", "60"))
+
+TILE_SQL = "SELECT payload::text, etag FROM public.map_tiles WHERE z = %s AND x = %s AND y = %s"
+
+
+def validate_tile(z: int, x: int, y: int) -> Optional[str]:
+    """Возвращает текст ошибки для недопустимых координат тайла."""
+    if not MIN_ZOOM <= z <= MAX_ZOOM:
+        return f"Зум должен быть от {MIN_ZOOM} до {MAX_ZOOM}"
+    limit = 1 << z
+    if not (0 <= x < limit and 0 <= y < limit):
+        return f"Координаты тайла вне диапазона 0..{limit - 1}"
+    return None
+
+
+def _empty_tile(z: int, x: int, y: int) -> Tuple[str, str]:
+    payload = json.dumps(
+        {"z": z, "x": x, "y": y, "house_count": 0, "houses_with_active": 0, "active_ads": 0, "total_ads": 0, "rooms": {}},
+        separators=(",", ":"),
+    )
+    return payload, hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+def fetch_tile(dsn: str, z: int, x: int, y: int) -> Tuple[str, str]:
+    """Возвращает (JSON тайла, etag). Тайл без домов — пустой, с постоянным etag."""
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute(TILE_SQL, (z, x, y))
+        row = cur.fetchone()
+    if not row:
+        return _empty_tile(z, x, y)
+    return row[0], row[1]
+
+
+def cache_headers(etag: str) -> dict[str, str]:
+    return {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={TILE_MAX_AGE}, stale-while-revalidate={TILE_MAX_AGE * 5}",
+    }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {value.strip().removeprefix("W/").strip('"') for value in if_none_match.split(",")}
+    return etag in candidates
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Обновление тайлов карты public.map_tiles")
+    parser.add_argument("command", choices=("refresh", "rebuild"), help="refresh — очередь изменений, rebuild — все дома")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Домов в одной транзакции")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = _parse_args()
+    conn = psycopg2.connect(_load_dsn())
+    try:
+        with conn.cursor() as cur:
+            if args.command == "rebuild":
+                print("🗺️ Ставим все дома в очередь пересчёта...")
+                cur.execute("SELECT public.map_tiles_enqueue_all()")
+            else:
+                cur.execute("SELECT count(*) FROM public.map_dirty_houses")
+            queued = cur.fetchone()[0]
+        conn.commit()
+        print(f"📊 Домов в очереди: {queued}")
+
+        done = 0
+        started = time.perf_counter()
+        while True:
+            batch_started = time.perf_counter()
+            with conn.cursor() as cur:
+                cur.execute("SELECT public.map_tiles_refresh(%s)", (args.batch_size,))
+                processed = cur.fetchone()[0]
+            conn.commit()
+            if not processed:
+                break
+            done += processed
+            print(f"✅ {done}/{queued} домов | пачка {time.perf_counter() - batch_started:.1f} с")
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM public.map_tiles")
+            tiles = cur.fetchone()[0]
+        print(f"🏁 Готово: {done} домов за {time.perf_counter() - started:.1f} с, тайлов: {tiles}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Пересчитывает устаревшие строки users.market_stats_cache (см. DB/market_stats_cache.sql).
+
+Триггеры на flats_history / flats_changes / users.ads только помечают строки
+кэша как stale; задание заранее пересчитывает их, чтобы отчёт не ждал расчёта.
+Заодно удаляются строки за прошлые дни. Пример:
+    python server/market_stats_job.py --batch-size 100
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пересчёт кэша рыночной статистики users.market_stats_cache")
+    parser.add_argument("--batch-size", type=int, default=100, help="Строк кэша в одной транзакции")
+    parser.add_argument("--report", action="store_true", help="Только показать состояние кэша за сегодня")
+    return parser.parse_args()
+
+
+def _print_report(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT count(*),
+                   count(*) FILTER (WHERE stale),
+                   (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM users.market_stats_hits_seq),
+                   (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM users.market_stats_misses_seq)
+            FROM users.market_stats_cache
+            WHERE stats_date = CURRENT_DATE
+            """
+        )
+        total, stale, hits, misses = cur.fetchone()
+    lookups = hits + misses
+    rate = hits / lookups * 100 if lookups else 0.0
+    print(f"📊 Строк за сегодня: {total}, устаревших: {stale}")
+    print(f"📊 Попаданий: {hits}, промахов: {misses} ({rate:.1f}% запросов из кэша с последнего сброса счётчиков)")
+
+
+def main() -> None:
+    args = _parse_args()
+    conn = psycopg2.connect(_load_dsn())
+    try:
+        _print_report(conn)
+        if args.report:
+            return
+
+        done = 0
+        started = time.perf_counter()
+        while True:
+            with conn.cursor() as cur:
+                cur.execute("SELECT users.market_stats_refresh_stale(%s)", (args.batch_size,))
+                refreshed = cur.fetchone()[0]
+            conn.commit()
+            if not refreshed:
+                break
+            done += refreshed
+            print(f"✅ Пересчитано {done} строк за {time.perf_counter() - started:.1f} с")
+
+        print(f"🏁 Готово: пересчитано {done} строк за {time.perf_counter() - started:.1f} с")
+        _print_report(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
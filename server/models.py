@@ -52,10 +52,12 @@ class PropertyData:
 
 class ParseUrlsRequest(BaseModel):
     urls: List[str]
+    refresh: bool = False
 
 
 class ParseTextRequest(BaseModel):
     text: str
+    refresh: bool = False
 
 
 class BazaWinnerAuthRequest(BaseModel):
@@ -97,6 +99,7 @@ class ParseResponse(BaseModel):
     total: int
     message: str
     timestamp: str
+    timings: List[Dict[str, Any]] = []
 
 
 __all__ = [
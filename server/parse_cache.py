@@ -0,0 +1,279 @@
+"""TTL cache for parsed listings shared by all parse endpoints."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from models import PropertyData
+
+try:
+    import psycopg2
+    from psycopg2.extras import Json
+except ImportError:  # pragma: no cover - Postgres-уровень необязателен
+    psycopg2 = None
+    Json = None
+
+DEPTH_LIGHT = "light"
+DEPTH_EXTENDED = "extended"
+DEPTH_FLAT_STATE = "flat_state"
+
+DEFAULT_TTLS: Dict[str, int] = {
+    DEPTH_LIGHT: 15 * 60,
+    DEPTH_EXTENDED: 60 * 60,
+    DEPTH_FLAT_STATE: 5 * 60,
+}
+
+_PROPERTY_FIELDS = set(PropertyData.__annotations__.keys())
+
+_DB_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS system.parse_cache (
+    cache_key  text PRIMARY KEY,
+    url        text NOT NULL,
+    depth      text NOT NULL,
+    payload    jsonb NOT NULL,
+    parsed_at  timestamptz NOT NULL DEFAULT now(),
+    expires_at timestamptz NOT NULL
+);
+CREATE INDEX IF NOT EXISTS parse_cache_expires_at_idx ON system.parse_cache (expires_at);
+"""
+
+
+def normalize_listing_url(url: str) -> str:
+    """Приводит ссылку к виду для ключа кэша: без схемы, www, query, fragment и хвостового '/'."""
+
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return f"{host}{path}"
+
+
+def _env_int(env_name: str, default: int) -> int:
+    try:
+        return int(os.getenv(env_name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class ParseResultCache:
+    """
+    Кэш результатов парсинга ``PropertyData``.
+
+    Ключ — нормализованный URL + глубина парсинга (light, extended, flat_state).
+    Первый уровень — LRU в памяти, второй (опционально) — таблица system.parse_cache в Postgres.
+    Одновременные запросы одного ключа ждут единственный парсинг (single-flight).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        ttls: Optional[Dict[str, int]] = None,
+        dsn: Optional[str] = None,
+        enabled: bool = True,
+    ) -> None:
+        self.max_entries = max(1, max_entries)
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.dsn = dsn if psycopg2 is not None else None
+        self.enabled = enabled
+        self._entries: "OrderedDict[str, Tuple[float, PropertyData]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._db_ready = False
+        self._stats = {"hits": 0, "db_hits": 0, "misses": 0, "shared": 0, "bypassed": 0}
+
+    @staticmethod
+    def make_key(url: str, depth: str) -> str:
+        return f"{depth}:{normalize_listing_url(url)}"
+
+    async def get_or_parse(
+        self,
+        url: str,
+        depth: str,
+        loader: Callable[[], Awaitable[Optional[PropertyData]]],
+        refresh: bool = False,
+    ) -> Optional[PropertyData]:
+        """Возвращает результат из кэша или вызывает ``loader``. ``refresh=True`` обходит кэш."""
+
+        if not self.enabled or depth not in self.ttls:
+            return await loader()
+
+        key = self.make_key(url, depth)
+        if refresh:
+            self._count("bypassed")
+        else:
+            cached = self._memory_get(key)
+            if cached is not None:
+                self._count("hits")
+                return replace(cached)
+
+        loop = asyncio.get_running_loop()
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] is loop:
+            self._count("shared")
+            result = await asyncio.shield(inflight[1])
+            return replace(result) if result is not None else None
+
+        future: asyncio.Future = loop.create_future()
+        self._inflight[key] = (loop, future)
+        try:
+            result: Optional[PropertyData] = None
+            if not refresh and self.dsn:
+                result = await loop.run_in_executor(None, self._db_get, key)
+                if result is not None:
+                    self._count("db_hits")
+                    self._memory_put(key, depth, result)
+            if result is None:
+                self._count("misses")
+                result = await loader()
+                if result is not None:
+                    self._memory_put(key, depth, result)
+                    if self.dsn:
+                        await loop.run_in_executor(None, self._db_put, key, url, depth, result)
+            future.set_result(result)
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Исключение уже получит вызывающий; помечаем его прочитанным для ожидающих
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key, (None, None))[1] is future:
+                del self._inflight[key]
+
+        return replace(result) if result is not None else None
+
+    def invalidate(self, url: str, depth: Optional[str] = None) -> None:
+        depths = [depth] if depth else list(self.ttls)
+        with self._lock:
+            for item in depths:
+                self._entries.pop(self.make_key(url, item), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._entries)
+        lookups = stats["hits"] + stats["db_hits"] + stats["misses"] + stats["shared"]
+        stats.update(
+            {
+                "enabled": self.enabled,
+                "postgres": bool(self.dsn),
+                "size": size,
+                "max_entries": self.max_entries,
+                "ttl_seconds": dict(self.ttls),
+                "hit_rate": round((stats["hits"] + stats["db_hits"] + stats["shared"]) / lookups, 3)
+                if lookups
+                else None,
+            }
+        )
+        return stats
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _memory_get(self, key: str) -> Optional[PropertyData]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def _memory_put(self, key: str, depth: str, data: PropertyData) -> None:
+        expires_at = time.monotonic() + self.ttls[depth]
+        with self._lock:
+            self._entries[key] = (expires_at, replace(data))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _ensure_db_schema(self, cursor) -> None:
+        if self._db_ready:
+            return
+        cursor.execute(_DB_SCHEMA_SQL)
+        self._db_ready = True
+
+    def _db_get(self, key: str) -> Optional[PropertyData]:
+        try:
+            with psycopg2.connect(self.dsn) as conn, conn.cursor() as cur:
+                self._ensure_db_schema(cur)
+                cur.execute(
+                    "SELECT payload FROM system.parse_cache WHERE cache_key = %s AND expires_at > now()",
+                    (key,),
+                )
+                row = cur.fetchone()
+        except Exception as exc:  # noqa: BLE001
+            print(f"⚠️ Кэш парсинга: ошибка чтения из Postgres: {exc}")
+            return None
+        if not row:
+            return None
+        payload = row[0] if isinstance(row[0], dict) else json.loads(row[0])
+        return PropertyData(**{k: v for k, v in payload.items() if k in _PROPERTY_FIELDS})
+
+    def _db_put(self, key: str, url: str, depth: str, data: PropertyData) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttls[depth])
+        try:
+            with psycopg2.connect(self.dsn) as conn, conn.cursor() as cur:
+                self._ensure_db_schema(cur)
+                cur.execute(
+                    """
+                    INSERT INTO system.parse_cache (cache_key, url, depth, payload, parsed_at, expires_at)
+                    VALUES (%s, %s, %s, %s, now(), %s)
+                    ON CONFLICT (cache_key) DO UPDATE
+                    SET payload = EXCLUDED.payload,
+                        url = EXCLUDED.url,
+                        parsed_at = EXCLUDED.parsed_at,
+                        expires_at = EXCLUDED.expires_at
+                    """,
+                    (key, url, depth, Json(data.to_dict()), expires_at),
+                )
+        except Exception as exc:  # noqa: BLE001
+            print(f"⚠️ Кэш парсинга: ошибка записи в Postgres: {exc}")
+
+
+def _cache_from_env() -> ParseResultCache:
+    enabled = os.getenv("PARSE_CACHE_ENABLED", "true").strip().lower() in {"1", "true", "yes", "on"}
+    ttls = {
+        DEPTH_LIGHT: _env_int("PARSE_CACHE_TTL_LIGHT", DEFAULT_TTLS[DEPTH_LIGHT]),
+        DEPTH_EXTENDED: _env_int("PARSE_CACHE_TTL_EXTENDED", DEFAULT_TTLS[DEPTH_EXTENDED]),
+        DEPTH_FLAT_STATE: _env_int("PARSE_CACHE_TTL_FLAT_STATE", DEFAULT_TTLS[DEPTH_FLAT_STATE]),
+    }
+    return ParseResultCache(
+        max_entries=_env_int("PARSE_CACHE_MAX_ENTRIES", 2000),
+        ttls=ttls,
+        dsn=os.getenv("PARSE_CACHE_DSN") or None,
+        enabled=enabled,
+    )
+
+
+parse_cache = _cache_from_env()
+
+
+__all__ = [
+    "DEPTH_LIGHT",
+    "DEPTH_EXTENDED",
+    "DEPTH_FLAT_STATE",
+    "ParseResultCache",
+    "normalize_listing_url",
+    "parse_cache",
+]
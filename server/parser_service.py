@@ -3,15 +3,19 @@
 from __future__ import annotations
 
 import asyncio
+import os
 import re
 from typing import Any, Dict, List, Optional, Union
 
 import requests
 from bs4 import BeautifulSoup
 
+import message_tokenizer
+from batch_parser import BatchItemResult, SourceBatchRunner, source_limits_from_env
 from cian_http_client import fetch_cian_page
 from models import PropertyData
-from persistent_browser import parse_avito_fast
+from parse_cache import DEPTH_EXTENDED, DEPTH_FLAT_STATE, DEPTH_LIGHT, parse_cache
+from persistent_browser import get_browser_pool, parse_avito_fast
 
 # Импортируем парсер Avito
 try:
@@ -149,7 +153,43 @@ class RealtyParserAPI:
 
         return not any(inactive_status in status_lower for inactive_status in inactive_statuses)
 
-    async def parse_property(self, url: str, skip_photos: bool = True) -> Optional[PropertyData]:
+    async def parse_property(
+        self, url: str, skip_photos: bool = True, refresh: bool = False
+    ) -> Optional[PropertyData]:
+        """Быстрый парсинг объявления (через кэш; ``refresh=True`` — всегда свежий парсинг)."""
+
+        return await parse_cache.get_or_parse(
+            url,
+            DEPTH_LIGHT,
+            lambda: self._parse_property_uncached(url, skip_photos=skip_photos),
+            refresh=refresh,
+        )
+
+    async def parse_property_extended(
+        self, url: str, skip_photos: bool = True, refresh: bool = False
+    ) -> Optional[PropertyData]:
+        """Расширенный парсинг объявления (через кэш; фото в кэш не попадают)."""
+
+        if not skip_photos:
+            return await self._parse_property_extended_uncached(url, skip_photos=False)
+        return await parse_cache.get_or_parse(
+            url,
+            DEPTH_EXTENDED,
+            lambda: self._parse_property_extended_uncached(url, skip_photos=True),
+            refresh=refresh,
+        )
+
+    async def parse_property_flat_state(self, url: str, refresh: bool = False) -> Optional[PropertyData]:
+        """Парсит только цену, статус и просмотры объявления (через кэш)."""
+
+        return await parse_cache.get_or_parse(
+            url,
+            DEPTH_FLAT_STATE,
+            lambda: self._parse_property_flat_state_uncached(url),
+            refresh=refresh,
+        )
+
+    async def _parse_property_uncached(self, url: str, skip_photos: bool = True) -> Optional[PropertyData]:
         """Быстрый парсинг объявления."""
 
         try:
@@ -165,7 +205,9 @@ class RealtyParserAPI:
             print(f"❌ Ошибка парсинга {url}: {exc}")
             return None
 
-    async def parse_property_extended(self, url: str, skip_photos: bool = True) -> Optional[PropertyData]:
+    async def _parse_property_extended_uncached(
+        self, url: str, skip_photos: bool = True
+    ) -> Optional[PropertyData]:
         """Расширенный парсинг объявления."""
 
         try:
@@ -181,7 +223,7 @@ class RealtyParserAPI:
             print(f"❌ Ошибка расширенного парсинга {url}: {exc}")
             return None
 
-    async def parse_property_flat_state(self, url: str) -> Optional[PropertyData]:
+    async def _parse_property_flat_state_uncached(self, url: str) -> Optional[PropertyData]:
         """Парсит только цену, статус и просмотры объявления."""
 
         try:
@@ -207,32 +249,51 @@ class RealtyParserAPI:
             print(f"❌ Ошибка flat_state парсинга {url}: {exc}")
             return None
 
-    async def parse_properties_batch(self, urls: List[str], skip_photos: bool = True) -> List[PropertyData]:
+    async def parse_properties_batch(
+        self, urls: List[str], skip_photos: bool = True, refresh: bool = False
+    ) -> List[PropertyData]:
         """Пакетный парсинг множественных объявлений."""
 
-        results: List[PropertyData] = []
-        for i, url in enumerate(urls, 1):
-            try:
-                print(f"🔄 Парсим объявление {i}/{len(urls)}: {url}")
-                property_data = await self.parse_property(url, skip_photos=skip_photos)
-                if property_data:
-                    results.append(property_data)
-                    print("✅ Объявление успешно спарсено")
-                else:
-                    print("❌ Не удалось спарсить объявление")
-            except Exception as exc:  # noqa: BLE001
-                print(f"❌ Ошибка при парсинге {url}: {exc}")
-                continue
+        items = await self.parse_properties_batch_detailed(urls, skip_photos=skip_photos, refresh=refresh)
+        return [item.data for item in items if item.ok]
+
+    async def parse_properties_batch_detailed(
+        self, urls: List[str], skip_photos: bool = True, refresh: bool = False
+    ) -> List[BatchItemResult]:
+        """
+        Пакетный парсинг с параллелизмом по источникам.
+
+        Cian и Yandex парсятся параллельно, Avito — не больше числа доступных браузеров.
+        Результаты возвращаются в порядке входного списка вместе со временем ожидания и парсинга.
+        """
+
+        limits = source_limits_from_env()
+        if not os.getenv("BATCH_AVITO_CONCURRENCY"):
+            # Avito парсится через пул браузеров — параллельно не больше его размера
+            limits["avito"] = get_browser_pool().size
+        runner = SourceBatchRunner(self.get_url_source, limits)
+
+        async def _parse(url: str, source: str) -> Optional[PropertyData]:
+            return await self.parse_property(url, skip_photos=skip_photos, refresh=refresh)
+
+        items = await runner.run(urls, _parse)
+        for item in items:
+            status = "✅" if item.ok else "❌"
+            print(
+                f"{status} [{item.index + 1}/{len(items)}] {item.source}: {item.url} "
+                f"(ожидание {item.wait_seconds:.2f} с, парсинг {item.parse_seconds:.2f} с)"
+            )
 
-        print(f"📊 Всего успешно спарсено: {len(results)} из {len(urls)}")
-        return results
+        print(f"📊 Всего успешно спарсено: {sum(1 for item in items if item.ok)} из {len(urls)}")
+        return items
 
     async def _parse_avito_light(self, url: str) -> Optional[PropertyData]:
         """Легкий парсер Avito через persistent браузер."""
 
         try:
             print(f"🔍 Легкий парсинг Avito (persistent): {url}")
-            data = parse_avito_fast(url)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, parse_avito_fast, url)
 
             if data:
                 title = data.get("title", "")
@@ -332,7 +393,8 @@ class RealtyParserAPI:
         try:
             print(f"🏠 Парсим объявление Avito (расширенный парсер): {url}")
             parser = AvitoCardParser(skip_photos=skip_photos)
-            parsed_data = parser.parse_avito_page(url)
+            loop = asyncio.get_running_loop()
+            parsed_data = await loop.run_in_executor(None, parser.parse_avito_page, url)
             if not parsed_data:
                 print("❌ Не удалось спарсить данные объявления Avito")
                 return None
@@ -397,7 +459,8 @@ class RealtyParserAPI:
         try:
             print(f"⚡ Быстрый парсинг Yandex Realty: {url}")
             parser = YandexCardParser()
-            parsed_data = parser.parse_yandex_quick(url)
+            loop = asyncio.get_running_loop()
+            parsed_data = await loop.run_in_executor(None, parser.parse_yandex_quick, url)
             if not parsed_data:
                 print("❌ Не удалось быстро спарсить данные объявления Yandex Realty")
                 return None
@@ -437,7 +500,8 @@ class RealtyParserAPI:
         try:
             print(f"🏠 Парсим объявление Yandex Realty: {url}")
             parser = YandexCardParser()
-            parsed_data = parser.parse_yandex_page(url)
+            loop = asyncio.get_running_loop()
+            parsed_data = await loop.run_in_executor(None, parser.parse_yandex_page, url)
             if not parsed_data:
                 print("❌ Не удалось спарсить данные объявления Yandex Realty")
                 return None
@@ -492,7 +556,7 @@ class RealtyParserAPI:
         try:
             print(f"🏠 Парсим объявление Cian: {url}")
 
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             response = await loop.run_in_executor(
                 None,
                 lambda: fetch_cian_page(
@@ -547,7 +611,7 @@ class RealtyParserAPI:
 
         try:
             print(f"🏠 Парсим flat_state Cian: {url}")
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             response = await loop.run_in_executor(
                 None,
                 lambda: fetch_cian_page(
@@ -778,34 +842,46 @@ class RealtyParserAPI:
 parser = RealtyParserAPI()
 
 
-async def parse_property(url: str, skip_photos: bool = True) -> Optional[PropertyData]:
+async def parse_property(url: str, skip_photos: bool = True, refresh: bool = False) -> Optional[PropertyData]:
     """Быстрый парсинг одного объявления."""
 
-    return await parser.parse_property(url, skip_photos=skip_photos)
+    return await parser.parse_property(url, skip_photos=skip_photos, refresh=refresh)
 
 
-async def parse_property_extended(url: str, skip_photos: bool = True) -> Optional[PropertyData]:
+async def parse_property_extended(
+    url: str, skip_photos: bool = True, refresh: bool = False
+) -> Optional[PropertyData]:
     """Расширенный парсинг одного объявления."""
 
-    return await parser.parse_property_extended(url, skip_photos=skip_photos)
+    return await parser.parse_property_extended(url, skip_photos=skip_photos, refresh=refresh)
 
 
-async def parse_property_flat_state(url: str) -> Optional[PropertyData]:
+async def parse_property_flat_state(url: str, refresh: bool = False) -> Optional[PropertyData]:
     """Минимальный парсинг объявления: цена + статус + просмотры."""
 
-    return await parser.parse_property_flat_state(url)
+    return await parser.parse_property_flat_state(url, refresh=refresh)
 
 
-async def parse_properties_batch(urls: List[str], skip_photos: bool = True) -> List[PropertyData]:
+async def parse_properties_batch(
+    urls: List[str], skip_photos: bool = True, refresh: bool = False
+) -> List[PropertyData]:
     """Быстрый пакетный парсинг."""
 
-    return await parser.parse_properties_batch(urls, skip_photos=skip_photos)
+    return await parser.parse_properties_batch(urls, skip_photos=skip_photos, refresh=refresh)
+
+
+async def parse_properties_batch_detailed(
+    urls: List[str], skip_photos: bool = True, refresh: bool = False
+) -> List[BatchItemResult]:
+    """Пакетный парсинг с результатами по каждой ссылке в исходном порядке."""
+
+    return await parser.parse_properties_batch_detailed(urls, skip_photos=skip_photos, refresh=refresh)
 
 
 def extract_urls(raw_input: str) -> List[str]:
-    """Извлекает URL из текста."""
+    """Извлекает URL из текста (общий токенизатор с ботом)."""
 
-    return re.findall(r"https?://[^\s,;]+", raw_input)
+    return message_tokenizer.extract_urls(raw_input)
 
 
 __all__ = [
@@ -818,7 +894,9 @@ __all__ = [
     "parse_property",
     "parse_property_extended",
     "parse_properties_batch",
+    "parse_properties_batch_detailed",
     "extract_urls",
     "get_property_by_guid",
     "parse_property_flat_state",
+    "parse_cache",
 ]
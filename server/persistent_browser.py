@@ -1,42 +1,84 @@
-"""Persistent browser helpers for Avito parsing."""
+"""Persistent browser pool for Avito parsing."""
 
 import json
 import os
+import queue
 import re
 import threading
 import time
-from typing import Optional
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 
+from browser_waits import (
+    enable_request_blocking,
+    wait_for_any,
+    wait_for_document_ready,
+    wait_for_dom_idle,
+)
 
-class PersistentAvitoBrowser:
-    """Persistent браузер для Avito с cookies."""
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
-    _instance = None
-    _lock = threading.Lock()
+COOKIES_FILE = "avito_cookies.json"
 
-    def __new__(cls):
-        """Singleton pattern для единственного браузера."""
+# Признаки готовности карточки объявления: цена или заголовок
+READY_SELECTORS = ['[data-marker="item-view/item-price"]', '[data-marker="item-view/title-info"]', "h1"]
+PRICE_SELECTORS = ['[data-marker="item-view/item-price"]', '[class*="price"]', '[data-testid*="price"]']
 
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    cls._instance = super().__new__(cls)
-        return cls._instance
 
-    def __init__(self):
-        if hasattr(self, "initialized"):
-            return
+def _env_int(env_name: str, default: int) -> int:
+    try:
+        value = int(os.getenv(env_name, default))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+_cookies_lock = threading.Lock()
+_cookies_cache: Dict[str, Any] = {"mtime": None, "cookies": None}
+
+
+def load_shared_cookies(cookies_file: str = COOKIES_FILE) -> Optional[List[dict]]:
+    """Читает cookies Avito один раз для всех браузеров пула (перечитывает при изменении файла)."""
+
+    try:
+        mtime = os.path.getmtime(cookies_file)
+    except OSError:
+        return None
+
+    with _cookies_lock:
+        if _cookies_cache["mtime"] != mtime:
+            with open(cookies_file, "r", encoding="utf-8") as file:
+                cookies_data = json.load(file)
+            cookies_list = cookies_data["cookies"] if "cookies" in cookies_data else cookies_data
+            _cookies_cache["cookies"] = list(cookies_list)
+            _cookies_cache["mtime"] = mtime
+        return _cookies_cache["cookies"]
 
+
+class BrowserPoolTimeout(TimeoutError):
+    """Не удалось получить свободный браузер из пула за отведённое время."""
+
+
+class PersistentAvitoBrowser:
+    """Persistent браузер для Avito с cookies (один экземпляр пула)."""
+
+    def __init__(self, instance_id: int = 1):
+        self.instance_id = instance_id
         self.driver = None
-        self.cookies_file = "avito_cookies.json"
+        self.cookies_file = COOKIES_FILE
         self.initialized = False
         self.last_activity = time.time()
         self.session_timeout = 86400  # 24 часа без активности
-        print("🔄 Persistent браузер инициализирован для постоянной работы")
+        self.pages_served = 0
+        self.started_at: Optional[float] = None
+        self.ready_timeout = float(os.getenv("AVITO_READY_TIMEOUT", "10"))
 
     def setup_browser(self) -> bool:
         """Настраивает и запускает браузер."""
@@ -46,9 +88,11 @@ class PersistentAvitoBrowser:
             return True
 
         try:
-            print("🔧 Запускаем persistent браузер...")
+            print(f"🔧 Запускаем persistent браузер #{self.instance_id}...")
 
             options = Options()
+            # Не ждём onload (картинки, счётчики) — готовность страницы проверяем по селекторам
+            options.page_load_strategy = "eager"
             has_cookies = os.path.exists(self.cookies_file)
 
             if has_cookies:
@@ -90,7 +134,9 @@ class PersistentAvitoBrowser:
 
             self.driver = webdriver.Chrome(options=options)
             self.driver.set_page_load_timeout(30)
-            self.driver.implicitly_wait(5)
+            # Неявное ожидание отключено: каждый пустой find_elements стоил бы 5 секунд
+            self.driver.implicitly_wait(0)
+            enable_request_blocking(self.driver)
 
             self.driver.execute_script(
                 """
@@ -105,8 +151,10 @@ class PersistentAvitoBrowser:
 
             self.initialized = True
             self.last_activity = time.time()
+            self.pages_served = 0
+            self.started_at = time.time()
 
-            print("✅ Persistent браузер готов к работе")
+            print(f"✅ Persistent браузер #{self.instance_id} готов к работе")
             return True
 
         except Exception as exc:  # noqa: BLE001
@@ -128,18 +176,14 @@ class PersistentAvitoBrowser:
         """Загружает и применяет cookies."""
 
         try:
-            if not os.path.exists(self.cookies_file):
+            cookies_list = load_shared_cookies(self.cookies_file)
+            if cookies_list is None:
                 print("⚠️ Файл cookies не найден, создайте его вручную")
                 return
 
             print("🍪 Загружаем главную страницу для cookies...")
             self.driver.get("https://www.avito.ru/")
-            time.sleep(2)
-
-            with open(self.cookies_file, "r", encoding="utf-8") as file:
-                cookies_data = json.load(file)
-
-            cookies_list = cookies_data["cookies"] if "cookies" in cookies_data else cookies_data
+            wait_for_document_ready(self.driver, timeout=10)
 
             for cookie in cookies_list:
                 try:
@@ -148,11 +192,11 @@ class PersistentAvitoBrowser:
                     print(f"⚠️ Не удалось добавить cookie: {exc}")
 
             self.driver.refresh()
-            time.sleep(1)
+            wait_for_document_ready(self.driver, timeout=10)
+            wait_for_dom_idle(self.driver, idle_ms=500, timeout=5)
 
             print("✅ Cookies применены")
             print("🏠 Остаемся на главной Avito для постоянной сессии")
-            time.sleep(3)
 
         except Exception as exc:  # noqa: BLE001
             print(f"❌ Ошибка загрузки cookies: {exc}")
@@ -171,13 +215,16 @@ class PersistentAvitoBrowser:
                 start_time = time.time()
 
                 if not self._is_browser_ready():
-                    print("⚠️ Браузер не готов, ждем...")
-                    time.sleep(3)
+                    print("⚠️ Браузер не готов, перезапускаем...")
+                    self.cleanup()
+                    if not self.setup_browser():
+                        return None
                     continue
 
                 self.driver.set_page_load_timeout(15)
                 self.driver.get(url)
-                time.sleep(1)
+                if not wait_for_any(self.driver, READY_SELECTORS, timeout=self.ready_timeout):
+                    print(f"⚠️ Карточка не загрузилась за {self.ready_timeout:.0f} сек")
 
                 data = {}
 
@@ -193,13 +240,7 @@ class PersistentAvitoBrowser:
                     pass
 
                 try:
-                    price_selectors = [
-                        '[data-marker="item-view/item-price"]',
-                        '[class*="price"]',
-                        '[data-testid*="price"]',
-                    ]
-
-                    for selector in price_selectors:
+                    for selector in PRICE_SELECTORS:
                         try:
                             price_elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
                             for element in price_elements:
@@ -218,15 +259,20 @@ class PersistentAvitoBrowser:
                     data.update(self._extract_from_text(text))
 
                 parse_time = time.time() - start_time
-                print(f"⏱️ Парсинг занял: {parse_time:.2f} сек")
+                self.pages_served += 1
+                print(f"⏱️ Парсинг занял: {parse_time:.2f} сек (браузер #{self.instance_id})")
 
                 return data
 
             except Exception as exc:  # noqa: BLE001
                 print(f"❌ Ошибка парсинга (попытка {attempt + 1}/{max_retries + 1}): {exc}")
                 if attempt < max_retries:
-                    print("🔄 Повторяем через 2 секунды...")
-                    time.sleep(2)
+                    if not self._is_browser_alive():
+                        print("🔄 Браузер не отвечает, перезапускаем...")
+                        self.cleanup()
+                        if not self.setup_browser():
+                            return None
+                    print("🔄 Повторяем...")
                     continue
                 return None
 
@@ -271,6 +317,46 @@ class PersistentAvitoBrowser:
 
         return time.time() - self.last_activity > self.session_timeout
 
+    def rss_mb(self) -> Optional[float]:
+        """Суммарная память chromedriver и всех процессов Chrome этого экземпляра (МБ)."""
+
+        if psutil is None or not self.driver:
+            return None
+        try:
+            root = psutil.Process(self.driver.service.process.pid)
+            processes = [root, *root.children(recursive=True)]
+            total = 0
+            for process in processes:
+                try:
+                    total += process.memory_info().rss
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+            return round(total / (1024 * 1024), 1)
+        except Exception:  # noqa: BLE001
+            return None
+
+    def needs_recycle(self, max_pages: int, max_rss_mb: int) -> bool:
+        """Нужно ли перезапустить браузер: после K страниц или при превышении M МБ памяти."""
+
+        if not self.driver:
+            return False
+        if self.pages_served >= max_pages:
+            return True
+        rss = self.rss_mb()
+        return rss is not None and rss >= max_rss_mb
+
+    def describe(self) -> dict:
+        """Сводка об экземпляре без обращения к WebDriver (безопасно для занятого браузера)."""
+
+        return {
+            "instance_id": self.instance_id,
+            "started": self.driver is not None,
+            "pages_served": self.pages_served,
+            "rss_mb": self.rss_mb(),
+            "uptime_minutes": round((time.time() - self.started_at) / 60, 1) if self.started_at else None,
+            "idle_minutes": round((time.time() - self.last_activity) / 60, 1),
+        }
+
     def get_session_info(self) -> dict:
         """Возвращает информацию о текущей сессии."""
 
@@ -306,7 +392,7 @@ class PersistentAvitoBrowser:
             if "avito.ru" not in current_url:
                 print("🔄 Возвращаемся на главную Avito...")
                 self.driver.get("https://www.avito.ru/")
-                time.sleep(1)
+                wait_for_document_ready(self.driver, timeout=10)
         except Exception:
             pass
 
@@ -317,9 +403,10 @@ class PersistentAvitoBrowser:
 
         try:
             if self.driver:
-                print("🧹 Закрываем persistent браузер...")
+                print(f"🧹 Закрываем persistent браузер #{self.instance_id}...")
                 self.driver.quit()
                 self.driver = None
+                self.started_at = None
                 print("✅ Браузер закрыт")
         except Exception as exc:  # noqa: BLE001
             print(f"⚠️ Ошибка закрытия браузера: {exc}")
@@ -328,44 +415,224 @@ class PersistentAvitoBrowser:
         self.cleanup()
 
 
-_browser: Optional[PersistentAvitoBrowser] = None
+class AvitoBrowserPool:
+    """
+    Пул прогретых headless-браузеров Avito.
+
+    Браузер выдаётся через ``checkout()`` и возвращается автоматически. При возврате
+    проверяется здоровье экземпляра; после ``max_pages`` страниц или ``max_rss_mb`` МБ
+    памяти он перезапускается в фоне.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        checkout_timeout: float = 30.0,
+        max_pages: int = 200,
+        max_rss_mb: int = 1024,
+    ) -> None:
+        self.size = max(1, size)
+        self.checkout_timeout = checkout_timeout
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self._browsers = [PersistentAvitoBrowser(instance_id=index + 1) for index in range(self.size)]
+        self._idle: "queue.LifoQueue[PersistentAvitoBrowser]" = queue.LifoQueue()
+        for browser in self._browsers:
+            self._idle.put(browser)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "recycled": 0,
+            "unhealthy_restarts": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "busy_seconds_total": 0.0,
+        }
+        print(f"🔄 Пул persistent браузеров Avito: {self.size} экз.")
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[PersistentAvitoBrowser]:
+        """Выдаёт готовый к работе браузер; ждёт свободный не дольше ``timeout`` секунд."""
+
+        queued_at = time.monotonic()
+        try:
+            browser = self._idle.get(timeout=timeout if timeout is not None else self.checkout_timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise BrowserPoolTimeout(f"Нет свободного браузера Avito за {self.checkout_timeout} с") from None
+
+        started_at = time.monotonic()
+        wait = started_at - queued_at
+        with self._lock:
+            self._busy += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds_total"] += wait
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+
+        try:
+            if browser.driver and not browser._is_browser_alive():
+                with self._lock:
+                    self._stats["unhealthy_restarts"] += 1
+                browser.cleanup()
+            if not browser.setup_browser():
+                raise RuntimeError(f"Не удалось запустить браузер #{browser.instance_id}")
+            yield browser
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._stats["busy_seconds_total"] += time.monotonic() - started_at
+            self._checkin(browser)
+
+    def _checkin(self, browser: PersistentAvitoBrowser) -> None:
+        if browser.needs_recycle(self.max_pages, self.max_rss_mb):
+            threading.Thread(target=self._recycle, args=(browser,), daemon=True).start()
+            return
+        self._idle.put(browser)
 
+    def _recycle(self, browser: PersistentAvitoBrowser) -> None:
+        print(
+            f"♻️ Перезапуск браузера #{browser.instance_id}: "
+            f"{browser.pages_served} страниц, {browser.rss_mb()} МБ"
+        )
+        try:
+            browser.cleanup()
+            browser.setup_browser()
+        finally:
+            with self._lock:
+                self._stats["recycled"] += 1
+            self._idle.put(browser)
+
+    def _take_idle(self) -> List[PersistentAvitoBrowser]:
+        taken: List[PersistentAvitoBrowser] = []
+        while True:
+            try:
+                taken.append(self._idle.get_nowait())
+            except queue.Empty:
+                return taken
 
-def get_persistent_browser() -> PersistentAvitoBrowser:
-    """Возвращает глобальный экземпляр браузера."""
+    def warm_up(self) -> int:
+        """Запускает все свободные браузеры пула, возвращает число готовых."""
 
-    global _browser
-    if _browser is None:
-        _browser = PersistentAvitoBrowser()
-    return _browser
+        taken = self._take_idle()
+        ready = 0
+        try:
+            for browser in taken:
+                if browser.setup_browser():
+                    ready += 1
+        finally:
+            for browser in taken:
+                self._idle.put(browser)
+        return ready
+
+    def refresh_all(self) -> int:
+        """Обновляет сессии свободных браузеров, возвращает число успешно обновлённых."""
+
+        taken = self._take_idle()
+        refreshed = 0
+        try:
+            for browser in taken:
+                if browser.refresh_session():
+                    refreshed += 1
+        finally:
+            for browser in taken:
+                self._idle.put(browser)
+        return refreshed
+
+    def status(self) -> dict:
+        """Метрики загрузки пула и состояние экземпляров."""
+
+        with self._lock:
+            busy = self._busy
+            stats = dict(self._stats)
+        started = sum(1 for browser in self._browsers if browser.driver is not None)
+        checkouts = stats["checkouts"]
+        if started == 0:
+            status = "not_started"
+        elif busy >= self.size:
+            status = "saturated"
+        else:
+            status = "active"
+        return {
+            "status": status,
+            "size": self.size,
+            "started": started,
+            "busy": busy,
+            "idle": self._idle.qsize(),
+            "utilization": round(busy / self.size, 2),
+            "checkouts": checkouts,
+            "timeouts": stats["timeouts"],
+            "recycled": stats["recycled"],
+            "unhealthy_restarts": stats["unhealthy_restarts"],
+            "avg_wait_ms": round(stats["wait_seconds_total"] / checkouts * 1000, 1) if checkouts else 0.0,
+            "max_wait_ms": round(stats["wait_seconds_max"] * 1000, 1),
+            "avg_busy_ms": round(stats["busy_seconds_total"] / checkouts * 1000, 1) if checkouts else 0.0,
+            "limits": {
+                "checkout_timeout_s": self.checkout_timeout,
+                "max_pages": self.max_pages,
+                "max_rss_mb": self.max_rss_mb,
+            },
+            "instances": [browser.describe() for browser in self._browsers],
+        }
+
+    def shutdown(self) -> None:
+        for browser in self._browsers:
+            browser.cleanup()
+
+
+_pool: Optional[AvitoBrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> AvitoBrowserPool:
+    """Возвращает глобальный пул браузеров (настройки из AVITO_BROWSER_POOL_* переменных)."""
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = AvitoBrowserPool(
+                    size=_env_int("AVITO_BROWSER_POOL_SIZE", 2),
+                    checkout_timeout=float(_env_int("AVITO_BROWSER_CHECKOUT_TIMEOUT", 30)),
+                    max_pages=_env_int("AVITO_BROWSER_MAX_PAGES", 200),
+                    max_rss_mb=_env_int("AVITO_BROWSER_MAX_RSS_MB", 1024),
+                )
+    return _pool
 
 
 def parse_avito_fast(url: str) -> Optional[dict]:
-    """Быстрый парсинг через persistent браузер."""
+    """Быстрый парсинг через свободный браузер пула."""
 
-    browser = get_persistent_browser()
-    if not browser.refresh_session():
+    try:
+        with get_browser_pool().checkout() as browser:
+            if not browser.refresh_session():
+                return None
+            return browser.parse_url(url)
+    except BrowserPoolTimeout as exc:
+        print(f"⏳ {exc}")
         return None
-    return browser.parse_url(url)
 
 
 def init_persistent_browser() -> None:
-    """Инициализирует браузер в текущем потоке."""
+    """Прогревает все браузеры пула в текущем потоке."""
 
     try:
-        print("🔄 Инициализация persistent браузера...")
-        browser = get_persistent_browser()
-        if browser.setup_browser():
-            print("✅ Persistent браузер запущен и готов к работе")
-            print("🏠 Браузер находится на Avito с активными cookies")
+        print("🔄 Инициализация пула persistent браузеров...")
+        pool = get_browser_pool()
+        ready = pool.warm_up()
+        if ready:
+            print(f"✅ Готово браузеров: {ready} из {pool.size}")
+            print("🏠 Браузеры находятся на Avito с активными cookies")
         else:
-            print("❌ Не удалось запустить persistent браузер")
+            print("❌ Не удалось запустить ни одного persistent браузера")
     except Exception as exc:  # noqa: BLE001
-        print(f"❌ Ошибка инициализации persistent браузера: {exc}")
+        print(f"❌ Ошибка инициализации persistent браузеров: {exc}")
 
 
 def start_persistent_browser_thread() -> threading.Thread:
-    """Запускает поток инициализации браузера."""
+    """Запускает поток инициализации браузеров."""
 
     thread = threading.Thread(target=init_persistent_browser, daemon=True)
     thread.start()
@@ -373,8 +640,11 @@ def start_persistent_browser_thread() -> threading.Thread:
 
 
 __all__ = [
+    "AvitoBrowserPool",
+    "BrowserPoolTimeout",
     "PersistentAvitoBrowser",
-    "get_persistent_browser",
+    "get_browser_pool",
+    "load_shared_cookies",
     "parse_avito_fast",
     "init_persistent_browser",
     "start_persistent_browser_thread",
@@ -0,0 +1,152 @@
+"""Разбирает очередь ads_cian несколькими параллельными воркерами.
+
+Каждый воркер держит своё соединение и вызывает public.process_cian_ads_batch
+(см. DB/process_cian_ads.sql), пока очередь не опустеет. Пачки захватываются
+через SKIP LOCKED, поэтому воркеры не пересекаются. Общие строки flats /
+flats_history параллельные пачки всё же обновляют, поэтому deadlock (40P01) и
+serialization failure (40001) не останавливают воркер: пачка откатывается и
+повторяется с экспоненциальной паузой. Пример:
+    python server/process_cian_ads_workers.py --workers 4 --batch-size 1000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict
+
+import psycopg2
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+BATCH_SQL = "SELECT claimed, skipped, imported, failed FROM public.process_cian_ads_batch(%s)"
+
+# deadlock_detected, serialization_failure: транзакцию можно просто повторить
+RETRYABLE_SQLSTATES = {"40P01", "40001"}
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.2
+
+
+def _load_dsn() -> str:
+    env_file = os.getenv("REPORT_ENV_FILE") or (REPO_ROOT / ".env")
+    if Path(env_file).exists():
+        load_dotenv(env_file)
+    dsn = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
+    if not dsn:
+        raise SystemExit("Не задана переменная FLAT_REPORTS_DSN / DATABASE_URL")
+    return dsn
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Параллельная обработка очереди ads_cian")
+    parser.add_argument("--workers", type=int, default=4, help="Число параллельных соединений")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Объявлений в одной транзакции")
+    parser.add_argument("--max-batches", type=int, default=0, help="Ограничение числа пачек на воркер (0 — до конца очереди)")
+    parser.add_argument("--max-retries", type=int, default=MAX_RETRIES, help="Повторов пачки при deadlock / serialization failure")
+    return parser.parse_args()
+
+
+class _Totals:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.values: Dict[str, int] = {"claimed": 0, "skipped": 0, "imported": 0, "failed": 0, "batches": 0}
+
+    def add(self, row) -> Dict[str, int]:
+        with self._lock:
+            for key, value in zip(("claimed", "skipped", "imported", "failed"), row):
+                self.values[key] += value or 0
+            self.values["batches"] += 1
+            return dict(self.values)
+
+
+def _run_batch(conn, worker_id: int, batch_size: int, max_retries: int):
+    """Одна пачка в своей транзакции; при 40P01 / 40001 — откат и повтор с паузой."""
+    attempt = 0
+    while True:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(BATCH_SQL, (batch_size,))
+                row = cur.fetchone()
+            conn.commit()
+            return row
+        except psycopg2.Error as exc:
+            conn.rollback()
+            if exc.pgcode not in RETRYABLE_SQLSTATES or attempt >= max_retries:
+                print(f"❌ Воркер {worker_id}: ошибка пачки: {exc}")
+                raise
+            attempt += 1
+            # Джиттер разводит воркеры, столкнувшиеся на одних и тех же строках
+            delay = RETRY_BASE_DELAY * 2 ** (attempt - 1) * (1 + random.random())
+            print(f"🔁 Воркер {worker_id}: {exc.pgcode}, повтор {attempt}/{max_retries} через {delay:.1f} с")
+            time.sleep(delay)
+
+
+def _worker(
+    worker_id: int,
+    dsn: str,
+    batch_size: int,
+    max_batches: int,
+    max_retries: int,
+    totals: _Totals,
+    started: float,
+) -> int:
+    conn = psycopg2.connect(dsn)
+    batches = 0
+    try:
+        while not max_batches or batches < max_batches:
+            batch_started = time.perf_counter()
+            row = _run_batch(conn, worker_id, batch_size, max_retries)
+            if not row or not row[0]:
+                break
+            batches += 1
+            snapshot = totals.add(row)
+            elapsed = time.perf_counter() - started
+            rate = snapshot["claimed"] / elapsed if elapsed else 0.0
+            print(
+                f"✅ [w{worker_id}] пачка {row[0]} ({row[2]} ок, {row[3]} ошибок, {row[1]} пропущено) "
+                f"за {time.perf_counter() - batch_started:.1f} с | всего {snapshot['claimed']} | {rate:.1f} объявл./с"
+            )
+    finally:
+        conn.close()
+    return batches
+
+
+def main() -> None:
+    args = _parse_args()
+    dsn = _load_dsn()
+
+    with psycopg2.connect(dsn) as conn, conn.cursor() as cur:
+        cur.execute("SELECT count(*) FROM public.ads_cian WHERE processed IS FALSE")
+        pending = cur.fetchone()[0]
+    print(f"📊 В очереди ads_cian: {pending} объявлений, воркеров: {args.workers}")
+    if not pending:
+        return
+
+    totals = _Totals()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [
+            pool.submit(_worker, i + 1, dsn, args.batch_size, args.max_batches, args.max_retries, totals, started)
+            for i in range(args.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    elapsed = time.perf_counter() - started
+    result = totals.values
+    rate = result["claimed"] / elapsed if elapsed else 0.0
+    print(
+        f"🏁 Готово за {elapsed:.1f} с: {result['claimed']} объявлений в {result['batches']} пачках, "
+        f"импортировано {result['imported']}, ошибок {result['failed']}, пропущено {result['skipped']} | "
+        f"{rate:.1f} объявл./с"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,9 @@ import sys
 
 import aiohttp
 import psycopg2
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 import uvicorn
@@ -36,6 +36,9 @@ if str(REPO_ROOT) not in sys.path:
     sys.path.insert(0, str(REPO_ROOT))
 DEFAULT_REPORT_OUTPUT_DIR = SERVER_DIR
 
+# Загружаем переменные из .env файла до импорта модулей, читающих настройки при загрузке
+load_dotenv()
+
 from models import (
     FlatReportRequest,
     ParseResponse,
@@ -52,12 +55,15 @@ from parser_service import (
     extract_urls,
     get_property_by_guid,
     parse_properties_batch as parser_parse_properties_batch,
+    parse_properties_batch_detailed as parser_parse_properties_batch_detailed,
     parse_property as parser_parse_property,
     parse_property_extended as parser_parse_property_extended,
+    parse_cache,
     parser,
 )
 from report_pipeline import ReportPipeline
-from history_sync import PublicHistoryMeta, sync_ad_to_public_history
+from history_sync import PublicHistoryMeta, sync_ads_to_public_history
+import map_tiles
 
 
 class HistoryTableMeta:
@@ -105,10 +111,8 @@ class HistoryTableMeta:
         return columns, values
 
 logger = logging.getLogger(__name__)
-from persistent_browser import get_persistent_browser, start_persistent_browser_thread
+from persistent_browser import get_browser_pool, start_persistent_browser_thread
 
-# Загружаем переменные из .env файла
-load_dotenv()
 FLAT_REPORTS_DSN = os.getenv("FLAT_REPORTS_DSN") or os.getenv("DATABASE_URL")
 DEFAULT_RADIUS_M = 1500
 DEFAULT_ANALOGS_AREA_RATIO = 0.15
@@ -285,14 +289,16 @@ app.add_middleware(
 async def parse_by_urls(request: ParseUrlsRequest):
     """Парсинг по списку URL"""
     try:
-        properties = await parser.parse_properties_batch(request.urls)
-        
+        items = await parser_parse_properties_batch_detailed(request.urls, refresh=request.refresh)
+        properties = [item.data for item in items if item.ok]
+
         return ParseResponse(
             success=True,
             data=properties,
             total=len(properties),
             message=f"Успешно спарсено {len(properties)} из {len(request.urls)} объявлений",
-            timestamp=str(datetime.now())
+            timestamp=str(datetime.now()),
+            timings=[item.timing() for item in items],
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка парсинга: {str(e)}")
@@ -307,23 +313,25 @@ async def parse_from_text(request: ParseTextRequest):
             raise HTTPException(status_code=400, detail="URL не найдены в тексте")
         
         # Парсим объявления
-        properties = await parser.parse_properties_batch(urls)
-        
+        items = await parser_parse_properties_batch_detailed(urls, refresh=request.refresh)
+        properties = [item.data for item in items if item.ok]
+
         return ParseResponse(
             success=True,
             data=properties,
             total=len(properties),
             message=f"Извлечено {len(urls)} URL, успешно спарсено {len(properties)} объявлений",
-            timestamp=str(datetime.now())
+            timestamp=str(datetime.now()),
+            timings=[item.timing() for item in items],
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка парсинга из текста: {str(e)}")
 
 @app.get("/api/parse/single")
-async def parse_single_property(url: str):
+async def parse_single_property(url: str, refresh: bool = False):
     """Парсинг одного объявления по URL (быстрый режим)"""
     try:
-        property_data = await parser.parse_property(url)
+        property_data = await parser.parse_property(url, refresh=refresh)
         if property_data:
             return {
                 "success": True,
@@ -336,10 +344,10 @@ async def parse_single_property(url: str):
         raise HTTPException(status_code=500, detail=f"Ошибка парсинга: {str(e)}")
 
 @app.get("/api/parse/extended")
-async def parse_extended_property(url: str):
+async def parse_extended_property(url: str, refresh: bool = False):
     """Расширенный парсинг одного объявления по URL (полные данные)"""
     try:
-        property_data = await parser.parse_property_extended(url)
+        property_data = await parser.parse_property_extended(url, refresh=refresh)
         if property_data:
             return {
                 "success": True,
@@ -353,10 +361,10 @@ async def parse_extended_property(url: str):
 
 
 @app.get("/api/parse/ext")
-async def parse_extended_minimal(url: str):
+async def parse_extended_minimal(url: str, refresh: bool = False):
     """Расширенный парсинг без адреса и фотографий."""
     try:
-        property_data = await parser.parse_property_extended(url)
+        property_data = await parser.parse_property_extended(url, refresh=refresh)
         if property_data:
             data = property_data.to_dict()
             data.pop("address", None)
@@ -373,10 +381,10 @@ async def parse_extended_minimal(url: str):
 
 
 @app.get("/api/parse/flat_state")
-async def parse_flat_state(url: str):
+async def parse_flat_state(url: str, refresh: bool = False):
     """Парсинг статуса и цены объявления."""
     try:
-        property_data = await parser.parse_property_flat_state(url)
+        property_data = await parser.parse_property_flat_state(url, refresh=refresh)
         if property_data:
             data = property_data.to_dict()
             return {
@@ -396,13 +404,16 @@ async def parse_flat_state(url: str):
 @app.get("/api/health")
 async def health_check():
     """Проверка состояния API"""
-    # Проверяем статус persistent браузера
+    # Проверяем статус пула persistent браузеров
     browser_status = "unknown"
+    browser_pool_info: dict[str, Any] = {}
     try:
-        browser = get_persistent_browser()
-        session_info = browser.get_session_info()
-        browser_status = session_info.get('status', 'unknown')
-    except:
+        pool_status = get_browser_pool().status()
+        browser_status = pool_status.get("status", "unknown")
+        browser_pool_info = {
+            key: pool_status[key] for key in ("size", "started", "busy", "idle", "utilization")
+        }
+    except Exception:  # noqa: BLE001
         browser_status = "error"
 
     return {
@@ -414,7 +425,9 @@ async def health_check():
         "baza_winner_available": BAZA_WINNER_AVAILABLE,
         "extended_collector_available": EXTENDED_COLLECTOR_AVAILABLE,
         "persistent_browser": browser_status,
+        "browser_pool": browser_pool_info,
         "reports_available": REPORT_MODULE_AVAILABLE,
+        "parse_cache": parse_cache.stats(),
     }
 
 @app.post("/api/send-excel-document")
@@ -509,7 +522,7 @@ async def create_flat_report(request: FlatReportRequest):
     if not FLAT_REPORTS_DSN:
         raise HTTPException(status_code=500, detail="Переменная FLAT_REPORTS_DSN или DATABASE_URL не настроена")
 
-    loop = asyncio.get_event_loop()
+    loop = asyncio.get_running_loop()
 
     def _load_user_flat():
         return _fetch_user_flat(FLAT_REPORTS_DSN, request.flat_id)
@@ -721,24 +734,19 @@ def _fetch_flats_missing_house_id(dsn: str) -> list[int]:
         return [row["id"] for row in rows]
 
 
-async def _parse_flat_state_via_api(session: aiohttp.ClientSession, url: str) -> tuple[dict[str, Any] | None, str | None]:
+async def _parse_flat_state(url: str) -> tuple[dict[str, Any] | None, str | None]:
     try:
-        async with session.get(
-            f"{REPORT_PARSER_BASE_URL}/api/parse/flat_state",
-            params={"url": url},
-            timeout=aiohttp.ClientTimeout(total=25),
-        ) as response:
-            if response.status != 200:
-                text = await response.text()
-                return None, f"status={response.status}; body={text[:200]}"
-            payload = await response.json()
-            data = payload.get("data")
-            if not isinstance(data, dict):
-                return None, "invalid payload"
-            return data, None
+        property_data = await parser.parse_property_flat_state(url)
     except Exception as exc:  # noqa: BLE001
-        logger.warning("Failed to fetch /api/parse/flat_state for %s: %s", url, exc)
+        logger.warning("Failed to parse flat_state for %s: %s", url, exc)
         return None, str(exc)
+    if property_data is None:
+        return None, "parse_failed"
+    return {
+        "price": property_data.price,
+        "status": property_data.status,
+        "views_today": property_data.views_today,
+    }, None
 
 
 def _detect_ad_change(ad: dict[str, Any], parsed: dict[str, Any]) -> dict[str, Any] | None:
@@ -778,6 +786,8 @@ def _detect_ad_change(ad: dict[str, Any], parsed: dict[str, Any]) -> dict[str, A
 def _persist_flats_state_changes(dsn: str, changes: list[dict[str, Any]]) -> None:
     with psycopg2.connect(dsn) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
         public_meta = PublicHistoryMeta(cur)
+        snapshots: list[dict[str, Any]] = []
+        timestamps: list[Any] = []
         for change in changes:
             set_fields: list[str] = []
             set_values: list[Any] = []
@@ -821,7 +831,9 @@ def _persist_flats_state_changes(dsn: str, changes: list[dict[str, Any]]) -> Non
                 "price": target_price,
                 "status": target_status,
             }
-            sync_ad_to_public_history(cur, ad_snapshot, meta=public_meta, timestamp=change["checked_at"])
+            snapshots.append(ad_snapshot)
+            timestamps.append(change["checked_at"])
+        sync_ads_to_public_history(cur, snapshots, meta=public_meta, timestamps=timestamps)
         conn.commit()
 
 
@@ -866,16 +878,14 @@ async def refresh_flats_state():
 
     changes: list[dict[str, Any]] = []
     errors: list[dict[str, Any]] = []
-    timeout = aiohttp.ClientTimeout(total=25)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        for ad in ads:
-            data, error = await _parse_flat_state_via_api(session, ad["url"])
-            if data is None:
-                errors.append({"url": ad["url"], "reason": error or "parse_failed"})
-                continue
-            change = _detect_ad_change(ad, data)
-            if change:
-                changes.append(change)
+    for ad in ads:
+        data, error = await _parse_flat_state(ad["url"])
+        if data is None:
+            errors.append({"url": ad["url"], "reason": error or "parse_failed"})
+            continue
+        change = _detect_ad_change(ad, data)
+        if change:
+            changes.append(change)
 
     if changes:
         await loop.run_in_executor(None, _persist_flats_state_changes, FLAT_REPORTS_DSN, changes)
@@ -899,68 +909,67 @@ async def refresh_flats_state():
 
 @app.get("/api/browser/status")
 async def browser_status():
-    """Проверка статуса persistent браузера"""
+    """Статус и метрики загрузки пула persistent браузеров"""
     try:
-        browser = get_persistent_browser()
-        session_info = browser.get_session_info()
+        pool_status = get_browser_pool().status()
         return {
             "success": True,
-            "browser_session": session_info,
-            "message": "Статус браузера получен"
+            "browser_session": pool_status,
+            "message": "Статус браузеров получен"
         }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
-            "message": "Ошибка получения статуса браузера"
+            "message": "Ошибка получения статуса браузеров"
         }
 
 @app.post("/api/browser/init")
 async def init_browser():
-    """Принудительная инициализация persistent браузера"""
+    """Принудительная инициализация всех браузеров пула"""
     try:
-        browser = get_persistent_browser()
-        if browser.setup_browser():
-            session_info = browser.get_session_info()
+        pool = get_browser_pool()
+        ready = await asyncio.to_thread(pool.warm_up)
+        if ready:
             return {
                 "success": True,
-                "browser_session": session_info,
-                "message": "Браузер успешно инициализирован"
+                "browser_session": pool.status(),
+                "message": f"Инициализировано браузеров: {ready} из {pool.size}"
             }
         else:
             return {
                 "success": False,
-                "message": "Не удалось инициализировать браузер"
+                "message": "Не удалось инициализировать браузеры"
             }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
-            "message": "Ошибка инициализации браузера"
+            "message": "Ошибка инициализации браузеров"
         }
 
 @app.post("/api/browser/refresh")
 async def refresh_browser():
-    """Обновление сессии persistent браузера"""
+    """Обновление сессий свободных браузеров пула"""
     try:
-        browser = get_persistent_browser()
-        if browser.refresh_session():
-            session_info = browser.get_session_info()
+        pool = get_browser_pool()
+        refreshed = await asyncio.to_thread(pool.refresh_all)
+        if refreshed:
             return {
                 "success": True,
-                "browser_session": session_info,
-                "message": "Сессия браузера обновлена"
+                "browser_session": pool.status(),
+                "message": f"Обновлено сессий браузеров: {refreshed}"
             }
         else:
             return {
                 "success": False,
-                "message": "Не удалось обновить сессию браузера"
+                "message": "Не удалось обновить сессии браузеров"
             }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
-            "message": "Ошибка обновления сессии браузера"
+            "message": "Ошибка обновления сессий браузеров"
         }
 
 @app.get("/api/property/guid/{guid}")
@@ -993,6 +1002,26 @@ async def get_property_by_guid_endpoint(guid: str):
             detail=f"Ошибка получения данных по GUID: {str(e)}"
         )
 
+@app.get("/api/map/tiles/{z}/{x}/{y}.json")
+async def get_map_tile(z: int, x: int, y: int, if_none_match: str | None = Header(default=None)):
+    """Предрасчитанный тайл карты (дома, активные объявления, минимальная цена) с ETag"""
+    if not FLAT_REPORTS_DSN:
+        raise HTTPException(status_code=500, detail="FLAT_REPORTS_DSN или DATABASE_URL не настроены")
+    error = map_tiles.validate_tile(z, x, y)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+    try:
+        payload, etag = await asyncio.to_thread(map_tiles.fetch_tile, FLAT_REPORTS_DSN, z, x, y)
+    except psycopg2.Error as exc:
+        logger.exception("Не удалось прочитать тайл %s/%s/%s", z, x, y)
+        raise HTTPException(status_code=500, detail=f"Ошибка чтения тайла: {exc}") from exc
+
+    headers = map_tiles.cache_headers(etag)
+    if map_tiles.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
 @app.get("/api/sources")
 async def get_supported_sources():
     """Получение списка поддерживаемых источников"""
@@ -1132,7 +1161,7 @@ async def api_documentation():
                     }
                 },
                 "POST /api/parse/urls": {
-                    "description": "Пакетный парсинг списка URL",
+                    "description": "Пакетный парсинг списка URL (параллельно по источникам, результаты в исходном порядке)",
                     "body": {
                         "urls": ["url1", "url2", "..."]
                     },
@@ -1140,7 +1169,10 @@ async def api_documentation():
                         "success": True,
                         "data": ["array of PropertyData objects"],
                         "total": 2,
-                        "message": "Успешно спарсено 2 из 2 объявлений"
+                        "message": "Успешно спарсено 2 из 2 объявлений",
+                        "timings": [
+                            {"url": "url1", "source": "cian", "success": True, "wait_ms": 0.0, "parse_ms": 812.4, "error": None}
+                        ]
                     }
                 },
                 "POST /api/parse/text": {
@@ -1184,17 +1216,25 @@ async def api_documentation():
             },
             "browser_management": {
                 "GET /api/browser/status": {
-                    "description": "Подробный статус persistent браузера",
+                    "description": "Статус и метрики загрузки пула persistent браузеров",
                     "response": {
                         "success": True,
                         "browser_session": {
                             "status": "active",
-                            "url": "https://www.avito.ru/",
-                            "title": "Авито",
-                            "session_age_minutes": 15.5,
-                            "is_on_avito": True
+                            "size": 2,
+                            "started": 2,
+                            "busy": 1,
+                            "idle": 1,
+                            "utilization": 0.5,
+                            "checkouts": 120,
+                            "timeouts": 0,
+                            "recycled": 1,
+                            "avg_wait_ms": 35.2,
+                            "instances": [
+                                {"instance_id": 1, "started": True, "pages_served": 57, "rss_mb": 412.3}
+                            ]
                         },
-                        "message": "Статус браузера получен"
+                        "message": "Статус браузеров получен"
                     }
                 },
                 "POST /api/browser/init": {
@@ -1214,6 +1254,22 @@ async def api_documentation():
                     }
                 }
             },
+            "map": {
+                "GET /api/map/tiles/{z}/{x}/{y}.json": {
+                    "description": "Тайл карты кабинета (z 10-16) из public.map_tiles: число домов, активных объявлений, минимальная цена и разбивка по комнатам; с z15 — список домов. Поддерживает If-None-Match (304) и Cache-Control для браузера/CDN.",
+                    "response": {
+                        "z": 15, "x": 19806, "y": 10244,
+                        "house_count": 12,
+                        "houses_with_active": 5,
+                        "active_ads": 9,
+                        "total_ads": 41,
+                        "min_price": 11500000,
+                        "rooms": {"2": {"active": 4, "min_price": 14200000}},
+                        "center": {"lat": 55.7512, "lng": 37.6184},
+                        "houses": [{"house_id": 92207, "lat": 55.751, "lng": 37.618, "address": "Тверская ул, 7", "active_ads_count": 2, "total_ads_count": 6, "min_price": 15900000}]
+                    }
+                }
+            },
             "reports": {
                 "POST /api/reports/flat": {
                     "description": "Генерация PDF-отчёта по user_flat; параметры берутся из users.user_flats, а при отсутствии house_id автоматически запускается подготовка. Отчёт по умолчанию сохраняется рядом с server/realty_parser_server.py.",
@@ -1331,7 +1387,7 @@ async def api_documentation():
         "performance": {
             "fast_mode": "3-5 секунд (только заголовок)",
             "extended_mode": "10-30 секунд (полные данные)",
-            "memory_usage": "~435 MB (persistent браузер)",
+            "memory_usage": "~435 MB на каждый браузер пула",
             "concurrent_requests": "Поддерживается"
         },
         "configuration": {
@@ -1339,6 +1395,40 @@ async def api_documentation():
                 "description": "Автоматически запускать persistent браузер при старте сервера",
                 "default": False,
                 "values": ["true", "1", "yes", "on"]
+            },
+            "AVITO_BROWSER_POOL_SIZE": {
+                "description": "Число прогретых headless-браузеров Avito (и параллельных Avito-парсингов)",
+                "default": 2
+            },
+            "AVITO_BROWSER_CHECKOUT_TIMEOUT / AVITO_BROWSER_MAX_PAGES / AVITO_BROWSER_MAX_RSS_MB": {
+                "description": "Ожидание свободного браузера (с) и перезапуск экземпляра после K страниц или M МБ памяти",
+                "default": {"checkout_timeout": 30, "max_pages": 200, "max_rss_mb": 1024}
+            },
+            "AVITO_READY_TIMEOUT / BROWSER_BLOCK_RESOURCES": {
+                "description": "Максимум ожидания цены/заголовка карточки после перехода (с) и блокировка "
+                               "картинок, шрифтов и аналитики через CDP",
+                "default": {"ready_timeout": 10, "block_resources": True}
+            },
+            "MAP_TILE_MAX_AGE": {
+                "description": "Cache-Control max-age (с) для тайлов карты /api/map/tiles; stale-while-revalidate — в 5 раз больше",
+                "default": 60
+            },
+            "BATCH_CIAN_CONCURRENCY / BATCH_YANDEX_CONCURRENCY / BATCH_AVITO_CONCURRENCY": {
+                "description": "Сколько ссылок каждого источника парсится одновременно в пакетных запросах "
+                               "(для Avito по умолчанию — размер пула браузеров)",
+                "default": {"cian": 6, "yandex": 3, "avito": "AVITO_BROWSER_POOL_SIZE"}
+            },
+            "PARSE_CACHE_*": {
+                "description": "Кэш результатов парсинга по нормализованному URL и глубине (light/extended/flat_state). "
+                               "Параметр ?refresh=true (или \"refresh\": true в теле) обходит кэш",
+                "variables": {
+                    "PARSE_CACHE_ENABLED": "true",
+                    "PARSE_CACHE_MAX_ENTRIES": 2000,
+                    "PARSE_CACHE_TTL_LIGHT": 900,
+                    "PARSE_CACHE_TTL_EXTENDED": 3600,
+                    "PARSE_CACHE_TTL_FLAT_STATE": 300,
+                    "PARSE_CACHE_DSN": "DSN для второго уровня кэша в system.parse_cache (опционально)"
+                }
             }
         }
     }
@@ -9,17 +9,20 @@ from datetime import datetime
 from decimal import Decimal, InvalidOperation
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
-import aiohttp
 import psycopg2
 from psycopg2 import sql
 from psycopg2.extras import RealDictCursor
 
+import address_cache
+from address_resolver import get_address_resolver, inprocess_resolver_enabled
 from models import PropertyData
-from history_sync import PublicHistoryMeta, sync_ad_to_public_history
+from history_sync import PublicHistoryMeta, sync_ads_to_public_history
+from parser_service import parser as realty_parser
 
 logger = logging.getLogger(__name__)
 
-REPORT_PARSER_BASE_URL = os.getenv("REPORT_PARSER_BASE_URL", "http://localhost:8008")
+REPORT_PARSER_CONCURRENCY = int(os.getenv("REPORT_PARSER_CONCURRENCY", "4"))
+REPORT_PARSER_TIMEOUT = float(os.getenv("REPORT_PARSER_TIMEOUT", "20"))
 
 
 class AdsTableMeta:
@@ -111,6 +114,8 @@ class ReportPipeline:
         if not dsn:
             raise ValueError("FLAT_REPORTS_DSN or DATABASE_URL is required")
         self._dsn = dsn
+        self._address_cache_available: Optional[bool] = None
+        self._nearby_by_house_available: Optional[bool] = None
 
     def prepare(
         self,
@@ -123,8 +128,8 @@ class ReportPipeline:
         if flat_id <= 0:
             raise ValueError("flat_id must be positive")
 
+        # Фаза 1: только чтение — транзакция закрывается до сетевых запросов.
         with psycopg2.connect(self._dsn) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
-            meta = AdsTableMeta(cur)
             user_flat = self._fetch_user_flat(cur, flat_id)
             address = user_flat.get("address")
             if not address:
@@ -146,38 +151,55 @@ class ReportPipeline:
 
             house_id = self._resolve_house_id(cur, address)
             user_flat["house_id"] = house_id
-            self._ensure_user_flat_house_id(cur, flat_id, house_id)
-            self._ensure_user_flat_radius(cur, flat_id, target_radius)
             history_rows = self._fetch_history_ads(cur, house_id, rooms, floor, max_history)
             if not history_rows:
                 raise ValueError("No entries found in public.flats_history for the resolved house_id")
 
             price_candidate = self._extract_price(history_rows)
             nearby_rows = self._fetch_nearby_ads(
-                cur, address, rooms, price_candidate, self._extract_area(history_rows), self._extract_kitchen(history_rows), target_radius
+                cur,
+                address,
+                house_id,
+                rooms,
+                price_candidate,
+                self._extract_area(history_rows),
+                self._extract_kitchen(history_rows),
+                target_radius,
+            )
+
+        payloads = self._build_payloads(history_rows, nearby_rows, user_flat, house_id, max_nearby)
+
+        # Фаза 2: параллельный парсинг без открытого соединения с БД.
+        parsed_map: Dict[str, Optional[PropertyData]] = {}
+        if run_parser and payloads:
+            parsed_map = asyncio.run(
+                self._parse_property_urls([payload["url"] for payload in payloads if payload.get("url")])
             )
 
-            payloads = self._build_payloads(history_rows, nearby_rows, user_flat, house_id, max_nearby)
-            persisted: List[Dict[str, Any]] = []
+        # Фаза 3: короткая транзакция записи.
+        persisted: List[Dict[str, Any]] = []
+        parser_result: Dict[str, List[str]] = {"parsed": [], "errors": []}
+        with psycopg2.connect(self._dsn) as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            meta = AdsTableMeta(cur)
+            self._ensure_user_flat_house_id(cur, flat_id, house_id)
+            self._ensure_user_flat_radius(cur, flat_id, target_radius)
+
             for payload in payloads:
                 ad_id = self._upsert_ad(cur, meta, payload)
                 if ad_id:
                     persisted.append({"id": ad_id, "url": payload.get("url")})
 
-            parser_result: Dict[str, List[str]] = {"parsed": [], "errors": []}
-            if run_parser and persisted:
-                parsed_map = asyncio.run(self._parse_property_urls([item["url"] for item in persisted if item.get("url")] ))
-                for item in persisted:
-                    url = item.get("url")
-                    if not url or url not in parsed_map:
-                        continue
-                    property_data = parsed_map[url]
-                    if not property_data:
-                        parser_result["errors"].append(url)
-                        continue
-                    updated = self._apply_property_data(cur, meta, item["id"], property_data)
-                    if updated:
-                        parser_result["parsed"].append(url)
+            for item in persisted:
+                url = item.get("url")
+                if not url or url not in parsed_map:
+                    continue
+                property_data = parsed_map[url]
+                if not property_data:
+                    parser_result["errors"].append(url)
+                    continue
+                updated = self._apply_property_data(cur, meta, item["id"], property_data)
+                if updated:
+                    parser_result["parsed"].append(url)
 
             if persisted:
                 self._sync_public_history(cur, [item["id"] for item in persisted if item.get("id")])
@@ -205,6 +227,23 @@ class ReportPipeline:
         return row
 
     def _resolve_house_id(self, cursor: RealDictCursor, address: str) -> int:
+        resolver = get_address_resolver(self._dsn) if inprocess_resolver_enabled() else None
+        if self._address_cache_available is None:
+            self._address_cache_available = address_cache.cache_available(cursor)
+        if self._address_cache_available:
+            house_id = address_cache.resolve_addresses(cursor, [address], resolver=resolver)[0][0]
+            if house_id is None:
+                raise ValueError(f"house_id could not be resolved for address {address}")
+            return int(house_id)
+
+        if resolver is not None:
+            try:
+                house_id = resolver.resolve(address, cursor=cursor)
+            except Exception:  # noqa: BLE001
+                logger.exception("In-process address resolver failed, falling back to SQL")
+            else:
+                if house_id is not None:
+                    return int(house_id)
         cursor.execute(
             "SELECT result_id FROM public.get_house_id_by_address(%s) WHERE result_id IS NOT NULL LIMIT 1",
             (address,),
@@ -268,6 +307,7 @@ class ReportPipeline:
         self,
         cursor: RealDictCursor,
         address: str,
+        house_id: int,
         rooms: Optional[int],
         price: Optional[int],
         area: Optional[Decimal],
@@ -276,6 +316,19 @@ class ReportPipeline:
     ) -> List[Dict[str, Any]]:
         if price is None:
             return []
+        if self._nearby_by_house_available is None:
+            cursor.execute(
+                "SELECT to_regprocedure('public.find_nearby_apartments_by_house(integer,integer,bigint,real,real,integer)')"
+                " IS NOT NULL AS ok"
+            )
+            self._nearby_by_house_available = bool(cursor.fetchone()["ok"])
+        if self._nearby_by_house_available:
+            # house_id уже известен — адрес второй раз не разбираем
+            cursor.execute(
+                "SELECT * FROM public.find_nearby_apartments_by_house(%s, %s, %s, %s, %s, %s)",
+                (house_id, rooms or 0, price, area, kitchen_area, radius),
+            )
+            return cursor.fetchall()
         cursor.execute(
             "SELECT * FROM public.find_nearby_apartments(%s, %s, %s, %s, %s, %s)",
             (address, rooms or 0, price, area, kitchen_area, radius),
@@ -416,35 +469,29 @@ class ReportPipeline:
         return int(row["id"]) if row else None
 
     async def _parse_property_urls(self, urls: Iterable[str]) -> Dict[str, Optional[PropertyData]]:
-        parsed: Dict[str, Optional[PropertyData]] = {}
-        if not REPORT_PARSER_BASE_URL:
-            return parsed
-
-        allowed_keys = set(PropertyData.__annotations__.keys())
-        async with aiohttp.ClientSession() as session:
-            for url in urls:
-                if not url or "cian.ru" not in url:
-                    continue
+        """Парсит Cian-ссылки внутрипроцессным парсером сервера с ограничением параллелизма."""
+        targets = list(dict.fromkeys(url for url in urls if url and "cian.ru" in url))
+        if not targets:
+            return {}
+
+        semaphore = asyncio.Semaphore(max(1, REPORT_PARSER_CONCURRENCY))
+
+        async def _parse_one(url: str) -> Tuple[str, Optional[PropertyData]]:
+            async with semaphore:
                 try:
-                    async with session.get(
-                        f"{REPORT_PARSER_BASE_URL}/api/parse/ext",
-                        params={"url": url},
-                        timeout=aiohttp.ClientTimeout(total=20),
-                    ) as response:
-                        if response.status != 200:
-                            raise RuntimeError(f"status={response.status}")
-                        payload = await response.json()
-                        data = payload.get("data")
-                        if not isinstance(data, dict):
-                            logger.warning("Unexpected payload while parsing %s: %s", url, payload)
-                            parsed[url] = None
-                            continue
-                        filtered = {k: v for k, v in data.items() if k in allowed_keys}
-                        parsed[url] = PropertyData(**filtered)
+                    property_data = await asyncio.wait_for(
+                        realty_parser.parse_property_extended(url),
+                        timeout=REPORT_PARSER_TIMEOUT,
+                    )
                 except Exception as exc:  # noqa: BLE001
-                    logger.warning("Failed to parse %s via API: %s", url, exc)
-                    parsed[url] = None
-        return parsed
+                    logger.warning("Failed to parse %s: %s", url, exc)
+                    return url, None
+            if property_data is None:
+                logger.warning("Parser returned no data for %s", url)
+            return url, property_data
+
+        results = await asyncio.gather(*(_parse_one(url) for url in targets))
+        return dict(results)
 
     def _apply_property_data(
         self, cursor: RealDictCursor, meta: AdsTableMeta, ad_id: int, property_data: PropertyData
@@ -535,18 +582,17 @@ class ReportPipeline:
         if not rows:
             return
         meta = PublicHistoryMeta(cursor)
+        snapshots: List[Dict[str, Any]] = []
+        timestamps: List[datetime] = []
         for row in rows:
             snapshot = dict(row)
             status_value = row.get("status")
             if status_value is None:
                 status_value = row.get("is_actual")
             snapshot["status"] = status_value
-            sync_ad_to_public_history(
-                cursor,
-                snapshot,
-                meta=meta,
-                timestamp=row.get("updated_at") or datetime.utcnow(),
-            )
+            snapshots.append(snapshot)
+            timestamps.append(row.get("updated_at") or datetime.utcnow())
+        sync_ads_to_public_history(cursor, snapshots, meta=meta, timestamps=timestamps)
 
     @staticmethod
     def _to_decimal(value: Any) -> Optional[Decimal]:
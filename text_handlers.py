@@ -1,11 +1,12 @@
 # text_handlers.py
 from aiogram.types import Message, BufferedInputFile
-from listings_processor import listings_processor, export_listings_to_excel, extract_urls
+from listings_processor import listings_processor, export_listings_to_excel, log_url_sources
+from message_tokenizer import tokenize_message
 from db_handler import find_similar_ads_grouped, get_web_domain
 import io
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font
+import json
+from excel_report import ExcelReportWriter, THOUSANDS_FORMAT
+from progress_reporter import ProgressReporter
 
 # Функции для форматирования данных
 def format_date(date_value):
@@ -47,6 +48,56 @@ def format_boolean(bool_value):
     # Все остальное - пусто
     return ""
 
+# Заголовки колонок файла похожих объявлений
+SIMILAR_ADS_HEADERS = ['URL', 'Цена', 'Комнат', 'Создано', 'Обновлено', 'Активно', 'Тип продавца']
+
+def _similar_ads_list(ads):
+    """ads группы из users.find_similar_ads_grouped: список или JSON-строка"""
+    if isinstance(ads, list):
+        return ads
+    if isinstance(ads, str):
+        try:
+            ads_list = json.loads(ads)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Ошибка парсинга JSON: {e}")
+            return None
+        if isinstance(ads_list, list):
+            return ads_list
+        print(f"⚠️ ads после парсинга не является списком: {type(ads_list)}")
+        return None
+    print(f"⚠️ ads не является списком или строкой: {type(ads)}")
+    return None
+
+def build_similar_ads_excel(similar_ads) -> tuple[io.BytesIO, int]:
+    """
+    Excel с похожими объявлениями, сгруппированными по адресам: жирный адрес,
+    жирные заголовки, объявления, пустая строка между группами.
+    Возвращает (файл, число объявлений).
+    """
+    writer = ExcelReportWriter("Похожие объявления")
+    ads_count = 0
+    for group in similar_ads:
+        ads_list = _similar_ads_list(group['ads'])
+        if ads_list is None:
+            continue
+
+        writer.append_title(group['address'])
+        writer.append_header(SIMILAR_ADS_HEADERS)
+        for ad in ads_list:
+            if isinstance(ad, dict):
+                writer.append_row([
+                    ad.get('url', ''),
+                    ad.get('price', ''),
+                    ad.get('rooms', ''),
+                    format_date(ad.get('created', '')),
+                    format_date(ad.get('updated', '')),
+                    format_boolean(ad.get('is_active', '')),
+                    ad.get('person_type', ''),
+                ], {1: THOUSANDS_FORMAT})
+                ads_count += 1
+        writer.append_blank()
+    return writer.save(), ads_count
+
 def extract_listing_comments(text: str, urls: list[str]) -> list[str]:
     """
     Извлекает комментарии между ссылками для каждого объявления
@@ -56,57 +107,11 @@ def extract_listing_comments(text: str, urls: list[str]) -> list[str]:
     - Текст от второй до третьей ссылки - комментарий ко второму объявлению
     - И так далее
     """
-    import re
-    comments = []
-    
     if not urls:
-        return comments
-    
-    # Находим позиции всех ссылок в тексте
-    url_positions = []
-    for url in urls:
-        pos = text.find(url)
-        if pos != -1:
-            url_positions.append((pos, url))
-    
-    # Сортируем по позиции
-    url_positions.sort(key=lambda x: x[0])
-    
-    # Извлекаем комментарии для каждого объявления
-    for i in range(len(url_positions)):
-        current_pos, current_url = url_positions[i]
-        
-        if i == 0:
-            # Для первого объявления - комментарий после первой ссылки
-            # Ищем следующую ссылку или конец текста
-            if i + 1 < len(url_positions):
-                next_pos = url_positions[i + 1][0]
-                comment = text[current_pos + len(current_url):next_pos].strip()
-            else:
-                # Если это единственная ссылка, берем текст после неё
-                comment = text[current_pos + len(current_url):].strip()
-        else:
-            # Для остальных объявлений - текст между текущей и следующей ссылкой
-            if i + 1 < len(url_positions):
-                next_pos = url_positions[i + 1][0]
-                comment = text[current_pos + len(current_url):next_pos].strip()
-            else:
-                # Для последнего объявления - текст после последней ссылки
-                comment = text[current_pos + len(current_url):].strip()
-        
-        # Очищаем комментарий от лишних символов
-        comment = comment.replace("подбор", "").replace("подбор-", "").strip()
-        # Убираем цифры в начале комментария (ограничения фото)
-        comment = re.sub(r'^\d+\s*', '', comment).strip()
-        
-        # Добавляем комментарий
-        comments.append(comment)
-    
+        return []
+    comments = tokenize_message(text).comments[:len(urls)]
     # Дополняем пустыми комментариями до нужного количества
-    while len(comments) < len(urls):
-        comments.append("")
-    
-    return comments
+    return comments + [""] * (len(urls) - len(comments))
 
 async def handle_text_message(message: Message):
     text = message.text.strip()
@@ -125,9 +130,12 @@ async def handle_text_message(message: Message):
             await message.answer(f"🚪 Ваш личный кабинет: {cabinet_url}")
         return
 
-    is_selection_request = "подбор" in text.lower()
-    use_embedded = "подбор" in text.lower() and "подбор-" not in text.lower()  # "подбор" = встроенные, "подбор-" = обычные
-    urls, url_count = extract_urls(text)
+    # Один проход по тексту: ссылки, комментарии, подзаголовок, лимит фото, метро
+    tokens = tokenize_message(text)
+    is_selection_request = tokens.is_selection
+    use_embedded = tokens.use_embedded  # "подбор" = встроенные, "подбор-" = обычные
+    urls, url_count = tokens.urls, tokens.url_count
+    log_url_sources(urls)
     
     # Сразу отправляем подтверждение получения ссылок
     if url_count == 0:
@@ -139,84 +147,30 @@ async def handle_text_message(message: Message):
     
     await message.answer(f"✅ Принято ссылок: {url_count}")
     
-    # Извлекаем метро из первого URL для названий файлов
-    metro_info = "метро"
-    # Убираем избыточный вызов extract_listing_info - он будет выполнен в generate_html_gallery_embedded
-    if urls:
-        try:
-            # Простое извлечение метро из URL без полного парсинга
-            if 'tekstilshchiki' in urls[0].lower() or 'текстильщики' in urls[0].lower():
-                metro_info = "Текстильщики"
-            elif 'begovaya' in urls[0].lower() or 'беговая' in urls[0].lower():
-                metro_info = "Беговая"
-            # Добавьте другие популярные станции метро при необходимости
-        except Exception as e:
-            print(f"Ошибка при извлечении метро: {e}")
-            metro_info = "метро"
+    # Метро для названий файлов — по индексу станций (ссылки, затем текст до них)
+    metro_info = tokens.metro_hint or "метро"
 
     try:
         if is_selection_request:
-            subtitle = None
-            max_photos_per_listing = None  # Максимальное количество фото на объявление
-            listing_comments = []  # Комментарии к объявлениям
-            
-            if "подбор" in text.lower():
-                podbor_pos = text.lower().find("подбор")
-                
-                # Ищем цифру перед словом "подбор"
-                text_before_podbor = text[:podbor_pos].strip()
-                import re
-                
-                # Ищем цифру в начале текста перед "подбор" (например: "3 подбор")
-                print(f"🔍 DEBUG: Ищем ограничение фото в тексте: '{text_before_podbor}'")
-                photo_limit_match = re.search(r'^(\d+)\s*', text_before_podbor)
-                if photo_limit_match:
-                    max_photos_per_listing = int(photo_limit_match.group(1))
-                    print(f"🔢 Ограничение фото: {max_photos_per_listing} на объявление (найдено в начале)")
-                else:
-                    # Если не нашли в начале, ищем любую цифру перед "подбор"
-                    photo_limit_match = re.search(r'(\d+)\s*$', text_before_podbor)
-                    if photo_limit_match:
-                        max_photos_per_listing = int(photo_limit_match.group(1))
-                        print(f"🔢 Ограничение фото: {max_photos_per_listing} на объявление (найдено в конце)")
-                    else:
-                        print(f"🔍 DEBUG: Ограничение фото не найдено, будут загружены все доступные фото")
-                
-                text_after_podbor = text[podbor_pos + 6:].strip()
-                first_url_pos = -1
-                for url in urls:
-                    pos = text_after_podbor.find(url)
-                    if pos != -1:
-                        first_url_pos = pos
-                        break
-                if first_url_pos != -1:
-                    subtitle = text_after_podbor[:first_url_pos].strip()
-                else:
-                    subtitle = text_after_podbor
-                if subtitle:
-                    subtitle = subtitle.replace("подбор", "").replace("подбор-", "").strip()
-                
-                # Извлекаем комментарии между ссылками
-                listing_comments = extract_listing_comments(text, urls)
-                print(f"📝 Найдено комментариев к объявлениям: {len(listing_comments)}")
+            subtitle = tokens.subtitle
+            max_photos_per_listing = tokens.photo_limit  # Максимальное количество фото на объявление
+            listing_comments = tokens.comments  # Комментарии к объявлениям
+            if max_photos_per_listing:
+                print(f"🔢 Ограничение фото: {max_photos_per_listing} на объявление")
+            else:
+                print(f"🔍 DEBUG: Ограничение фото не найдено, будут загружены все доступные фото")
+            print(f"📝 Найдено комментариев к объявлениям: {len(listing_comments)}")
 
             if use_embedded:
-                html_content, photo_stats = await listings_processor.generate_html_gallery_embedded(urls, message.from_user.id, subtitle, remove_watermarks=True, max_photos_per_listing=max_photos_per_listing, listing_comments=listing_comments)
+                # Один статус с прогрессом по объявлениям вместо сообщения на каждое
+                progress = ProgressReporter(message, total=len(urls), photo_limit=max_photos_per_listing)
+                await progress.start()
+                try:
+                    html_content, photo_stats = await listings_processor.generate_html_gallery_embedded(urls, message.from_user.id, subtitle, remove_watermarks=True, max_photos_per_listing=max_photos_per_listing, listing_comments=listing_comments, progress=progress)
+                finally:
+                    await progress.finish()
                 filename = f"Подбор_{metro_info}.html"
                 caption = f"🏠 Подбор недвижимости"
-                
-                # Показываем статус загрузки фото для каждого объявления
-                if max_photos_per_listing:
-                    await message.answer(f"🔢 Ограничение: максимум {max_photos_per_listing} фото на объявление")
-                
-                for stat in photo_stats:
-                    if stat['photo_count'] > 0:
-                        await message.answer(f"📸 {stat['photo_count']} фото загружено из объявления {stat['listing_number']}")
-                    else:
-                        if 'error' in stat:
-                            await message.answer(f"❌ Ошибка при загрузке фото из объявления {stat['listing_number']}: {stat['error']}")
-                        else:
-                            await message.answer(f"⚠️ Фото не найдены в объявлении {stat['listing_number']}")
             else:
                 html_content = await listings_processor.generate_html_gallery(urls, message.from_user.id, subtitle, listing_comments, max_photos_per_listing)
                 filename = f"Подбор_{metro_info}.html"
@@ -236,115 +190,12 @@ async def handle_text_message(message: Message):
             try:
                 similar_ads = await find_similar_ads_grouped(request_id)
                 if similar_ads:
-                    # Создаем Excel файл с похожими объявлениями
-                    similar_excel = io.BytesIO()
-                    
-                    # Создаем DataFrame для похожих объявлений
-                    import pandas as pd
-                    import json
-                    similar_data = []
-                    for group in similar_ads:
-                        address = group['address']
-                        ads = group['ads']
-                        
-                        # Проверяем, что ads - это список, а не строка
-                        if isinstance(ads, list):
-                            ads_list = ads
-                        elif isinstance(ads, str):
-                            try:
-                                # Пытаемся распарсить JSON строку
-                                ads_list = json.loads(ads)
-                                if not isinstance(ads_list, list):
-                                    print(f"⚠️ ads после парсинга не является списком: {type(ads_list)}")
-                                    continue
-                            except json.JSONDecodeError as e:
-                                print(f"⚠️ Ошибка парсинга JSON: {e}")
-                                continue
-                        else:
-                            print(f"⚠️ ads не является списком или строкой: {type(ads)}")
-                            continue
-                        
-                        # Обрабатываем список объявлений
-                        for ad in ads_list:
-                            if isinstance(ad, dict):
-                                ad_copy = ad.copy()  # Создаем копию, чтобы не изменять оригинал
-                                ad_copy['Адрес'] = address
-                                
-                                # Форматируем даты и логические значения
-                                if 'created' in ad_copy:
-                                    ad_copy['created'] = format_date(ad_copy['created'])
-                                if 'updated' in ad_copy:
-                                    ad_copy['updated'] = format_date(ad_copy['updated'])
-                                if 'is_active' in ad_copy:
-                                    ad_copy['is_active'] = format_boolean(ad_copy['is_active'])
-                                
-                                similar_data.append(ad_copy)
-                    
-                    if similar_data:
-                        # Создаем Excel файл с группировкой по адресам
-                        wb = Workbook()
-                        ws = wb.active
-                        ws.title = "Похожие объявления"
-                        
-                        # Заголовки для объявлений
-                        headers = ['URL', 'Цена', 'Комнат', 'Создано', 'Обновлено', 'Активно', 'Тип продавца']
-                        header_row = 1
-                        
-                        # Группируем данные по адресам
-                        current_row = 1
-                        for group in similar_ads:
-                            address = group['address']
-                            ads = group['ads']
-                            
-                            # Парсим ads если это строка
-                            if isinstance(ads, str):
-                                try:
-                                    ads_list = json.loads(ads)
-                                except json.JSONDecodeError:
-                                    continue
-                            else:
-                                ads_list = ads
-                            
-                            if not isinstance(ads_list, list):
-                                continue
-                            
-                            # Добавляем адрес как заголовок (жирным шрифтом)
-                            ws.cell(row=current_row, column=1, value=address)
-                            ws.cell(row=current_row, column=1).font = Font(bold=True)
-                            current_row += 1
-                            
-                            # Добавляем заголовки колонок
-                            for col, header in enumerate(headers, 1):
-                                ws.cell(row=current_row, column=col, value=header)
-                                ws.cell(row=current_row, column=col).font = Font(bold=True)
-                            current_row += 1
-                            
-                            # Добавляем объявления
-                            for ad in ads_list:
-                                if isinstance(ad, dict):
-                                    ws.cell(row=current_row, column=1, value=ad.get('url', ''))
-                                    ws.cell(row=current_row, column=2, value=ad.get('price', ''))
-                                    ws.cell(row=current_row, column=3, value=ad.get('rooms', ''))
-                                    # Форматируем даты
-                                    ws.cell(row=current_row, column=4, value=format_date(ad.get('created', '')))
-                                    ws.cell(row=current_row, column=5, value=format_date(ad.get('updated', '')))
-                                    # Форматируем логическое значение
-                                    ws.cell(row=current_row, column=6, value=format_boolean(ad.get('is_active', '')))
-                                    ws.cell(row=current_row, column=7, value=ad.get('person_type', ''))
-                                    current_row += 1
-                            
-                            # Добавляем пустую строку между группами
-                            current_row += 1
-                        
-                        # Сохраняем в BytesIO
-                        similar_excel = io.BytesIO()
-                        wb.save(similar_excel)
-                        similar_excel.seek(0)
-                        
+                    similar_excel, similar_count = build_similar_ads_excel(similar_ads)
+                    if similar_count:
                         similar_filename = f"похожие_объявления_{metro_info}.xlsx"
                         similar_input_file = BufferedInputFile(similar_excel.getvalue(), filename=similar_filename)
                         await message.answer_document(similar_input_file, caption=f"🔍 Похожие объявления")
-                        print(f"✅ Создан Excel с {len(similar_data)} похожими объявлениями")
+                        print(f"✅ Создан Excel с {similar_count} похожими объявлениями")
                     else:
                         print("⚠️ Нет данных для создания Excel с похожими объявлениями")
             except Exception as e: